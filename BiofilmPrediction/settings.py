@@ -70,6 +70,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'BiofilmPrediction.wsgi.application'
 
+ASGI_APPLICATION = 'BiofilmPrediction.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
@@ -119,3 +121,114 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Biofilm inhibitory peptide prediction
+
+# Versioned model artifacts, see apis/registry.py. Server processes poll the
+# registry's CURRENT file every BIP_MODEL_POLL_SECONDS and hot-swap new versions.
+BIP_MODEL_DIR = os.path.join(BASE_DIR, 'apis', 'model_registry')
+
+BIP_MODEL_POLL_SECONDS = 5
+
+# Memory-map registry models read-only so worker processes share their arrays.
+BIP_MODEL_MMAP_MODE = 'r'
+
+# Served as version BIP_MODEL_VERSION while BIP_MODEL_DIR holds no version.
+BIP_MODEL_PATH = os.path.join(BASE_DIR, 'apis', 'SVMModel.joblib')
+
+BIP_MODEL_VERSION = '1'
+
+# Rows per INSERT when new predictions are written to the Peptide store.
+BIP_STORE_BATCH_SIZE = 500
+
+# Peptides featurized and predicted per chunk of a streamed (ndjson/csv) response.
+BIP_STREAM_CHUNK_SIZE = 256
+
+# /predict/upload reads the request body this many bytes at a time and
+# predicts every BIP_STREAM_CHUNK_SIZE peptides as soon as they are parsed.
+BIP_UPLOAD_BLOCK_SIZE = 64 * 1024
+
+# Executor for featurization and prediction in the async views: 'thread',
+# 'process', or 'auto' to let apis/planner.py pick inline, thread or process
+# execution and the chunk size per request. None lets concurrent.futures size
+# the pool from the CPU count.
+BIP_EXECUTOR = 'auto'
+
+BIP_EXECUTOR_WORKERS = None
+
+# Batches of more than BIP_PREDICT_CHUNK_ROWS peptides are predicted in chunks
+# of that size on BIP_PREDICT_WORKERS threads (None: one per CPU), in order.
+BIP_PREDICT_CHUNK_ROWS = 2048
+
+BIP_PREDICT_WORKERS = None
+
+# Keep DPC features in a CSR matrix through to the SVM instead of building a
+# dense DataFrame (see apis/sparse.py); the predictions are the same.
+BIP_SPARSE_FEATURES = False
+
+# Build feature matrices as 'float32' instead of float64 (None) to halve their
+# memory; check with apis/parity.py that the model's labels do not change.
+BIP_FEATURE_DTYPE = None
+
+# Coalesce concurrent single-peptide predictions into one model call, waiting
+# at most BIP_BATCH_MAX_WAIT_MS for up to BIP_BATCH_MAX_SIZE peptides.
+BIP_MICRO_BATCHING = True
+
+BIP_BATCH_MAX_WAIT_MS = 5
+
+BIP_BATCH_MAX_SIZE = 64
+
+# Admission control, see apis/admission.py. Requests cost their total number of
+# residues; at most BIP_ADMISSION_CAPACITY residues are featurized at once and
+# up to BIP_ADMISSION_MAX_QUEUE requests wait BIP_ADMISSION_TIMEOUT seconds for
+# capacity before being answered with 429 and Retry-After.
+BIP_ADMISSION_CAPACITY = 20000
+
+BIP_ADMISSION_MAX_QUEUE = 32
+
+BIP_ADMISSION_TIMEOUT = 10
+
+# Requests costing more residues than this become background jobs (202 and
+# /jobs/<id>). At most BIP_JOB_QUEUE_SIZE jobs wait; the results of the last
+# BIP_JOB_RESULTS_KEPT finished jobs are kept in memory.
+BIP_ADMISSION_JOB_COST = 10000
+
+BIP_JOB_QUEUE_SIZE = 16
+
+BIP_JOB_RESULTS_KEPT = 256
+
+# /mutants scores 19 single-point mutants per residue, so its cost grows with
+# the square of the peptide length; longer peptides are rejected.
+BIP_MUTANTS_MAX_LENGTH = 100
+
+# Whole prediction responses are cached under a hash of the normalized request
+# and model version, which is also sent as their ETag. The local-memory cache
+# evicts least recently used responses beyond MAX_ENTRIES; use a FileBasedCache
+# to share it between worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'predictions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bip-predictions',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+BIP_RESPONSE_CACHE = 'predictions'
+
+# Seconds a cached response is kept; None keeps it until it is evicted.
+BIP_RESPONSE_CACHE_TIMEOUT = None
+
+# Nearest training peptides (/neighbours), see apis/neighbours.py. The index is
+# built from BIP_TRAINING_FILE and saved to BIP_NEIGHBOUR_INDEX if missing.
+BIP_TRAINING_FILE = os.path.join(BASE_DIR, 'apis', 'new_all_feature_train2_pydpi.csv')
+
+BIP_NEIGHBOUR_INDEX = os.path.join(BASE_DIR, 'apis', 'neighbours.npz')
+
+BIP_NEIGHBOURS = 5
+
+BIP_NEIGHBOURS_MAX = 50
@@ -21,5 +21,13 @@ urlpatterns = [
     # path('admin/', admin.site.urls),
     path('', views.index),
     path('car', views.add_car),
+    path('predict', views.predict),
+    path('predict/async', views.predict_async),
+    path('predict/upload', views.predict_upload),
+    path('scan', views.scan),
+    path('mutants', views.mutants),
+    path('neighbours', views.neighbours),
+    path('metrics', views.metrics),
+    path('jobs/<str:job_id>', views.job),
     path('<str:car_name>', views.get_car),
 ]
@@ -36,8 +36,6 @@ Email: oriental-cds@163.com
 ###############################################################################
 """
 
-import re
-
 AALetter=["A","R","N","D","C","E","Q","G","H","I","L","K","M","F","P","S","T","W","Y","V"]
 #############################################################################################
 def CalculateAAComposition(ProteinSequence):
@@ -132,6 +130,8 @@ def GetSpectrumDict(proteinsequence):
 	3-mers.
 	########################################################################
 	"""
+	import re
+
 	result={}
 	kmers=Getkmers()
 	for i in kmers:
@@ -166,36 +166,28 @@ def CalculateAADipeptideComposition(ProteinSequence):
 
 	return result
 
-def CalculateAAC4All(input_file_path, output_file_path = ""):
-	with open(output_file_path, 'w') as f:
-		pass
-
-	lines = []
-	with open(input_file_path) as f:
-		lines = f.readlines()
-
-	keys = list(CalculateAAComposition("AD"))
-	# with open(output_file_path, 'a') as f:
-	# 	keys = list(CalculateAAComposition("AD"))
-	# 	f.write("seq,")
-	# 	f.write(str(keys).replace("[","").replace("]","") + ",\n")
-
-	output_results = []
-	for pep in lines:
-		caledCTD = CalculateAAComposition(pep)
-		results = str(pep.split('\n')[0] + ",")
-		for key in keys:
-			results = results + str(caledCTD.get(key))+","
-		results = results + "\n"
-		output_results.append(results)
-
-	if output_file_path != "":
-		with open(output_file_path, 'w') as f:
-			f.write("seq,")
-			f.write(str(keys).replace("[","").replace("]","").replace("'","").replace("_","") + ",\n")
-			f.writelines(output_results)
-	else:
-		return output_results
+def CalculateAAC4All(input_file_path, output_file_path = "", precision = 3, compress = None, shard = None, manifest_file_path = "", resume = False, profiler = None):
+	"""
+	########################################################################
+	Write the AAC features of every sequence in a file to a CSV file.
+
+	Usage:
+
+	CalculateAAC4All(input_file_path, output_file_path, precision=3, compress=None, shard=None, manifest_file_path="", resume=False, profiler=None)
+
+	See csvwriter.featurize_file for the arguments.
+
+	Output: the formatted lines when output_file_path is empty.
+	########################################################################
+	"""
+	try:
+		from apis import csvwriter
+	except ImportError:
+		import csvwriter
+
+	return csvwriter.featurize_file(input_file_path, output_file_path, (1,), precision, compress,
+		shard=shard, manifest_file_path=manifest_file_path, resume=resume,
+		profiler=profiler or csvwriter.profiling.NULL)
 
 #############################################################################################
 if __name__=="__main__":
@@ -36,7 +36,7 @@ Email: oriental-cds@163.com
 '''
 
 
-import string, math, copy
+import math, copy
 
 
 AALetter=["A","R","N","D","C","E","Q","G","H","I","L","K","M","F","P","S","T","W","Y","V"]
@@ -130,6 +130,12 @@ _AATPropertyName=('_Hydrophobicity','_NormalizedVDWV','_Polarity','_Charge','_Se
 '_PRNAIPropPhipps','_PLBSPropKhazanov','_PLVBSKhazanov','_PropPLPANBIntImai','_MolecularWeight','_cLogP','_NoHydroBondDonorSideChain',\
 '_NoHydroBondAccSideChain','_SolubilityInWater','_AminoAcidFlexInd')
 
+# Order of the properties in the output of CalculateCTD (and in the training file).
+_CTDPropertyOrder=('_Polarizability','_SolventAccessibility','_SecondaryStr','_Charge','_Polarity','_NormalizedVDWV','_Hydrophobicity',\
+'_SurfaceTension','_PPIHotspotPropBogan','_PPIPropMa','_PDNAIPropSchneider','_PDNAIPropAhmad','_PRNAIPropKim','_PRNAIPropEllis',\
+'_PRNAIPropPhipps','_PLBSPropKhazanov','_PLVBSKhazanov','_PropPLPANBIntImai','_MolecularWeight','_cLogP','_NoHydroBondDonorSideChain',\
+'_NoHydroBondAccSideChain','_SolubilityInWater','_AminoAcidFlexInd')
+
 
 ##################################################################################################
 
@@ -403,78 +409,6 @@ def CalculateCompositionPolarizability(ProteinSequence):
 	result=CalculateComposition(ProteinSequence,_Polarizability,'_Polarizability')
 	return result
 
-def CalculateCompositionSurfaceTension(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_SurfaceTension,'_SurfaceTension')
-	return result
-
-def CalculateCompositionPPIHotspotPropBogan(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PPIHotspotPropBogan,'_PPIHotspotPropBogan')
-	return result
-
-def CalculateCompositionPPIPropMa(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PPIPropMa,'_PPIPropMa')
-	return result
-
-def CalculateCompositionPDNAIPropSchneider(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PDNAIPropSchneider,'_PDNAIPropSchneider')
-	return result
-
-def CalculateCompositionPDNAIPropAhmad(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PDNAIPropAhmad,'_PDNAIPropAhmad')
-	return result
-
-def CalculateCompositionPRNAIPropKim(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PRNAIPropKim,'_PRNAIPropKim')
-	return result
-
-def CalculateCompositionPRNAIPropEllis(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PRNAIPropEllis,'_PRNAIPropEllis')
-	return result
-
-def CalculateCompositionPRNAIPropPhipps(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PRNAIPropPhipps,'_PRNAIPropPhipps')
-	return result
-
-def CalculateCompositionPRNAIPropPhipps(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PRNAIPropPhipps,'_PRNAIPropPhipps')
-	return result
-
-def CalculateCompositionPLBSPropKhazanov(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PLBSPropKhazanov,'_PLBSPropKhazanov')
-	return result
-
-def CalculateCompositionPLVBSKhazanov(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PLVBSKhazanov,'_PLVBSKhazanov')
-	return result
-
-def CalculateCompositionPropPLPANBIntImai(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_PropPLPANBIntImai,'_PropPLPANBIntImai')
-	return result
-
-def CalculateCompositionMolecularWeight(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_MolecularWeight,'_MolecularWeight')
-	return result
-
-def CalculateCompositioncLogP(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_cLogP,'_cLogP')
-	return result
-
-def CalculateCompositionNoHydroBondDonorSideChain(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_NoHydroBondDonorSideChain,'_NoHydroBondDonorSideChain')
-	return result
-
-def CalculateCompositionNoHydroBondAccSideChain(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_NoHydroBondAccSideChain,'_NoHydroBondAccSideChain')
-	return result
-
-def CalculateCompositionSolubilityInWater(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_SolubilityInWater,'_SolubilityInWater')
-	return result
-
-def CalculateCompositionAminoAcidFlexInd(ProteinSequence):
-	result=CalculateComposition(ProteinSequence,_AminoAcidFlexInd,'_AminoAcidFlexInd')
-	return result
-
 ##################################################################################################
 
 
@@ -619,78 +553,6 @@ def CalculateTransitionPolarizability(ProteinSequence):
 	result=CalculateTransition(ProteinSequence,_Polarizability,'_Polarizability')
 	return result
 
-def CalculateTransitionSurfaceTension(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_SurfaceTension,'_SurfaceTension')
-	return result
-
-def CalculateTransitionPPIHotspotPropBogan(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PPIHotspotPropBogan,'_PPIHotspotPropBogan')
-	return result
-
-def CalculateTransitionPPIPropMa(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PPIPropMa,'_PPIPropMa')
-	return result
-
-def CalculateTransitionPDNAIPropSchneider(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PDNAIPropSchneider,'_PDNAIPropSchneider')
-	return result
-
-def CalculateTransitionPDNAIPropAhmad(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PDNAIPropAhmad,'_PDNAIPropAhmad')
-	return result
-
-def CalculateTransitionPRNAIPropKim(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PRNAIPropKim,'_PRNAIPropKim')
-	return result
-
-def CalculateTransitionPRNAIPropEllis(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PRNAIPropEllis,'_PRNAIPropEllis')
-	return result
-
-def CalculateTransitionPRNAIPropPhipps(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PRNAIPropPhipps,'_PRNAIPropPhipps')
-	return result
-
-def CalculateTransitionPRNAIPropPhipps(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PRNAIPropPhipps,'_PRNAIPropPhipps')
-	return result
-
-def CalculateTransitionPLBSPropKhazanov(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PLBSPropKhazanov,'_PLBSPropKhazanov')
-	return result
-
-def CalculateTransitionPLVBSKhazanov(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PLVBSKhazanov,'_PLVBSKhazanov')
-	return result
-
-def CalculateTransitionPropPLPANBIntImai(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_PropPLPANBIntImai,'_PropPLPANBIntImai')
-	return result
-
-def CalculateTransitionMolecularWeight(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_MolecularWeight,'_MolecularWeight')
-	return result
-
-def CalculateTransitioncLogP(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_cLogP,'_cLogP')
-	return result
-
-def CalculateTransitionNoHydroBondDonorSideChain(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_NoHydroBondDonorSideChain,'_NoHydroBondDonorSideChain')
-	return result
-
-def CalculateTransitionNoHydroBondAccSideChain(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_NoHydroBondAccSideChain,'_NoHydroBondAccSideChain')
-	return result
-
-def CalculateTransitionSolubilityInWater(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_SolubilityInWater,'_SolubilityInWater')
-	return result
-
-def CalculateTransitionAminoAcidFlexInd(ProteinSequence):
-	result=CalculateTransition(ProteinSequence,_AminoAcidFlexInd,'_AminoAcidFlexInd')
-	return result
-
 ##################################################################################################
 ##################################################################################################
 def CalculateDistributionHydrophobicity(ProteinSequence):
@@ -834,80 +696,28 @@ def CalculateDistributionPolarizability(ProteinSequence):
 	result=CalculateDistribution(ProteinSequence,_Polarizability,'_Polarizability')
 	return result
 
-def CalculateDistributionSurfaceTension(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_SurfaceTension,'_SurfaceTension')
-	return result
-
-def CalculateDistributionPPIHotspotPropBogan(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PPIHotspotPropBogan,'_PPIHotspotPropBogan')
-	return result
-
-def CalculateDistributionPPIPropMa(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PPIPropMa,'_PPIPropMa')
-	return result
-
-def CalculateDistributionPDNAIPropSchneider(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PDNAIPropSchneider,'_PDNAIPropSchneider')
-	return result
-
-def CalculateDistributionPDNAIPropAhmad(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PDNAIPropAhmad,'_PDNAIPropAhmad')
-	return result
-
-def CalculateDistributionPRNAIPropKim(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PRNAIPropKim,'_PRNAIPropKim')
-	return result
-
-def CalculateDistributionPRNAIPropEllis(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PRNAIPropEllis,'_PRNAIPropEllis')
-	return result
-
-def CalculateDistributionPRNAIPropPhipps(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PRNAIPropPhipps,'_PRNAIPropPhipps')
-	return result
-
-def CalculateDistributionPRNAIPropPhipps(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PRNAIPropPhipps,'_PRNAIPropPhipps')
-	return result
-
-def CalculateDistributionPLBSPropKhazanov(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PLBSPropKhazanov,'_PLBSPropKhazanov')
-	return result
-
-def CalculateDistributionPLVBSKhazanov(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PLVBSKhazanov,'_PLVBSKhazanov')
-	return result
-
-def CalculateDistributionPropPLPANBIntImai(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_PropPLPANBIntImai,'_PropPLPANBIntImai')
-	return result
-
-def CalculateDistributionMolecularWeight(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_MolecularWeight,'_MolecularWeight')
-	return result
-
-def CalculateDistributioncLogP(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_cLogP,'_cLogP')
-	return result
-
-def CalculateDistributionNoHydroBondDonorSideChain(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_NoHydroBondDonorSideChain,'_NoHydroBondDonorSideChain')
-	return result
-
-def CalculateDistributionNoHydroBondAccSideChain(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_NoHydroBondAccSideChain,'_NoHydroBondAccSideChain')
-	return result
-
-def CalculateDistributionSolubilityInWater(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_SolubilityInWater,'_SolubilityInWater')
-	return result
-
-def CalculateDistributionAminoAcidFlexInd(ProteinSequence):
-	result=CalculateDistribution(ProteinSequence,_AminoAcidFlexInd,'_AminoAcidFlexInd')
-	return result
-
 ##################################################################################################
 
+def __getattr__(name):
+	"""
+	###############################################################################################
+	Build the per-property wrappers of the properties listed in _AATPropertyName on first use,
+	e.g. CalculateCompositionSurfaceTension or CalculateDistributioncLogP, instead of defining
+	all of them when the module is imported.
+	###############################################################################################
+	"""
+	for Step,CalculateStep in (('Composition',CalculateComposition),('Transition',CalculateTransition),('Distribution',CalculateDistribution)):
+		AAPName='_'+name[len('Calculate'+Step):]
+		if name.startswith('Calculate'+Step) and AAPName in _AATPropertyName:
+			AAProperty=globals()[AAPName]
+			def wrapper(ProteinSequence):
+				return CalculateStep(ProteinSequence,AAProperty,AAPName)
+			wrapper.__name__=name
+			wrapper.__doc__="Calculate the %s descriptors based on %s of AADs." % (Step,AAPName[1:])
+			globals()[name]=wrapper
+			return wrapper
+	raise AttributeError("module %r has no attribute %r" % (__name__,name))
+
 def CalculateC(ProteinSequence):
 	"""
 	###############################################################################################
@@ -996,84 +806,9 @@ def CalculateCTD(ProteinSequence, output_file_path=''):
 	###############################################################################################
 	"""
 	result={}
-	## Calculate Composition
-	result.update(CalculateCompositionPolarizability(ProteinSequence))
-	result.update(CalculateCompositionSolventAccessibility(ProteinSequence))
-	result.update(CalculateCompositionSecondaryStr(ProteinSequence))
-	result.update(CalculateCompositionCharge(ProteinSequence))
-	result.update(CalculateCompositionPolarity(ProteinSequence))
-	result.update(CalculateCompositionNormalizedVDWV(ProteinSequence))
-	result.update(CalculateCompositionHydrophobicity(ProteinSequence))
-	result.update(CalculateCompositionSurfaceTension(ProteinSequence))
-	result.update(CalculateCompositionPPIHotspotPropBogan(ProteinSequence))
-	result.update(CalculateCompositionPPIPropMa(ProteinSequence))
-	result.update(CalculateCompositionPDNAIPropSchneider(ProteinSequence))
-	result.update(CalculateCompositionPDNAIPropAhmad(ProteinSequence))
-	result.update(CalculateCompositionPRNAIPropKim(ProteinSequence))
-	result.update(CalculateCompositionPRNAIPropEllis(ProteinSequence))
-	result.update(CalculateCompositionPRNAIPropPhipps(ProteinSequence))
-	result.update(CalculateCompositionPLBSPropKhazanov(ProteinSequence))
-	result.update(CalculateCompositionPLVBSKhazanov(ProteinSequence))
-	result.update(CalculateCompositionPropPLPANBIntImai(ProteinSequence))
-	result.update(CalculateCompositionMolecularWeight(ProteinSequence))
-	result.update(CalculateCompositioncLogP(ProteinSequence))
-	result.update(CalculateCompositionNoHydroBondDonorSideChain(ProteinSequence))
-	result.update(CalculateCompositionNoHydroBondAccSideChain(ProteinSequence))
-	result.update(CalculateCompositionSolubilityInWater(ProteinSequence))
-	result.update(CalculateCompositionAminoAcidFlexInd(ProteinSequence))
-
-	## Calculate Transition
-	result.update(CalculateTransitionPolarizability(ProteinSequence))
-	result.update(CalculateTransitionSolventAccessibility(ProteinSequence))
-	result.update(CalculateTransitionSecondaryStr(ProteinSequence))
-	result.update(CalculateTransitionCharge(ProteinSequence))
-	result.update(CalculateTransitionPolarity(ProteinSequence))
-	result.update(CalculateTransitionNormalizedVDWV(ProteinSequence))
-	result.update(CalculateTransitionHydrophobicity(ProteinSequence))
-	result.update(CalculateTransitionSurfaceTension(ProteinSequence))
-	result.update(CalculateTransitionPPIHotspotPropBogan(ProteinSequence))
-	result.update(CalculateTransitionPPIPropMa(ProteinSequence))
-	result.update(CalculateTransitionPDNAIPropSchneider(ProteinSequence))
-	result.update(CalculateTransitionPDNAIPropAhmad(ProteinSequence))
-	result.update(CalculateTransitionPRNAIPropKim(ProteinSequence))
-	result.update(CalculateTransitionPRNAIPropEllis(ProteinSequence))
-	result.update(CalculateTransitionPRNAIPropPhipps(ProteinSequence))
-	result.update(CalculateTransitionPLBSPropKhazanov(ProteinSequence))
-	result.update(CalculateTransitionPLVBSKhazanov(ProteinSequence))
-	result.update(CalculateTransitionPropPLPANBIntImai(ProteinSequence))
-	result.update(CalculateTransitionMolecularWeight(ProteinSequence))
-	result.update(CalculateTransitioncLogP(ProteinSequence))
-	result.update(CalculateTransitionNoHydroBondDonorSideChain(ProteinSequence))
-	result.update(CalculateTransitionNoHydroBondAccSideChain(ProteinSequence))
-	result.update(CalculateTransitionSolubilityInWater(ProteinSequence))
-	result.update(CalculateTransitionAminoAcidFlexInd(ProteinSequence))
-
-	## Calculate Distribution
-	result.update(CalculateDistributionPolarizability(ProteinSequence))
-	result.update(CalculateDistributionSolventAccessibility(ProteinSequence))
-	result.update(CalculateDistributionSecondaryStr(ProteinSequence))
-	result.update(CalculateDistributionCharge(ProteinSequence))
-	result.update(CalculateDistributionPolarity(ProteinSequence))
-	result.update(CalculateDistributionNormalizedVDWV(ProteinSequence))
-	result.update(CalculateDistributionHydrophobicity(ProteinSequence))
-	result.update(CalculateDistributionSurfaceTension(ProteinSequence))
-	result.update(CalculateDistributionPPIHotspotPropBogan(ProteinSequence))
-	result.update(CalculateDistributionPPIPropMa(ProteinSequence))
-	result.update(CalculateDistributionPDNAIPropSchneider(ProteinSequence))
-	result.update(CalculateDistributionPDNAIPropAhmad(ProteinSequence))
-	result.update(CalculateDistributionPRNAIPropKim(ProteinSequence))
-	result.update(CalculateDistributionPRNAIPropEllis(ProteinSequence))
-	result.update(CalculateDistributionPRNAIPropPhipps(ProteinSequence))
-	result.update(CalculateDistributionPLBSPropKhazanov(ProteinSequence))
-	result.update(CalculateDistributionPLVBSKhazanov(ProteinSequence))
-	result.update(CalculateDistributionPropPLPANBIntImai(ProteinSequence))
-	result.update(CalculateDistributionMolecularWeight(ProteinSequence))
-	result.update(CalculateDistributioncLogP(ProteinSequence))
-	result.update(CalculateDistributionNoHydroBondDonorSideChain(ProteinSequence))
-	result.update(CalculateDistributionNoHydroBondAccSideChain(ProteinSequence))
-	result.update(CalculateDistributionSolubilityInWater(ProteinSequence))
-	result.update(CalculateDistributionAminoAcidFlexInd(ProteinSequence))
-
+	for CalculateStep in (CalculateComposition,CalculateTransition,CalculateDistribution):
+		for AAPName in _CTDPropertyOrder:
+			result.update(CalculateStep(ProteinSequence,globals()[AAPName],AAPName))
 
 	if len(output_file_path)>0:
 		with open(output_file_path, 'w') as f:
@@ -1082,37 +817,28 @@ def CalculateCTD(ProteinSequence, output_file_path=''):
 	return result
 ##################################################################################################
 
-def CalculateCTD4All(input_file_path, output_file_path = ""):
-	with open(output_file_path, 'w') as f:
-		pass
-
-	lines = []
-	with open(input_file_path) as f:
-		lines = f.readlines()
-
-	keys = list(CalculateCTD("AD"))
-	# with open(output_file_path, 'a') as f:
-	# 	keys = list(CalculateCTD("AD"))
-	# 	f.write("seq,")
-	# 	f.write(str(keys).replace("[","").replace("]","") + ",\n")
-
-	# print(lines[0])
-	output_results = []
-	for pep in lines:
-		caledCTD = CalculateCTD(pep)
-		results = str(pep.split('\n')[0] + ",")
-		for key in keys:
-			results = results + str(caledCTD.get(key))+","
-		results = results + "\n"
-		output_results.append(results)
-
-	if output_file_path != "":
-		with open(output_file_path, 'w') as f:
-			f.write("seq,")
-			f.write(str(keys).replace("[","").replace("]","").replace("'","").replace("_","") + ",\n")
-			f.writelines(output_results)
-	else:
-		return output_results
+def CalculateCTD4All(input_file_path, output_file_path = "", precision = 3, compress = None, shard = None, manifest_file_path = "", resume = False, profiler = None):
+	"""
+	########################################################################
+	Write the CTD features of every sequence in a file to a CSV file.
+
+	Usage:
+
+	CalculateCTD4All(input_file_path, output_file_path, precision=3, compress=None, shard=None, manifest_file_path="", resume=False, profiler=None)
+
+	See csvwriter.featurize_file for the arguments.
+
+	Output: the formatted lines when output_file_path is empty.
+	########################################################################
+	"""
+	try:
+		from apis import csvwriter
+	except ImportError:
+		import csvwriter
+
+	return csvwriter.featurize_file(input_file_path, output_file_path, (3,), precision, compress,
+		shard=shard, manifest_file_path=manifest_file_path, resume=resume,
+		profiler=profiler or csvwriter.profiling.NULL)
 
 
 
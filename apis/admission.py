@@ -0,0 +1,237 @@
+"""Admission control for the prediction endpoints.
+
+Every request is costed by the residues it asks the server to featurize
+(peptide count x mean length, i.e. the total sequence length). A request is
+admitted while the cost in flight stays within ``capacity``, otherwise it
+waits in a bounded queue for at most ``timeout`` seconds. When the queue is
+full or the wait times out, ``Overloaded`` is raised with a ``retry_after``
+estimated from the recent throughput, and the views answer 429.
+
+Requests costing more than ``BIP_ADMISSION_JOB_COST`` are not served inline:
+they become jobs on a bounded ``JobQueue`` worked off by a single background
+thread, chunk by chunk through the same controller, so a few huge batches
+cannot take all the capacity away from single-peptide requests.
+"""
+import collections
+import itertools
+import math
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+THROUGHPUT_WINDOW = 10.0
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def request_cost(sequences):
+    return sum(len(seq) for seq in sequences)
+
+
+class Ticket:
+    """Capacity held by one admitted request; release it exactly once, or use it as a context manager."""
+
+    def __init__(self, controller, cost):
+        self.controller = controller
+        self.cost = cost
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self.cost)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    def __init__(self, capacity, max_queue=32, timeout=10.0):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._in_flight_cost = 0
+        self._queued = 0
+        self._queued_cost = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._max_queued = 0
+        self._completed = collections.deque()
+
+    def _fits(self, cost):
+        # An idle server always takes the next request, however large.
+        return self._in_flight == 0 or self._in_flight_cost + cost <= self.capacity
+
+    def retry_after(self, cost=0):
+        """Seconds until the work ahead of a new request of ``cost`` should be done."""
+        with self._condition:
+            backlog = self._in_flight_cost + self._queued_cost + cost
+            rate = self._throughput()
+        if not rate:
+            return 1
+        return max(1, min(60, int(math.ceil(backlog / rate))))
+
+    def _throughput(self):
+        now = time.monotonic()
+        while self._completed and now - self._completed[0][0] > THROUGHPUT_WINDOW:
+            self._completed.popleft()
+        if not self._completed:
+            return 0.0
+        return sum(cost for _, cost in self._completed) / THROUGHPUT_WINDOW
+
+    def check(self, cost=1):
+        """Raise ``Overloaded`` if ``admit(cost)`` would turn a new request away right now.
+
+        Streamed responses call this before they start, as their chunks are
+        admitted later without the queue-length limit.
+        """
+        cost = min(cost, self.capacity)
+        with self._condition:
+            full = not self._fits(cost) and self._queued >= self.max_queue
+            if full:
+                self._rejected += 1
+        if full:
+            raise Overloaded("The server is busy, retry later", self.retry_after(cost))
+
+    def admit(self, cost, timeout=-1, bounded=True):
+        """Wait for capacity and return a ``Ticket``.
+
+        ``timeout=-1`` uses the controller's timeout and ``None`` waits
+        indefinitely. ``bounded=False`` skips the queue-length limit, for
+        work that was already accepted (job and stream chunks).
+        """
+        cost = min(cost, self.capacity)
+        if timeout == -1:
+            timeout = self.timeout
+        with self._condition:
+            admitted = self._fits(cost)
+            if not admitted and not (bounded and self._queued >= self.max_queue):
+                self._queued += 1
+                self._queued_cost += cost
+                self._max_queued = max(self._max_queued, self._queued)
+                try:
+                    admitted = self._condition.wait_for(lambda: self._fits(cost), timeout)
+                finally:
+                    self._queued -= 1
+                    self._queued_cost -= cost
+            if admitted:
+                self._in_flight += 1
+                self._in_flight_cost += cost
+                self._admitted += 1
+                return Ticket(self, cost)
+            self._rejected += 1
+        raise Overloaded("The server is busy, retry later", self.retry_after(cost))
+
+    def _release(self, cost):
+        with self._condition:
+            self._in_flight -= 1
+            self._in_flight_cost -= cost
+            self._completed.append((time.monotonic(), cost))
+            self._condition.notify_all()
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'in_flight': self._in_flight,
+                'in_flight_cost': self._in_flight_cost,
+                'queued': self._queued,
+                'queued_cost': self._queued_cost,
+                'max_queued': self._max_queued,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'residues_per_second': self._throughput(),
+                'config': {'capacity': self.capacity, 'max_queue': self.max_queue, 'timeout': self.timeout},
+            }
+
+
+class JobQueue:
+    """Bounded queue of oversized requests, run one at a time by a background thread."""
+
+    def __init__(self, max_jobs=16, keep=256):
+        self._queue = queue.Queue(maxsize=max_jobs)
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.keep = keep
+        self._thread = threading.Thread(target=self._run, name='bip-jobs', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        """Queue ``func(*args)`` and return its job id; raises ``Overloaded`` when the queue is full."""
+        with self._lock:
+            job_id = '%d-%d' % (int(time.time()), next(self._ids))
+            job = {'id': job_id, 'status': 'queued', 'result': None, 'error': None, 'submitted': time.time()}
+            try:
+                self._queue.put_nowait((job, func, args))
+            except queue.Full:
+                raise Overloaded("Too many queued jobs, retry later", 1 + self._queue.qsize())
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.keep:
+                oldest = next(iter(self._jobs.values()))
+                if oldest['status'] not in ('done', 'failed'):
+                    break
+                self._jobs.popitem(last=False)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _run(self):
+        while True:
+            job, func, args = self._queue.get()
+            job['status'] = 'running'
+            try:
+                job['result'] = func(*args)
+                job['status'] = 'done'
+            except Exception as e:
+                job['error'] = str(e)
+                job['status'] = 'failed'
+
+    def metrics(self):
+        with self._lock:
+            statuses = collections.Counter(job['status'] for job in self._jobs.values())
+        return {'queued': self._queue.qsize(), 'running': statuses['running'], 'done': statuses['done'],
+                'failed': statuses['failed'], 'config': {'max_jobs': self._queue.maxsize, 'keep': self.keep}}
+
+
+_controllers = {}
+_job_queues = {}
+_lock = threading.Lock()
+
+
+def get_controller():
+    """Return the process-wide controller configured by the Django settings."""
+    key = (settings.BIP_ADMISSION_CAPACITY, settings.BIP_ADMISSION_MAX_QUEUE, settings.BIP_ADMISSION_TIMEOUT)
+    with _lock:
+        if key not in _controllers:
+            _controllers[key] = AdmissionController(*key)
+        return _controllers[key]
+
+
+def get_job_queue():
+    key = (settings.BIP_JOB_QUEUE_SIZE, settings.BIP_JOB_RESULTS_KEPT)
+    with _lock:
+        if key not in _job_queues:
+            _job_queues[key] = JobQueue(*key)
+        return _job_queues[key]
+
+
+def admission_metrics():
+    with _lock:
+        controllers = list(_controllers.values())
+        job_queues = list(_job_queues.values())
+    return {'controllers': [controller.metrics() for controller in controllers],
+            'jobs': [job_queue.metrics() for job_queue in job_queues]}
@@ -0,0 +1,150 @@
+"""Coalesce concurrent single-peptide predictions into one model call.
+
+Requests are queued and a worker thread collects them for up to
+``max_wait_ms`` milliseconds or ``max_batch_size`` peptides, featurizes and
+predicts them as one matrix and hands every caller its own row back.
+A stopped batcher answers what was queued before it stopped, and predicts
+anything submitted afterwards directly in the caller's thread.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, predict_batch, max_wait_ms=5, max_batch_size=64):
+        """``predict_batch(sequences)`` must return ``(labels, scores)`` like ``predict_sequences``."""
+        self.predict_batch = predict_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._max_batch = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._stopped = False
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='bip-microbatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, sequence):
+        """Queue ``sequence``; the returned future resolves to ``(label, score)``."""
+        future = Future()
+        with self._submit_lock:
+            if not self._stopped:
+                self._queue.put((sequence, future, time.perf_counter()))
+                return future
+        try:
+            labels, scores = self.predict_batch([sequence])
+            future.set_result((labels[0], None if scores is None else scores[0]))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def stop(self):
+        """Let the worker thread finish the queued requests and exit."""
+        with self._submit_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(_STOP)
+
+    def predict(self, sequence, timeout=None):
+        return self.submit(sequence).result(timeout)
+
+    def metrics(self):
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                'batches': batches,
+                'requests': self._requests,
+                'mean_batch_size': self._requests / batches if batches else 0.0,
+                'max_batch_size': self._max_batch,
+                'mean_wait_ms': self._total_wait * 1000 / self._requests if self._requests else 0.0,
+                'max_wait_ms': self._max_wait_seen * 1000,
+                'queued': self._queue.qsize(),
+                'config': {'max_wait_ms': self.max_wait * 1000, 'max_batch_size': self.max_batch_size},
+            }
+
+    def _collect(self):
+        """The next batch, and whether the batcher was stopped behind it."""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._collect()
+            if not batch:
+                continue
+            dispatched = time.perf_counter()
+            waits = [dispatched - queued for _, _, queued in batch]
+            with self._stats_lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._max_batch = max(self._max_batch, len(batch))
+                self._total_wait += sum(waits)
+                self._max_wait_seen = max(self._max_wait_seen, max(waits))
+
+            try:
+                labels, scores = self.predict_batch([sequence for sequence, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            if scores is None:
+                scores = [None] * len(labels)
+            for (_, future, _), label, score in zip(batch, labels, scores):
+                future.set_result((label, score))
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(served):
+    """Return the process-wide batcher for the served ``registry.ModelVersion``."""
+    key = (served.path, settings.BIP_BATCH_MAX_WAIT_MS, settings.BIP_BATCH_MAX_SIZE)
+    with _batchers_lock:
+        if key not in _batchers:
+            _batchers[key] = MicroBatcher(served.predict_sequences,
+                                          max_wait_ms=settings.BIP_BATCH_MAX_WAIT_MS,
+                                          max_batch_size=settings.BIP_BATCH_MAX_SIZE)
+        return _batchers[key]
+
+
+def stop_batchers(path):
+    """Stop and drop the batchers of the model at ``path``, e.g. once a newer version is served."""
+    with _batchers_lock:
+        keys = [key for key in _batchers if key[0] == path]
+        batchers = [_batchers.pop(key) for key in keys]
+    for batcher in batchers:
+        batcher.stop()
+
+
+def batching_metrics():
+    with _batchers_lock:
+        batchers = list(_batchers.values())
+    return [batcher.metrics() for batcher in batchers]
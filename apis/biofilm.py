@@ -2,16 +2,39 @@ import sys, getopt
 
 def main(argv):
 	feature = 0
+	families = ()
 	predict = 0
 	input_file_path = ""
 	output_file_path = ""
 	test_file_path = ""
 	SVM_joblib_file_path = ""
+	window_length = 0
+	precision = None
+	compress = None
+	shard = None
+	manifest_file_path = ""
+	resume = False
+	profile = False
+	progress = False
+	workers = None
+	executor = "auto"
+	neighbours = 0
+	dtype = None
 	str_help = "biofilm USAGE:\n  biofilm.py -f <feature number> -p <perform prediction> -t <test file path for prediction> -i <input file path> -o <output file path>\n" +\
 	"\n Please select features from the list below: \n  1- AAC\n  2- DPC\n  3- CTD\n"+\
-	"\n If you want to perform prediction set the value 1 for -p: \n  -p 1"
+	"\n Several families, e.g. -f 1,2,3 or -f all, are computed in one pass into one CSV in the training column order\n" +\
+	"\n If you want to perform prediction set the value 1 for -p: \n  -p 1\n" +\
+	"\n Prediction runs on chunks of -t in parallel: \n  --workers <count> (default one per CPU) --executor auto|inline|thread|process\n" +\
+	"\n With --executor auto (the default) planner.py picks the executor and chunk size of -f and -p from the job size\n" +\
+	"\n Feature values are written with -d <decimals> (default 3, DPC 2); add -z, or end -o in .gz, for gzip output\n" +\
+	"\n To featurize only shard k of N of -i (see shard.py): \n  -s k/N [-m <manifest file>]\n" +\
+	"\n To continue an interrupted -f, -p or -w run from its last checkpoint of -o: \n  -r (--resume)\n" +\
+	"\n To time each stage (written to <output>.profile.json) or show throughput and ETA: \n  --profile --progress\n" +\
+	"\n To list the k most similar training peptides of each peptide in -i (see neighbours.py): \n  --neighbours <k>\n" +\
+	"\n To predict -p or -w from float32 instead of float64 feature matrices (see parity.py): \n  --float32\n" +\
+	"\n To scan long proteins in -i for biofilm inhibitory windows of a given length with the model in -j: \n  -w <window length>"
 	try:
-		opts, args = getopt.getopt(argv, "hf:i:o:p:t:j:", ["feature=", "predict=", "input=", "output=", "test=", "joblib="])
+		opts, args = getopt.getopt(argv, "hf:i:o:p:t:j:w:d:zs:m:r", ["feature=", "predict=", "input=", "output=", "test=", "joblib=", "window=", "decimals=", "gzip", "shard=", "manifest=", "resume", "profile", "progress", "workers=", "executor=", "neighbours=", "float32"])
 	except getopt.GetoptError:
 		print(str_help)
 		sys.exit()
@@ -21,10 +44,13 @@ def main(argv):
 			sys.exit()
 		if opt in ("-f", "--feature"):
 			try:
-				feature = int(arg)
+				families = (1, 2, 3) if arg == "all" else tuple(sorted(set(int(f) for f in arg.split(","))))
+				if not set(families) <= {1, 2, 3}:
+					raise ValueError(arg)
 			except Exception as e:
-				print(str_help + "\n   Error: -f should be an Integer")
+				print(str_help + "\n   Error: -f should be 1, 2, 3, a comma-separated list of them, or all")
 				sys.exit()
+			feature = families[0] if len(families) == 1 else 0
 		if opt in ("-p", "--predict"):
 			try:
 				predict = int(arg)
@@ -55,23 +81,118 @@ def main(argv):
 			except Exception as e:
 				print(str_help + "\n   Error: -j should be a String")
 				sys.exit()
+		if opt in ("-w", "--window"):
+			try:
+				window_length = int(arg)
+			except Exception as e:
+				print(str_help + "\n   Error: -w should be an Integer")
+				sys.exit()
+		if opt in ("-d", "--decimals"):
+			try:
+				precision = int(arg)
+			except Exception as e:
+				print(str_help + "\n   Error: -d should be an Integer")
+				sys.exit()
+		if opt in ("-z", "--gzip"):
+			compress = True
+		if opt in ("-s", "--shard"):
+			import shard as sharding
+			try:
+				shard = sharding.parse_shard(arg)
+			except Exception as e:
+				print(str_help + "\n   Error: " + str(e))
+				sys.exit()
+		if opt in ("-m", "--manifest"):
+			manifest_file_path = arg
+		if opt in ("-r", "--resume"):
+			resume = True
+		if opt == "--profile":
+			profile = True
+		if opt == "--progress":
+			progress = True
+		if opt == "--workers":
+			try:
+				workers = int(arg)
+			except Exception as e:
+				print(str_help + "\n   Error: --workers should be an Integer")
+				sys.exit()
+		if opt == "--executor":
+			if arg not in ("auto", "inline", "thread", "process"):
+				print(str_help + "\n   Error: --executor should be auto, inline, thread or process")
+				sys.exit()
+			executor = arg
+		if opt == "--float32":
+			dtype = "float32"
+		if opt == "--neighbours":
+			try:
+				neighbours = int(arg)
+			except Exception as e:
+				print(str_help + "\n   Error: --neighbours should be an Integer")
+				sys.exit()
+
+	profiler = None
+	if profile or progress:
+		import profiling
+		profiler = profiling.Profiler(profile, progress)
+
+	#Featurization only runs faster in processes: it holds the GIL
+	feature_workers, feature_chunk_rows = None, None
+	if families and executor == "auto":
+		import planner
+		peptides, residues = planner.file_workload(input_file_path)
+		plan = planner.plan(peptides, residues, families, False, workers)
+		if profiler is not None:
+			profiler.plan("featurize", plan)
+		if plan.mode == "process":
+			feature_workers, feature_chunk_rows = plan.workers, plan.chunk_rows
+	elif families and executor == "process":
+		import os
+		feature_workers = workers or os.cpu_count()
 
 	#for Feature extraction
-	if feature == 1:
+	if feature == 1 and not feature_workers:
 		import AAC1
-		AAC1.CalculateAAC4All(input_file_path, output_file_path)
+		AAC1.CalculateAAC4All(input_file_path, output_file_path, 3 if precision is None else precision, compress, shard, manifest_file_path, resume, profiler)
 
-	if feature == 2:
+	if feature == 2 and not feature_workers:
 		import DPC
-		DPC.CalculateDPC4All(input_file_path, output_file_path)
+		DPC.CalculateDPC4All(input_file_path, output_file_path, 2 if precision is None else precision, compress, shard, manifest_file_path, resume, profiler)
 
-	if feature == 3:
+	if feature == 3 and not feature_workers:
 		import CTD1
-		CTD1.CalculateCTD4All(input_file_path, output_file_path)
+		CTD1.CalculateCTD4All(input_file_path, output_file_path, 3 if precision is None else precision, compress, shard, manifest_file_path, resume, profiler)
+
+	if len(families) > 1 or feature_workers:
+		import csvwriter
+		if precision is None:
+			precision = 2 if families == (2,) else 3
+		csvwriter.featurize_file(input_file_path, output_file_path, families, precision, compress,
+			chunk_rows=feature_chunk_rows or csvwriter.CHUNK_ROWS, shard=shard, manifest_file_path=manifest_file_path, resume=resume, profiler=profiler or csvwriter.profiling.NULL,
+			workers=feature_workers)
 
 	if predict == 1:
 		import prediction
-		prediction.perform_prediction(SVM_joblib_file_path, test_file_path, output_file_path)
+		chunk_rows = prediction.PREDICT_CHUNK_ROWS
+		predict_executor = executor
+		if executor == "auto":
+			import planner
+			lines, _ = planner.file_workload(test_file_path)
+			plan = planner.plan(max(lines - 1, 0), 0, (), True, workers)
+			if profiler is not None:
+				profiler.plan("predict", plan)
+			predict_executor, workers, chunk_rows = plan.mode, plan.workers, plan.chunk_rows
+		prediction.perform_prediction(SVM_joblib_file_path, test_file_path, output_file_path, workers, chunk_rows, predict_executor, dtype, profiler, resume)
+
+	if window_length > 0:
+		import window
+		window.scan_file(SVM_joblib_file_path, input_file_path, output_file_path, window_length, resume, profiler, dtype=dtype)
+
+	if neighbours > 0:
+		import neighbours as neighbour_index
+		neighbour_index.neighbours_file(input_file_path, output_file_path, neighbours)
+
+	if profiler is not None:
+		profiler.report((output_file_path or "biofilm") + ".profile.json")
 
 
 
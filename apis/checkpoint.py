@@ -0,0 +1,135 @@
+"""Checkpointed, resumable CSV output for long batch runs.
+
+Output is appended to ``<output>.part`` one chunk at a time. At least every
+``interval`` seconds the part file is flushed to disk and ``<output>.ckpt``
+is atomically replaced with the number of completed chunks and the byte
+length of the part file that holds them. A run restarted with ``resume``
+truncates the part file back to that length and continues with the next
+chunk; the finished file is renamed to ``<output>`` and the checkpoint is
+removed, so ``<output>`` never exists half-written.
+
+Gzip output is written as one gzip member per checkpoint, which every gzip
+reader decompresses as a single stream.
+"""
+import gzip
+import json
+import os
+import time
+
+CHECKPOINT_SECONDS = 10
+
+
+def input_fingerprint(input_file_path):
+    """Path, size and modification time, enough to notice a replaced input file."""
+    stat = os.stat(input_file_path)
+    return {'path': os.path.abspath(input_file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _replace_json(path, content):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointedOutput:
+    """Text output that can be resumed after the last checkpointed chunk.
+
+    ``params`` describes the run (input fingerprint, feature families,
+    precision, chunk size, ...); resuming a checkpoint written with other
+    ``params`` raises ``ValueError`` rather than mixing two runs in one file.
+    """
+
+    def __init__(self, output_file_path, params, resume=False, compress=None, compresslevel=6,
+                 interval=None):
+        if compress is None:
+            compress = output_file_path.endswith('.gz')
+        self.output_file_path = output_file_path
+        self.part_path = output_file_path + '.part'
+        self.checkpoint_path = output_file_path + '.ckpt'
+        self.params = params
+        self.compress = compress
+        self.compresslevel = compresslevel
+        self.interval = CHECKPOINT_SECONDS if interval is None else interval
+        self.chunks = 0
+        self._pending = 0
+        self._member = None
+        checkpoint = self._load() if resume else None
+        if checkpoint is None:
+            self.raw = open(self.part_path, 'wb')
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+        else:
+            self.raw = open(self.part_path, 'r+b')
+            self.raw.truncate(checkpoint['offset'])
+            self.raw.seek(checkpoint['offset'])
+            self.chunks = checkpoint['chunks']
+        self.resumed = checkpoint is not None
+        self._last_checkpoint = time.monotonic()
+
+    def _load(self):
+        if not (os.path.exists(self.checkpoint_path) and os.path.exists(self.part_path)):
+            return None
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['params'] != self.params:
+            raise ValueError("%s was written by a run with other inputs or options; remove it or run without "
+                             "resuming" % self.checkpoint_path)
+        if os.path.getsize(self.part_path) < checkpoint['offset']:
+            raise ValueError("%s is shorter than its checkpoint %s" % (self.part_path, self.checkpoint_path))
+        return checkpoint
+
+    def write(self, text):
+        data = text.encode()
+        if not self.compress:
+            self.raw.write(data)
+            return
+        if self._member is None:
+            self._member = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=self.compresslevel)
+        self._member.write(data)
+
+    def commit(self, chunks=1):
+        """Mark ``chunks`` more chunks as written; checkpoint if the interval has passed."""
+        self._pending += chunks
+        if time.monotonic() - self._last_checkpoint >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.chunks += self._pending
+        self._pending = 0
+        _replace_json(self.checkpoint_path, {'params': self.params, 'chunks': self.chunks,
+                                             'offset': self.raw.tell()})
+        self._last_checkpoint = time.monotonic()
+
+    def finish(self):
+        """Close, and move the complete part file to the output path."""
+        self.close()
+        os.replace(self.part_path, self.output_file_path)
+        if self.chunks or self.resumed:
+            os.remove(self.checkpoint_path)
+
+    def close(self):
+        """Stop without finishing; the part file and checkpoint are left for a resumed run."""
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+        if not self.raw.closed:
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.close()
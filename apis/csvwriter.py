@@ -0,0 +1,151 @@
+"""Buffered CSV output for feature matrices.
+
+Rows are formatted a block at a time, from numpy arrays or lists of rows, with
+one fixed-precision format string, written in large chunks, and optionally gzip-compressed on the
+fly (``compress=True`` or an output path ending in ``.gz``). The header is
+``seq`` followed by the training file's column names without their quotes,
+so the output can be fed straight back to prediction.
+"""
+import gzip
+import io
+
+try:
+    from apis import checkpoint, features, profiling
+except ImportError:
+    import checkpoint
+    import features
+    import profiling
+
+CHUNK_ROWS = 1024
+BUFFER_SIZE = 1 << 20
+
+
+def open_output(output_file_path, compress=None, compresslevel=6):
+    if compress is None:
+        compress = output_file_path.endswith('.gz')
+    if compress:
+        return gzip.open(output_file_path, 'wt', compresslevel=compresslevel, newline='')
+    return io.open(output_file_path, 'w', buffering=BUFFER_SIZE, newline='')
+
+
+def header(columns, id_column='seq'):
+    return ','.join([id_column] + list(columns)) + '\n'
+
+
+def format_block(ids, rows, precision=3):
+    """Format one block: ``ids[i]`` followed by the values of ``rows[i]``.
+
+    Each row is one ``%`` of the same format string. Nearly all of that time
+    goes to formatting the floats, so a single ``%`` for the whole block, or
+    numpy's ``savetxt``, is no faster.
+    """
+    if not len(ids):
+        return ''
+    if hasattr(rows, 'tolist'):
+        rows = rows.tolist()
+    row_format = '%s' + (',%%.%df' % precision) * len(rows[0]) + '\n'
+    return ''.join([row_format % ((row_id,) + tuple(row)) for row_id, row in zip(ids, rows)])
+
+
+def read_sequences(input_file_path, shard=None, manifest_file_path=""):
+    """Cleaned, non-blank lines of ``input_file_path``, or only those of ``shard`` ``(k, N)``."""
+    if shard is not None:
+        try:
+            from apis import shard as sharding
+        except ImportError:
+            import shard as sharding
+        return sharding.read_shard(input_file_path, shard, manifest_file_path=manifest_file_path)
+    with open(input_file_path) as f:
+        return [features.clean_sequence(line) for line in f if line.strip()]
+
+
+def featurize_block(ids, families):
+    """Feature rows of ``ids`` with the columns of ``families`` in order; picklable for process pools."""
+    rows = [[] for _ in ids]
+    for family in families:
+        for row, family_row in zip(rows, features.feature_rows(ids, None, (family,))):
+            row.extend(family_row)
+    return rows
+
+
+def featurize_file(input_file_path, output_file_path="", families=features.ALL_FAMILIES, precision=3,
+                   compress=None, chunk_rows=CHUNK_ROWS, shard=None, manifest_file_path="", resume=False,
+                   profiler=profiling.NULL, workers=None):
+    """Featurize every line of ``input_file_path``, or of one ``shard``, into one CSV.
+
+    ``input_file_path`` holds one sequence per line. The header of the output
+    is ``seq`` followed by the training file's column names of ``families``;
+    values are printed with ``precision`` decimals and gzip-compressed when
+    ``compress`` is set or ``output_file_path`` ends in ``.gz``. With
+    ``shard=(k, N)`` only the k-th of N shards of the input is featurized, by
+    the byte ranges of ``manifest_file_path`` if given.
+
+    With an empty ``output_file_path`` the formatted lines are returned
+    instead, as the ``Calculate*4All`` functions always did. Otherwise the
+    output is checkpointed every few chunks, and ``resume`` continues an
+    interrupted run after its last checkpoint (see ``checkpoint``). Reading,
+    each family, formatting and writing are timed as stages of ``profiler``.
+    With more than one of ``workers`` the chunks are featurized in a process
+    pool, up to twice ``workers`` ahead of the writer, and timed as one
+    ``featurize`` stage.
+    """
+    from collections import deque
+
+    with profiler.stage('read'):
+        sequences = read_sequences(input_file_path, shard, manifest_file_path)
+    columns = features.feature_names(families)
+    pool = None
+    if workers and workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=workers)
+
+    def chunks(first_chunk):
+        for start in range(first_chunk * chunk_rows, len(sequences), chunk_rows):
+            yield sequences[start:start + chunk_rows]
+
+    def blocks(first_chunk=0):
+        # Plain lists rather than numpy arrays keep feature-only runs from importing numpy.
+        if pool is None:
+            for ids in chunks(first_chunk):
+                rows = [[] for _ in ids]
+                for family in families:
+                    with profiler.stage(features.FAMILIES[family][0]):
+                        for row, family_row in zip(rows, features.feature_rows(ids, None, (family,))):
+                            row.extend(family_row)
+                with profiler.stage('format'):
+                    text = format_block(ids, rows, precision)
+                yield ids, text
+            return
+        pending = deque()
+        for ids in chunks(first_chunk):
+            pending.append((ids, pool.submit(featurize_block, ids, families)))
+            if len(pending) >= 2 * workers:
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+
+    def finish(ids, future):
+        with profiler.stage('featurize'):
+            rows = future.result()
+        with profiler.stage('format'):
+            return ids, format_block(ids, rows, precision)
+
+    try:
+        if output_file_path == "":
+            profiler.start(len(sequences))
+            return [line for ids, text in blocks() for line in text.splitlines(True)]
+        params = {'input': checkpoint.input_fingerprint(input_file_path), 'families': list(families),
+                  'precision': precision, 'chunk_rows': chunk_rows, 'shard': list(shard) if shard else None,
+                  'compress': compress}
+        with checkpoint.CheckpointedOutput(output_file_path, params, resume, compress) as out:
+            profiler.start(len(sequences), min(out.chunks * chunk_rows, len(sequences)))
+            if not out.resumed:
+                out.write(header(columns))
+            for ids, text in blocks(out.chunks):
+                with profiler.stage('write'):
+                    out.write(text)
+                    out.commit()
+                profiler.count(len(ids))
+    finally:
+        if pool is not None:
+            pool.shutdown()
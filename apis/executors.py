@@ -0,0 +1,49 @@
+"""Executors that keep CPU-bound featurization and prediction off the event loop.
+
+``BIP_EXECUTOR`` selects ``'thread'`` or ``'process'`` and
+``BIP_EXECUTOR_WORKERS`` its size; with ``'auto'`` the views let
+``planner.plan`` choose per request, and both executors are created on first
+use. Work submitted to a process executor must
+be a picklable module-level function such as
+``prediction.predict_with_model_path``.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(kind=None):
+    """The executor of ``kind``, by default ``BIP_EXECUTOR`` (``'auto'`` runs on threads)."""
+    kind = kind or settings.BIP_EXECUTOR
+    if kind == 'auto':
+        kind = 'thread'
+    with _lock:
+        if kind not in _executors:
+            workers = settings.BIP_EXECUTOR_WORKERS
+            if kind == 'thread':
+                _executors[kind] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bip')
+            elif kind == 'process':
+                _executors[kind] = ProcessPoolExecutor(max_workers=workers)
+            else:
+                raise ImproperlyConfigured("BIP_EXECUTOR must be 'auto', 'thread' or 'process', not %r" % kind)
+    return _executors[kind]
+
+
+def shutdown_executor(wait=True):
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+async def run_cpu_bound(func, *args, kind=None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(kind), functools.partial(func, *args))
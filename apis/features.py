@@ -0,0 +1,169 @@
+"""Feature extraction shared by the prediction service and the biofilm CLI.
+
+The feature families are numbered the same way as the ``-f`` option of
+``biofilm.py``: 1 - AAC, 2 - DPC, 3 - CTD.
+"""
+from collections import Counter
+from operator import add
+
+try:
+    from apis import AAC1, CTD1, DPC
+except ImportError:
+    import AAC1
+    import CTD1
+    import DPC
+
+
+FAMILIES = {
+    1: ('AAC', AAC1.CalculateAAComposition),
+    2: ('DPC', DPC.CalculateDipeptideComposition),
+    3: ('CTD', CTD1.CalculateCTD),
+}
+
+ALL_FAMILIES = tuple(sorted(FAMILIES))
+
+# One-letter IUPAC residue codes. Only the 20 standard residues have features;
+# the others (B, J, O, U, X, Z) count towards a peptide's length only.
+RESIDUE_CODES = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+
+def clean_sequence(sequence):
+    return ''.join(sequence.split()).upper()
+
+
+def check_sequence(sequence):
+    if len(sequence) < 2:
+        raise ValueError("Peptide sequences need at least two residues: %r" % sequence)
+    if not RESIDUE_CODES.issuperset(sequence):
+        raise ValueError("Peptide sequences may only hold the one-letter residue codes A-Z: %r" % sequence)
+    return sequence
+
+
+def normalize_column(name):
+    """Turn a training-file header such as `` 'AR'`` into ``AR``."""
+    return name.strip().strip("'\"")
+
+
+DIPEPTIDES = tuple(i + j for i in AAC1.AALetter for j in AAC1.AALetter)
+
+_DISTRIBUTION = ('001', '025', '050', '075', '100')
+
+
+def _ctd_properties():
+    """Per CTD property: residue -> class table and the output keys, in ``CTD1.CalculateCTD`` order."""
+    properties = []
+    for name in CTD1._CTDPropertyOrder:
+        AAProperty = getattr(CTD1, name)
+        table = str.maketrans({aa: CTD1.StringtoNum(aa, AAProperty) for aa in AAC1.AALetter})
+        properties.append((table, tuple(name + 'C' + c for c in '123'),
+                           (name + 'T12', name + 'T13', name + 'T23'),
+                           tuple((c, tuple(name + 'D' + c + q for q in _DISTRIBUTION)) for c in '123')))
+    return properties
+
+
+_CTD_PROPERTIES = _ctd_properties()
+
+
+def _aac(sequence, result):
+    n = len(sequence)
+    for aa in AAC1.AALetter:
+        result[aa] = round(sequence.count(aa) / n * 100, 3)
+
+
+def _dpc(sequence, result):
+    m = len(sequence) - 1
+    pairs = Counter(map(add, sequence, sequence[1:]))
+    # Homodipeptides are counted like str.count, without overlaps: "AAA" holds one "AA".
+    for aa in set(sequence):
+        if aa + aa in pairs:
+            pairs[aa + aa] = sequence.count(aa + aa)
+    zero = round(0 / m * 100, 2)
+    for dipeptide in DIPEPTIDES:
+        result[dipeptide] = round(pairs[dipeptide] / m * 100, 2) if dipeptide in pairs else zero
+
+
+def _ctd(sequence, result):
+    n = len(sequence)
+    m = n - 1
+    encoded = [(properties, sequence.translate(properties[0])) for properties in _CTD_PROPERTIES]
+    for (_, composition, _, _), classes in encoded:
+        for key, c in zip(composition, '123'):
+            result[key] = round(classes.count(c) / n, 3)
+    for (_, _, transition, _), classes in encoded:
+        result[transition[0]] = round((classes.count('12') + classes.count('21')) / m, 3)
+        result[transition[1]] = round((classes.count('13') + classes.count('31')) / m, 3)
+        result[transition[2]] = round((classes.count('23') + classes.count('32')) / m, 3)
+    for (_, _, _, distribution), classes in encoded:
+        find = classes.find
+        for c, keys in distribution:
+            num = classes.count(c)
+            if not num:
+                for key in keys:
+                    result[key] = 0
+                continue
+            cds = []
+            index = -1
+            for _ in range(num):
+                index = find(c, index + 1)
+                cds.append(index + 1)
+            result[keys[0]] = round(cds[0] / n * 100, 3)
+            result[keys[1]] = round(cds[int(num * 0.25) - 1] / n * 100, 3)
+            result[keys[2]] = round(cds[int(num * 0.5) - 1] / n * 100, 3)
+            result[keys[3]] = round(cds[int(num * 0.75) - 1] / n * 100, 3)
+            result[keys[4]] = round(cds[-1] / n * 100, 3)
+
+
+_KERNELS = {1: _aac, 2: _dpc, 3: _ctd}
+
+
+def calculate_features(sequence, families=ALL_FAMILIES):
+    """Features of ``families`` for one sequence, in ``feature_names`` order.
+
+    The values, keys and key order are exactly those of the PyDPI functions
+    in ``FAMILIES``, but every CTD property encodes the sequence into its
+    classes once for composition, transition and distribution together,
+    instead of once per descriptor.
+    """
+    result = {}
+    for family in families:
+        _KERNELS[family](sequence, result)
+    return result
+
+
+_family_names = {}
+
+
+def feature_names(families=ALL_FAMILIES):
+    names = []
+    for family in families:
+        if family not in _family_names:
+            _family_names[family] = list(FAMILIES[family][1]("AD"))
+        names.extend(_family_names[family])
+    return names
+
+
+def families_for_columns(columns):
+    """Return the feature families needed to compute ``columns``."""
+    columns = set(columns)
+    return tuple(family for family in ALL_FAMILIES if columns.intersection(feature_names((family,))))
+
+
+def feature_rows(sequences, columns=None, families=None):
+    """Return one list of feature values per sequence, ordered by ``columns``."""
+    if families is None:
+        families = ALL_FAMILIES if columns is None else families_for_columns(columns)
+    if columns is None:
+        columns = feature_names(families)
+    rows = []
+    for sequence in sequences:
+        features = calculate_features(sequence, families)
+        rows.append([features[column] for column in columns])
+    return rows
+
+
+def feature_matrix(sequences, columns=None, families=None, dtype=float):
+    """Like ``feature_rows`` but as a ``numpy`` array of ``dtype`` and shape ``(len(sequences), len(columns))``."""
+    import numpy as np
+
+    rows = feature_rows(sequences, columns, families)
+    return np.array(rows, dtype=dtype).reshape(len(rows), -1)
@@ -0,0 +1,307 @@
+"""Load generator for the prediction API.
+
+Replays a mix of single-peptide and batch requests, with peptide lengths and
+residue frequencies sampled from the rows of the training file, and reports
+throughput, p50/p95/p99 latency and error rate per request kind. Requests
+queued as a job (202) and turned away by admission control (429) are counted
+apart from errors.
+
+Targets:
+  -u <url>          a running server, e.g. http://127.0.0.1:8000
+  -a wsgi|asgi      the Django app in-process (django.test Client/AsyncClient)
+                    against a fresh temporary database, optionally serving
+                    the model registry in -d instead of BIP_MODEL_DIR
+
+USAGE:
+  loadtest.py (-u <url> | -a wsgi|asgi [-d <registry dir>]) [-e /predict]
+              [-n <requests>] [-c <concurrency>] [-s <single-peptide fraction>] [-b <batch size>] [-r <seed>]
+              [-o <results json>] [-k <earlier results json to compare with>]
+"""
+import getopt
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+try:
+    from apis import AAC1
+except ImportError:
+    import AAC1
+
+TRAINING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'new_all_feature_train2_pydpi.csv')
+
+
+def training_profiles(training_file_path=TRAINING_FILE):
+    """Return ``(length, residue weights)`` for every training peptide.
+
+    Lengths come from the ``NumberOf<residue>`` columns, weights from the
+    AAC columns of the same row.
+    """
+    import csv
+    with open(training_file_path) as f:
+        reader = csv.reader(f)
+        header = [name.strip().strip("'") for name in next(reader)]
+        aac = [header.index(aa) for aa in AAC1.AALetter]
+        counts = [header.index('NumberOf' + aa) for aa in AAC1.AALetter]
+        profiles = []
+        for row in reader:
+            length = int(round(sum(float(row[i]) for i in counts)))
+            weights = [float(row[i]) for i in aac]
+            if length >= 2 and sum(weights) > 0:
+                profiles.append((length, weights))
+    return profiles
+
+
+class PeptideSampler:
+    def __init__(self, profiles, seed=None):
+        self.profiles = profiles
+        self.random = random.Random(seed)
+
+    def peptide(self):
+        length, weights = self.random.choice(self.profiles)
+        return ''.join(self.random.choices(AAC1.AALetter, weights, k=length))
+
+    def requests(self, count, single_fraction, batch_size):
+        """Yield ``(kind, peptides)`` request bodies."""
+        for _ in range(count):
+            if self.random.random() < single_fraction:
+                yield 'single', [self.peptide()]
+            else:
+                yield 'batch', [self.peptide() for _ in range(batch_size)]
+
+
+def _outcome(status, body):
+    """``'ok'``, ``'accepted'`` (202, queued as a job), ``'rejected'`` (429) or ``'error'``."""
+    if status == 202:
+        return 'accepted'
+    if status == 429:
+        return 'rejected'
+    if status != 200:
+        return 'error'
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return 'error'
+    if isinstance(payload, list) and payload and isinstance(payload[0], dict) and 'Error' in payload[0]:
+        return 'error'
+    return 'ok'
+
+
+def _http_post(url):
+    import urllib.error
+    import urllib.request
+
+    def post(body):
+        request = urllib.request.Request(url, data=body.encode(), headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+    return post
+
+
+def _setup_django(model_dir=""):
+    import tempfile
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BiofilmPrediction.settings')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import django
+    from django.conf import settings
+    database = tempfile.NamedTemporaryFile(prefix='loadtest-', suffix='.sqlite3', delete=False).name
+    settings.DATABASES['default']['NAME'] = database
+    settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+    if model_dir:
+        settings.BIP_MODEL_DIR = model_dir
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return database
+
+
+def run_threads(post, requests, concurrency):
+    """Send ``requests`` from ``concurrency`` threads; ``post(body)`` returns ``(status, body)``."""
+    requests = iter(requests)
+    lock = threading.Lock()
+    samples = []
+
+    def worker(post):
+        while True:
+            with lock:
+                try:
+                    kind, peptides = next(requests)
+                except StopIteration:
+                    return
+            start = time.perf_counter()
+            status, body = post(json.dumps({'peptides': peptides}))
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples.append((kind, len(peptides), elapsed, _outcome(status, body)))
+
+    threads = [threading.Thread(target=worker, args=(post(),)) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def run_asgi(endpoint, requests, concurrency):
+    import asyncio
+    from django.test import AsyncClient
+
+    async def main():
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        samples = []
+
+        async def send(kind, peptides):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(endpoint, json.dumps({'peptides': peptides}),
+                                             content_type='application/json')
+                elapsed = time.perf_counter() - start
+                samples.append((kind, len(peptides), elapsed, _outcome(response.status_code, response.content)))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(kind, peptides) for kind, peptides in requests))
+        return samples, time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def summarize(samples, wall):
+    summary = {'wall_seconds': wall}
+    for kind in ('all', 'single', 'batch'):
+        selected = [s for s in samples if kind == 'all' or s[0] == kind]
+        if not selected:
+            continue
+        latencies = [s[2] * 1000 for s in selected]
+        summary[kind] = {
+            'requests': len(selected),
+            'peptides': sum(s[1] for s in selected),
+            'requests_per_second': len(selected) / wall,
+            'peptides_per_second': sum(s[1] for s in selected) / wall,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+        }
+        for outcome, key in (('error', 'error_rate'), ('accepted', 'accepted_rate'), ('rejected', 'rejected_rate')):
+            summary[kind][key] = sum(1 for s in selected if s[3] == outcome) / float(len(selected))
+    return summary
+
+
+def print_summary(summary, previous=None):
+    for kind in ('all', 'single', 'batch'):
+        if kind not in summary:
+            continue
+        row = summary[kind]
+        line = ("%-7s %5d req  %7.1f req/s  %8.1f pep/s  p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms  errors %5.1f%%"
+                "  202 %5.1f%%  429 %5.1f%%") % (
+            kind, row['requests'], row['requests_per_second'], row['peptides_per_second'],
+            row['p50_ms'], row['p95_ms'], row['p99_ms'], row['error_rate'] * 100,
+            row.get('accepted_rate', 0.0) * 100, row.get('rejected_rate', 0.0) * 100)
+        if previous and kind in previous:
+            before = previous[kind]
+            line += "  (req/s %+.1f%%, p95 %+.1f%%)" % (
+                (row['requests_per_second'] / before['requests_per_second'] - 1) * 100,
+                (row['p95_ms'] / before['p95_ms'] - 1) * 100)
+        print(line)
+
+
+def main(argv):
+    url = ""
+    app = ""
+    model_dir = ""
+    endpoint = "/predict"
+    count = 200
+    concurrency = 8
+    single_fraction = 0.9
+    batch_size = 50
+    seed = 0
+    output_file_path = ""
+    compare_file_path = ""
+    try:
+        opts, args = getopt.getopt(argv, "hu:a:d:e:n:c:s:b:r:o:k:",
+                                   ["url=", "app=", "dir=", "endpoint=", "requests=", "concurrency=", "single=", "batch=",
+                                    "seed=", "output=", "compare="])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit()
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            sys.exit()
+        if opt in ("-u", "--url"):
+            url = arg.rstrip("/")
+        if opt in ("-a", "--app"):
+            app = arg
+        if opt in ("-d", "--dir"):
+            model_dir = arg
+        if opt in ("-e", "--endpoint"):
+            endpoint = arg
+        if opt in ("-n", "--requests"):
+            count = int(arg)
+        if opt in ("-c", "--concurrency"):
+            concurrency = int(arg)
+        if opt in ("-s", "--single"):
+            single_fraction = float(arg)
+        if opt in ("-b", "--batch"):
+            batch_size = int(arg)
+        if opt in ("-r", "--seed"):
+            seed = int(arg)
+        if opt in ("-o", "--output"):
+            output_file_path = arg
+        if opt in ("-k", "--compare"):
+            compare_file_path = arg
+    if bool(url) == bool(app) or app not in ("", "wsgi", "asgi"):
+        print(__doc__ + "\n   Error: give either -u <url> or -a wsgi|asgi")
+        sys.exit()
+
+    requests = list(PeptideSampler(training_profiles(), seed).requests(count, single_fraction, batch_size))
+    if url:
+        samples, wall = run_threads(lambda: _http_post(url + endpoint), requests, concurrency)
+    else:
+        database = _setup_django(model_dir)
+        try:
+            if app == "asgi":
+                samples, wall = run_asgi(endpoint, requests, concurrency)
+            else:
+                from django.test import Client
+
+                def client_post():
+                    client = Client()
+
+                    def post(body):
+                        response = client.post(endpoint, body, content_type='application/json')
+                        return response.status_code, response.content
+                    return post
+                samples, wall = run_threads(client_post, requests, concurrency)
+        finally:
+            os.remove(database)
+
+    summary = summarize(samples, wall)
+    summary['config'] = {'target': url or app, 'endpoint': endpoint, 'requests': count, 'concurrency': concurrency,
+                         'single_fraction': single_fraction, 'batch_size': batch_size, 'seed': seed,
+                         'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+    previous = None
+    if compare_file_path:
+        with open(compare_file_path) as f:
+            previous = json.load(f)
+    print_summary(summary, previous)
+    if output_file_path:
+        with open(output_file_path, 'w') as f:
+            json.dump(summary, f, indent=1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
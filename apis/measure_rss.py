@@ -0,0 +1,106 @@
+"""Measure per-worker memory of serving one model from several processes.
+
+Starts ``-n`` fresh worker processes (like separate server workers), each of
+which loads the model once with a regular unpickle and once more in another
+round with ``mmap_mode='r'``, predicts a batch to touch every array, and then
+reports RSS, PSS and USS (private) memory while all workers are alive.
+Memory-mapped arrays show up as shared: RSS stays similar, but USS and PSS
+per worker drop by roughly the size of the model's arrays.
+
+The model must be an uncompressed joblib file, e.g. one from the registry.
+
+USAGE:
+  measure_rss.py -j <joblib file> [-n <workers>] [-o <json output file>]
+"""
+import getopt
+import json
+import multiprocessing
+import os
+import sys
+
+try:
+    from apis import prediction
+except ImportError:
+    import prediction
+
+
+def _memory():
+    result = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                fields = line.split()
+                if fields[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                    result[fields[0][:-1]] = int(fields[1]) / 1024.0
+        result['Uss'] = result.pop('Private_Clean') + result.pop('Private_Dirty')
+    except OSError:
+        import resource
+        result['Rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return result
+
+
+def _worker(SVM_joblib_file_path, mmap_mode, loaded, release, results):
+    model = prediction.load_model(SVM_joblib_file_path, mmap_mode)
+    prediction.predict_sequences(model, ['ARNDCEQGHILKMFPSTWYV', 'GLFDIVKKVVGALGSL'] * 32)
+    loaded.wait()
+    results.put(_memory())
+    release.wait()
+
+
+def measure(SVM_joblib_file_path, workers, mmap_mode):
+    context = multiprocessing.get_context('spawn')
+    loaded = context.Barrier(workers)
+    release = context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = [context.Process(target=_worker, args=(SVM_joblib_file_path, mmap_mode, loaded, release, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in processes]
+    release.wait()
+    for process in processes:
+        process.join()
+    summary = {'mmap_mode': mmap_mode, 'workers': workers}
+    for key in samples[0]:
+        summary['mean_%s_mb' % key.lower()] = sum(sample[key] for sample in samples) / workers
+        summary['total_%s_mb' % key.lower()] = sum(sample[key] for sample in samples)
+    return summary
+
+
+def main(argv):
+    SVM_joblib_file_path = ""
+    workers = 4
+    output_file_path = ""
+    try:
+        opts, args = getopt.getopt(argv, "hj:n:o:", ["joblib=", "workers=", "output="])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit()
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            sys.exit()
+        if opt in ("-j", "--joblib"):
+            SVM_joblib_file_path = arg
+        if opt in ("-n", "--workers"):
+            workers = int(arg)
+        if opt in ("-o", "--output"):
+            output_file_path = arg
+    if not SVM_joblib_file_path:
+        print(__doc__)
+        sys.exit()
+
+    results = [measure(SVM_joblib_file_path, workers, None), measure(SVM_joblib_file_path, workers, 'r')]
+    print("model: %s (%.1f MB on disk), %d workers" % (SVM_joblib_file_path,
+                                                       os.path.getsize(SVM_joblib_file_path) / 1048576.0, workers))
+    for result in results:
+        print("  mmap_mode=%-4s " % result['mmap_mode'] +
+              "  ".join("%s %.1f MB" % (key[5:-3].upper(), value) for key, value in sorted(result.items())
+                        if key.startswith('mean_')) + " per worker")
+    if output_file_path:
+        with open(output_file_path, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0002_car'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='peptide',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='peptide',
+            name='decision_score',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='peptide',
+            name='label',
+            field=models.CharField(default='', max_length=16),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='peptide',
+            name='model_version',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='peptide',
+            name='sequence_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AlterUniqueTogether(
+            name='peptide',
+            unique_together={('sequence_hash', 'model_version')},
+        ),
+    ]
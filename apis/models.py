@@ -1,9 +1,34 @@
+import hashlib
+
 from django.db import models
 
+
+class PeptideManager(models.Manager):
+    def lookup(self, sequence_hashes, model_version):
+        """Return stored predictions for ``model_version`` keyed by sequence hash."""
+        found = self.filter(model_version=model_version, sequence_hash__in=set(sequence_hashes))
+        return {peptide.sequence_hash: peptide for peptide in found}
+
+
 class Peptide(models.Model):
     sequence = models.TextField()
+    sequence_hash = models.CharField(max_length=64)
+    model_version = models.CharField(max_length=64)
+    label = models.CharField(max_length=16)
+    decision_score = models.FloatField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = PeptideManager()
+
+    class Meta:
+        unique_together = (('sequence_hash', 'model_version'),)
+
+    @staticmethod
+    def hash_sequence(sequence):
+        return hashlib.sha256(sequence.encode('ascii')).hexdigest()
+
     def __str__(self):
-        return sequence
+        return self.sequence
 
 
 class Car(models.Model):
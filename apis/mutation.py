@@ -0,0 +1,184 @@
+"""In-silico single-point mutation scanning of a lead peptide.
+
+The parent peptide is featurized once. Each of its 19*L single-point mutants
+is then derived from the parent's counts by touching only what the mutation
+changes: two AAC counts, the dipeptides on either side of the mutated
+residue, and for every CTD property whose class changes its composition,
+its two neighbouring transitions and its per-class position lists. The
+mutant rows are predicted in one batch and returned ranked by score.
+"""
+from bisect import bisect_left
+from collections import Counter
+
+try:
+    from apis import features
+    from apis.window import AALetter, _CLASSES, _PAIRS, _ctd_properties, distribution
+except ImportError:
+    import features
+    from window import AALetter, _CLASSES, _PAIRS, _ctd_properties, distribution
+
+
+def _shifted_removed(positions, r):
+    """``k -> positions[k]`` of ``positions`` with the element at index ``r`` dropped."""
+    return lambda k: positions[k] + 1 if k < r else positions[k + 1] + 1
+
+
+def _shifted_inserted(positions, q, i):
+    """``k -> positions[k]`` of ``positions`` with ``i`` inserted at index ``q``."""
+    return lambda k: positions[k] + 1 if k < q else (i + 1 if k == q else positions[k - 1] + 1)
+
+
+class MutationScanner:
+    aa_letters = frozenset(AALetter)
+
+    def __init__(self, peptide, columns, families=None):
+        self.peptide = features.check_sequence(features.clean_sequence(peptide))
+        self.columns = list(columns)
+        self.index = {column: n for n, column in enumerate(self.columns)}
+        if families is None:
+            families = features.families_for_columns(self.columns)
+        self.families = tuple(families)
+        parent = features.calculate_features(self.peptide, self.families)
+        self.parent_row = [parent[column] for column in self.columns]
+
+        peptide = self.peptide
+        n = len(peptide)
+        self.aa = Counter(peptide)
+        self.dipeptides = Counter(peptide[i:i + 2] for i in range(n - 1) if peptide[i] != peptide[i + 1])
+        self.run_start = [0] * n
+        self.run_stop = [n - 1] * n
+        for i in range(1, n):
+            self.run_start[i] = self.run_start[i - 1] if peptide[i] == peptide[i - 1] else i
+        for i in range(n - 2, -1, -1):
+            self.run_stop[i] = self.run_stop[i + 1] if peptide[i] == peptide[i + 1] else i
+        for i in range(n):
+            if self.run_stop[i] == i:
+                self.dipeptides[peptide[i] * 2] += (i - self.run_start[i] + 1) // 2
+
+        self.properties = []
+        if 3 in self.families:
+            for name, classes in _ctd_properties():
+                sequence_classes = [classes.get(aa) for aa in peptide]
+                self.properties.append({
+                    'name': name,
+                    'residue_classes': classes,
+                    'classes': sequence_classes,
+                    'counts': Counter(sequence_classes),
+                    'pairs': Counter(frozenset(sequence_classes[i:i + 2]) for i in range(n - 1)),
+                    'positions': {c: [i for i, k in enumerate(sequence_classes) if k == c] for c in _CLASSES},
+                })
+
+    def _set(self, row, values):
+        for column, value in values.items():
+            position = self.index.get(column)
+            if position is not None:
+                row[position] = value
+
+    def _dipeptide_deltas(self, i, b):
+        peptide = self.peptide
+        a = peptide[i]
+        n = len(peptide)
+        delta = Counter()
+        left = peptide[i - 1] if i > 0 else None
+        right = peptide[i + 1] if i + 1 < n else None
+        # Heterodipeptides through position i.
+        for x, y, new_x, new_y in ((left, a, left, b), (a, right, b, right)):
+            if x is None or y is None:
+                continue
+            if x != y:
+                delta[x + y] -= 1
+            if new_x != new_y:
+                delta[new_x + new_y] += 1
+        # Homodipeptides are counted per run without overlaps, so the run of
+        # ``a`` through i splits and the runs of ``b`` beside i merge.
+        run = self.run_stop[i] - self.run_start[i] + 1
+        before, after = i - self.run_start[i], self.run_stop[i] - i
+        delta[a * 2] += before // 2 + after // 2 - run // 2
+        left_run = i - self.run_start[i - 1] if left == b else 0
+        right_run = self.run_stop[i + 1] - i if right == b else 0
+        delta[b * 2] += (left_run + 1 + right_run) // 2 - left_run // 2 - right_run // 2
+        return delta
+
+    def mutant_row(self, i, b):
+        """Feature row of the peptide with residue ``i`` (0-based) replaced by ``b``."""
+        peptide = self.peptide
+        a = peptide[i]
+        length = len(peptide)
+        row = list(self.parent_row)
+        values = {}
+        if 1 in self.families:
+            values[a] = round(float(self.aa[a] - 1) / length * 100, 3)
+            values[b] = round(float(self.aa[b] + 1) / length * 100, 3)
+        if 2 in self.families:
+            for dipeptide, change in self._dipeptide_deltas(i, b).items():
+                if change:
+                    values[dipeptide] = round(float(self.dipeptides[dipeptide] + change) / (length - 1) * 100, 2)
+        for prop in self.properties:
+            old = prop['classes'][i]
+            new = prop['residue_classes'].get(b)
+            if old == new:
+                continue
+            name = prop['name']
+            counts = Counter(prop['counts'])
+            counts[old] -= 1
+            counts[new] += 1
+            pairs = Counter(prop['pairs'])
+            for j in (i - 1, i + 1):
+                if 0 <= j < length:
+                    neighbour = prop['classes'][j]
+                    pairs[frozenset((neighbour, old))] -= 1
+                    pairs[frozenset((neighbour, new))] += 1
+            for c in _CLASSES:
+                values[name + 'C' + c] = round(float(counts[c]) / length, 3)
+            for x, y in _PAIRS:
+                values[name + 'T' + x + y] = round(float(pairs[frozenset((x, y))]) / (length - 1), 3)
+            for c in (old, new):
+                if c not in _CLASSES:
+                    continue
+                positions = prop['positions'][c]
+                if c == old:
+                    cds = _shifted_removed(positions, bisect_left(positions, i))
+                else:
+                    cds = _shifted_inserted(positions, bisect_left(positions, i), i)
+                distribution(values, name, c, counts[c], cds, length)
+        self._set(row, values)
+        return row
+
+    def mutants(self):
+        """Yield ``(position, original, substitute, mutant_sequence, row)`` for all 19*L mutants.
+
+        Positions holding a non-standard residue such as ``X`` are not mutated.
+        """
+        peptide = self.peptide
+        for i, a in enumerate(peptide):
+            if a not in self.aa_letters:
+                continue
+            for b in AALetter:
+                if b != a:
+                    yield i + 1, a, b, peptide[:i] + b + peptide[i + 1:], self.mutant_row(i, b)
+
+
+def scan_mutants(model, peptide, columns=None):
+    """Predict every single-point mutant of ``peptide`` and rank them by decision score.
+
+    Returns a list of dicts sorted from the most to the least BIP-like mutant;
+    models without ``decision_function`` keep the scan order.
+    """
+    try:
+        from apis import prediction
+    except ImportError:
+        import prediction
+
+    if columns is None:
+        columns = prediction.model_columns(model)
+    scanner = MutationScanner(peptide, columns)
+    mutants = list(scanner.mutants())
+    labels, scores = prediction.predict_rows(model, [mutant[4] for mutant in mutants], columns)
+    if scores is None:
+        scores = [None] * len(labels)
+    results = [{'position': position, 'original': a, 'substitute': b, 'sequence': sequence,
+                'label': label, 'score': score}
+               for (position, a, b, sequence, _), label, score in zip(mutants, labels, scores)]
+    if results and results[0]['score'] is not None:
+        results.sort(key=lambda result: result['score'], reverse=True)
+    return results
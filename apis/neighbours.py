@@ -0,0 +1,241 @@
+"""Nearest training peptides of a query peptide.
+
+The index holds the training feature matrix standardized with the training
+mean and standard deviation and scaled to unit length, so the cosine
+similarity of a query to every training peptide is one matrix product and
+the top k come from ``argpartition``. It is saved as one ``.npz`` file next
+to the training file and loaded in a few milliseconds.
+
+The training file only holds peptide ids (``BIP_1``, ...), so an exact
+sequence index needs the sequences from elsewhere: ``-s`` takes a file of
+``<id>,<sequence>`` lines, and the SHA-256 of every known training sequence
+is kept so that a query that is itself a training peptide is reported as an
+exact match.
+
+USAGE:
+  neighbours.py -b [-t <training file>] [-s <sequence file>] [-x <index file>]
+  neighbours.py -q <peptide>[,<peptide>...] [-k <neighbours>] [-x <index file>]
+"""
+import getopt
+import hashlib
+import os
+import sys
+import threading
+
+try:
+    from apis import features, prediction
+except ImportError:
+    import features
+    import prediction
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TRAINING_FILE = os.path.join(HERE, 'new_all_feature_train2_pydpi.csv')
+INDEX_FILE = os.path.join(HERE, 'neighbours.npz')
+
+NEIGHBOURS = 5
+
+
+def hash_sequence(sequence):
+    """Same digest as ``Peptide.hash_sequence``."""
+    return hashlib.sha256(sequence.encode('ascii')).hexdigest()
+
+
+def read_training_sequences(sequence_file_path):
+    """``{id: sequence}`` from lines of ``<id>,<sequence>``."""
+    sequences = {}
+    with open(sequence_file_path) as f:
+        for line in f:
+            if line.strip():
+                peptide_id, sequence = line.split(',', 1)
+                sequences[peptide_id.strip()] = features.clean_sequence(sequence)
+    return sequences
+
+
+class NeighbourIndex:
+    def __init__(self, ids, labels, columns, mean, scale, matrix, sequence_hashes=None):
+        import numpy as np
+
+        self.ids = [str(peptide_id) for peptide_id in ids]
+        self.labels = [int(label) for label in labels]
+        self.columns = [str(column) for column in columns]
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+        self.sequence_hashes = list(sequence_hashes) if sequence_hashes is not None else [''] * len(self.ids)
+        self.positions = {digest: position for position, digest in enumerate(self.sequence_hashes) if digest}
+
+    @classmethod
+    def build(cls, training_file_path=TRAINING_FILE, sequence_file_path="", columns=None):
+        import numpy as np
+        import pandas as pd
+        try:
+            from apis import train
+        except ImportError:
+            import train
+
+        X, y = train.load_training(training_file_path, columns)
+        ids = list(pd.read_csv(training_file_path, usecols=[0]).iloc[:, 0])
+        values = X.values.astype(np.float64)
+        mean = values.mean(axis=0)
+        scale = values.std(axis=0)
+        scale[scale == 0] = 1.0
+        hashes = None
+        if sequence_file_path:
+            sequences = read_training_sequences(sequence_file_path)
+            hashes = [hash_sequence(sequences[peptide_id]) if peptide_id in sequences else ''
+                      for peptide_id in ids]
+        index = cls(ids, y, X.columns, mean, scale, np.zeros((0, values.shape[1])), hashes)
+        index.matrix = index.embed(values)
+        return index
+
+    def save(self, index_file_path=INDEX_FILE):
+        import numpy as np
+
+        # Written to a temporary name and renamed, so servers never load half a file.
+        tmp_path = index_file_path + '.tmp.npz'
+        np.savez(tmp_path, ids=np.array(self.ids), labels=np.array(self.labels), columns=np.array(self.columns),
+                 mean=self.mean, scale=self.scale, matrix=self.matrix,
+                 sequence_hashes=np.array(self.sequence_hashes))
+        os.replace(tmp_path, index_file_path)
+
+    @classmethod
+    def load(cls, index_file_path=INDEX_FILE):
+        import numpy as np
+
+        with np.load(index_file_path, allow_pickle=False) as data:
+            return cls(data['ids'], data['labels'], data['columns'], data['mean'], data['scale'], data['matrix'],
+                       data['sequence_hashes'])
+
+    def embed(self, rows):
+        """Standardize feature ``rows`` and scale each to unit length."""
+        import numpy as np
+
+        X = (np.asarray(rows, dtype=np.float32) - self.mean) / self.scale
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return X / norms
+
+    def nearest(self, rows, k=NEIGHBOURS):
+        """``[(positions, similarities)]`` of the ``k`` most similar training peptides per row."""
+        import numpy as np
+
+        k = max(1, min(k, len(self.ids)))
+        similarities = self.embed(rows) @ self.matrix.T
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(similarities, top):
+            ranked = candidates[np.argsort(-row[candidates], kind='stable')]
+            results.append((ranked.tolist(), row[ranked].tolist()))
+        return results
+
+    def query(self, sequences, k=NEIGHBOURS):
+        """Exact training match (or ``None``) and the ``k`` nearest training peptides of each sequence."""
+        sequences = [features.clean_sequence(sequence) for sequence in sequences]
+        nearest = self.nearest(features.feature_rows(sequences, self.columns), k) if sequences else []
+        results = []
+        for sequence, (positions, similarities) in zip(sequences, nearest):
+            exact = self.positions.get(hash_sequence(sequence))
+            results.append({
+                'sequence': sequence,
+                'exact': None if exact is None else self.record(exact),
+                'neighbours': [dict(self.record(position), similarity=round(similarity, 6))
+                               for position, similarity in zip(positions, similarities)],
+            })
+        return results
+
+    def record(self, position):
+        return {'id': self.ids[position], 'label': prediction.label_name(self.labels[position])}
+
+
+def load_or_build(index_file_path=INDEX_FILE, training_file_path=TRAINING_FILE):
+    """Load the saved index, or build it from the training file and try to save it."""
+    if os.path.exists(index_file_path):
+        return NeighbourIndex.load(index_file_path)
+    index = NeighbourIndex.build(training_file_path)
+    try:
+        index.save(index_file_path)
+    except OSError as e:
+        sys.stderr.write("Could not save the neighbour index to %s: %s\n" % (index_file_path, e))
+    return index
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide index configured by the Django settings."""
+    from django.conf import settings
+
+    key = (settings.BIP_NEIGHBOUR_INDEX, settings.BIP_TRAINING_FILE)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = load_or_build(*key)
+        return _indexes[key]
+
+
+def neighbours_file(input_file_path, output_file_path, k=NEIGHBOURS, index_file_path=INDEX_FILE):
+    """``biofilm.py --neighbours``: write the ``k`` nearest training peptides of every line of a file."""
+    import csv
+
+    index = load_or_build(index_file_path)
+    with open(input_file_path) as f:
+        sequences = [line for line in f if line.strip()]
+    with open(output_file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['seq', 'rank', 'id', 'label', 'similarity', 'exact_match'])
+        for result in index.query(sequences, k):
+            exact = result['exact']['id'] if result['exact'] else ''
+            for rank, neighbour in enumerate(result['neighbours'], 1):
+                writer.writerow([result['sequence'], rank, neighbour['id'], neighbour['label'],
+                                 neighbour['similarity'], exact])
+
+
+def main(argv):
+    build = False
+    training_file_path = TRAINING_FILE
+    sequence_file_path = ""
+    index_file_path = INDEX_FILE
+    queries = []
+    k = NEIGHBOURS
+    try:
+        opts, args = getopt.getopt(argv, "hbt:s:x:q:k:", ["build", "training=", "sequences=", "index=", "query=",
+                                                          "neighbours="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__doc__)
+                sys.exit()
+            if opt in ("-b", "--build"):
+                build = True
+            if opt in ("-t", "--training"):
+                training_file_path = arg
+            if opt in ("-s", "--sequences"):
+                sequence_file_path = arg
+            if opt in ("-x", "--index"):
+                index_file_path = arg
+            if opt in ("-q", "--query"):
+                queries = [query for query in arg.split(',') if query]
+            if opt in ("-k", "--neighbours"):
+                k = int(arg)
+        if not build and not queries:
+            raise ValueError("give -b to build the index or -q to query it")
+    except (getopt.GetoptError, ValueError) as e:
+        print(__doc__ + "\n   Error: %s" % e)
+        sys.exit()
+
+    if build:
+        index = NeighbourIndex.build(training_file_path, sequence_file_path)
+        index.save(index_file_path)
+        print("indexed %d training peptides (%d sequences known) in %s"
+              % (len(index.ids), len(index.positions), index_file_path))
+    if queries:
+        for result in load_or_build(index_file_path, training_file_path).query(queries, k):
+            exact = result['exact']
+            print("%s%s" % (result['sequence'], "  (training peptide %s, %s)" % (exact['id'], exact['label'])
+                                               if exact else ""))
+            for rank, neighbour in enumerate(result['neighbours'], 1):
+                print("  %2d  %-10s %-8s %.4f" % (rank, neighbour['id'], neighbour['label'], neighbour['similarity']))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
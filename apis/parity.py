@@ -0,0 +1,126 @@
+"""Check that float32 feature matrices give the labels of float64 ones.
+
+The model predicts the training CSV and a synthetic corpus of random 10-50
+residue peptides twice, from float64 and from float32 features (see
+``prediction.predict_rows``). Every peptide whose label differs is reported
+with both decision scores, next to the largest score difference and the
+size and peak traced memory of both predictions.
+
+USAGE:
+  parity.py -j <joblib file> [-t <training file>] [-n <synthetic peptides>] [-s <seed>]
+"""
+import getopt
+import sys
+
+try:
+    from apis import features, prediction, train
+except ImportError:
+    import features
+    import prediction
+    import train
+
+AMINO_ACIDS = 'ARNDCEQGHILKMFPSTWYV'
+SYNTHETIC_PEPTIDES = 10000
+
+
+def synthetic_corpus(count=SYNTHETIC_PEPTIDES, seed=0, min_length=10, max_length=50):
+    import random
+
+    rng = random.Random(seed)
+    return [''.join(rng.choice(AMINO_ACIDS) for _ in range(rng.randint(min_length, max_length)))
+            for _ in range(count)]
+
+
+def _traced_predict(model, X, columns, dtype):
+    """``predict_rows`` and the peak memory it allocated, in bytes."""
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        result = prediction.predict_rows(model, X, columns, dtype)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def compare(model, X, ids, columns):
+    """Predict the float64 matrix ``X`` as float64 and as float32 and report where the labels differ."""
+    import numpy as np
+
+    X32 = X.astype(np.float32)
+    (labels64, scores64), peak64 = _traced_predict(model, X, columns, None)
+    (labels32, scores32), peak32 = _traced_predict(model, X32, columns, 'float32')
+    disagreements = [{'peptide': peptide, 'float64': {'label': label64, 'score': score64},
+                      'float32': {'label': label32, 'score': score32}}
+                     for peptide, label64, label32, score64, score32
+                     in zip(ids, labels64, labels32, scores64 or [None] * len(ids), scores32 or [None] * len(ids))
+                     if label64 != label32]
+    difference = 0.0
+    if scores64 is not None and len(ids):
+        difference = float(np.abs(np.array(scores64) - np.array(scores32)).max())
+    return {'peptides': len(ids), 'disagreements': disagreements, 'max_score_difference': difference,
+            'float64_bytes': int(X.nbytes), 'float32_bytes': int(X32.nbytes),
+            'float64_peak_bytes': peak64, 'float32_peak_bytes': peak32}
+
+
+def check(model, training_file_path=train.TRAINING_FILE, synthetic=SYNTHETIC_PEPTIDES, seed=0):
+    """``{'training': report, 'synthetic': report}`` of ``compare``; a corpus is skipped when empty."""
+    import numpy as np
+
+    columns = prediction.model_columns(model)
+    reports = {}
+    if training_file_path:
+        import pandas as pd
+
+        X, _ = train.load_training(training_file_path, columns)
+        ids = [str(peptide_id) for peptide_id in pd.read_csv(training_file_path, usecols=[0]).iloc[:, 0]]
+        reports['training'] = compare(model, X.values.astype(np.float64), ids, columns)
+    if synthetic:
+        sequences = synthetic_corpus(synthetic, seed)
+        reports['synthetic'] = compare(model, features.feature_matrix(sequences, columns), sequences, columns)
+    return reports
+
+
+def main(argv):
+    SVM_joblib_file_path = ""
+    training_file_path = train.TRAINING_FILE
+    synthetic = SYNTHETIC_PEPTIDES
+    seed = 0
+    try:
+        opts, args = getopt.getopt(argv, "hj:t:n:s:", ["joblib=", "training=", "synthetic=", "seed="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__doc__)
+                sys.exit()
+            if opt in ("-j", "--joblib"):
+                SVM_joblib_file_path = arg
+            if opt in ("-t", "--training"):
+                training_file_path = arg
+            if opt in ("-n", "--synthetic"):
+                synthetic = int(arg)
+            if opt in ("-s", "--seed"):
+                seed = int(arg)
+        if not SVM_joblib_file_path:
+            raise ValueError("-j is required")
+    except (getopt.GetoptError, ValueError) as e:
+        print(__doc__ + "\n   Error: %s" % e)
+        sys.exit()
+
+    reports = check(prediction.load_model(SVM_joblib_file_path), training_file_path, synthetic, seed)
+    failed = False
+    for name, report in reports.items():
+        print("%s: %d peptides, %d label disagreements, max decision score difference %.2e" % (
+            name, report['peptides'], len(report['disagreements']), report['max_score_difference']))
+        print("  matrix %.1f MB -> %.1f MB, peak while predicting %.1f MB -> %.1f MB" % (
+            report['float64_bytes'] / 1048576.0, report['float32_bytes'] / 1048576.0,
+            report['float64_peak_bytes'] / 1048576.0, report['float32_peak_bytes'] / 1048576.0))
+        for disagreement in report['disagreements']:
+            print("  %s: float64 %s (%s), float32 %s (%s)" % (
+                disagreement['peptide'], disagreement['float64']['label'], disagreement['float64']['score'],
+                disagreement['float32']['label'], disagreement['float32']['score']))
+        failed = failed or bool(report['disagreements'])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,285 @@
+"""Choose inline, thread-pool or process-pool execution for a job by its size.
+
+A job is costed from its peptide count, total residues and feature families
+with calibration constants measured on the host: seconds per residue of each
+family, seconds per predicted row and per model call, and the overhead of a
+thread or process task, of sending a row to a process and of starting a
+worker process. Featurization is
+pure Python and holds the GIL, so only processes spread it over cores;
+libsvm releases the GIL, so threads spread prediction. The cheapest of
+
+    inline   featurize + predict
+    thread   featurize + predict / workers + dispatch
+    process  (featurize + predict) / workers + dispatch + transfer + start-up
+
+wins, with jobs below ``INLINE_SECONDS`` always inline. The chunk size aims
+at ``CHUNK_SECONDS`` of work per task and at least ``CHUNKS_PER_WORKER``
+chunks per worker.
+
+The defaults below were measured on a 1-CPU development host. Run
+``python planner.py -c -j <model>`` on the serving host to measure and save
+them to ``planner.json``, which is used whenever it exists.
+
+USAGE:
+  planner.py -c [-j <joblib file>] [-o <calibration file>]
+  planner.py -n <peptides> -r <residues> [-f <families>] [-p] [-w <workers>]
+"""
+import getopt
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    from apis import features
+except ImportError:
+    import features
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CALIBRATION_FILE = os.path.join(HERE, 'planner.json')
+
+INLINE_SECONDS = 0.05
+CHUNK_SECONDS = 0.25
+CHUNKS_PER_WORKER = 4
+MIN_CHUNK_ROWS = 64
+MAX_CHUNK_ROWS = 8192
+
+DEFAULT_CALIBRATION = {
+    # Featurization seconds per residue, by family number.
+    'family_residue_s': {'1': 2.7e-7, '2': 1.5e-6, '3': 9.8e-6},
+    'predict_row_s': 1.2e-4,
+    'predict_call_s': 9.0e-3,
+    'thread_task_s': 8.0e-6,
+    'process_task_s': 6.0e-5,
+    'process_row_s': 4.0e-6,
+    # A forked worker starts in ~5 ms, a spawned one that loads the model in ~1 s.
+    'process_start_s': 0.5,
+}
+
+MODES = ('inline', 'thread', 'process')
+
+
+class Plan:
+    """How to run one job, and why."""
+
+    def __init__(self, mode, workers, chunk_rows, estimates, peptides, residues, families, predict):
+        self.mode = mode
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        # Estimated seconds of the job in every mode.
+        self.estimates = estimates
+        self.peptides = peptides
+        self.residues = residues
+        self.families = tuple(families)
+        self.predict = predict
+
+    def as_dict(self):
+        return {'mode': self.mode, 'workers': self.workers, 'chunk_rows': self.chunk_rows,
+                'estimated_s': dict(self.estimates), 'peptides': self.peptides, 'residues': self.residues,
+                'families': list(self.families), 'predict': self.predict}
+
+    def __repr__(self):
+        return "Plan(%s, workers=%d, chunk_rows=%d, %.3f s)" % (self.mode, self.workers, self.chunk_rows,
+                                                                self.estimates[self.mode])
+
+
+_calibrations = {}
+
+
+def load_calibration(calibration_file_path=CALIBRATION_FILE):
+    """The saved calibration of this host over ``DEFAULT_CALIBRATION``, read once per file."""
+    if calibration_file_path not in _calibrations:
+        calibration = json.loads(json.dumps(DEFAULT_CALIBRATION))
+        if os.path.exists(calibration_file_path):
+            with open(calibration_file_path) as f:
+                saved = json.load(f)
+            calibration['family_residue_s'].update(saved.pop('family_residue_s', {}))
+            calibration.update(saved)
+        _calibrations[calibration_file_path] = calibration
+    return _calibrations[calibration_file_path]
+
+
+def plan(peptides, residues, families=features.ALL_FAMILIES, predict=True, workers=None, calibration=None):
+    """The cheapest ``Plan`` for featurizing ``families`` of and optionally predicting ``peptides``."""
+    calibration = calibration or load_calibration()
+    workers = max(1, workers or os.cpu_count() or 1)
+    featurize = residues * sum(calibration['family_residue_s'][str(family)] for family in families)
+    predict_s = peptides * calibration['predict_row_s'] if predict else 0.0
+    serial = featurize + predict_s
+    chunk_rows = chunk_size(peptides, serial, workers)
+    chunks = -(-peptides // chunk_rows) if peptides else 0
+    calls = calibration['predict_call_s'] if predict else 0.0
+    estimates = {
+        'inline': serial + calls,
+        'thread': featurize + predict_s / workers + chunks * (calibration['thread_task_s'] + calls),
+        'process': (serial + chunks * calls) / workers + chunks * calibration['process_task_s']
+                   + peptides * calibration['process_row_s'] + calibration['process_start_s'],
+    }
+    if serial < INLINE_SECONDS or workers == 1 or chunks < 2:
+        mode = 'inline'
+    else:
+        mode = min(MODES, key=lambda m: estimates[m])
+    if mode == 'inline':
+        workers, chunk_rows = 1, max(peptides, 1)
+    result = Plan(mode, workers, chunk_rows, estimates, peptides, residues, families, predict)
+    _count(mode)
+    return result
+
+
+def chunk_size(peptides, seconds, workers):
+    """Rows per task: about ``CHUNK_SECONDS`` of work, and ``CHUNKS_PER_WORKER`` tasks per worker."""
+    if not peptides:
+        return MIN_CHUNK_ROWS
+    per_row = seconds / peptides
+    rows = int(CHUNK_SECONDS / per_row) if per_row else MAX_CHUNK_ROWS
+    rows = min(rows, -(-peptides // (workers * CHUNKS_PER_WORKER)))
+    return max(MIN_CHUNK_ROWS, min(MAX_CHUNK_ROWS, rows))
+
+
+def sequences_workload(sequences):
+    """``(peptides, residues)`` of a list of sequences."""
+    return len(sequences), sum(len(sequence) for sequence in sequences)
+
+
+def file_workload(input_file_path, block_size=1 << 20):
+    """``(lines, characters)`` of a one-peptide-per-line file, counted without decoding it.
+
+    Blank lines and whitespace are counted too, so this slightly
+    overestimates a job, which is all a plan needs.
+    """
+    lines = size = 0
+    last = b'\n'
+    with open(input_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            lines += block.count(b'\n')
+            size += len(block)
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return lines, size - lines
+
+
+_decisions = dict.fromkeys(MODES, 0)
+_decisions_lock = threading.Lock()
+
+
+def _count(mode):
+    with _decisions_lock:
+        _decisions[mode] += 1
+
+
+def planner_metrics():
+    with _decisions_lock:
+        return dict(_decisions)
+
+
+def calibrate(SVM_joblib_file_path="", peptides=2000, seed=0):
+    """Measure the calibration constants of this host, on random 10-50 residue peptides."""
+    import pickle
+    import random
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    rng = random.Random(seed)
+    sequences = [''.join(rng.choice('ARNDCEQGHILKMFPSTWYV') for _ in range(rng.randint(10, 50)))
+                 for _ in range(peptides)]
+    residues = sum(len(sequence) for sequence in sequences)
+    calibration = json.loads(json.dumps(DEFAULT_CALIBRATION))
+    for family in features.ALL_FAMILIES:
+        start = time.perf_counter()
+        features.feature_rows(sequences, None, (family,))
+        calibration['family_residue_s'][str(family)] = (time.perf_counter() - start) / residues
+    matrix = features.feature_matrix(sequences)
+    start = time.perf_counter()
+    pickle.loads(pickle.dumps(matrix))
+    calibration['process_row_s'] = (time.perf_counter() - start) / peptides
+    if SVM_joblib_file_path:
+        try:
+            from apis import prediction
+        except ImportError:
+            import prediction
+        model = prediction.load_model(SVM_joblib_file_path)
+        columns = prediction.model_columns(model)
+        rows = features.feature_rows(sequences, columns)
+        prediction.predict_rows(model, rows[:1], columns)
+        start = time.perf_counter()
+        for _ in range(20):
+            prediction.predict_rows(model, rows[:1], columns)
+        calibration['predict_call_s'] = (time.perf_counter() - start) / 20
+        start = time.perf_counter()
+        prediction.predict_rows(model, rows, columns)
+        calibration['predict_row_s'] = max(0.0, time.perf_counter() - start - calibration['predict_call_s']) / peptides
+    with ThreadPoolExecutor(1) as pool:
+        pool.submit(int).result()
+        start = time.perf_counter()
+        for _ in range(200):
+            pool.submit(int).result()
+        calibration['thread_task_s'] = (time.perf_counter() - start) / 200
+    start = time.perf_counter()
+    with ProcessPoolExecutor(1) as pool:
+        pool.submit(features.feature_names).result()
+        calibration['process_start_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(50):
+            pool.submit(int).result()
+        calibration['process_task_s'] = (time.perf_counter() - start) / 50
+    return calibration
+
+
+def save_calibration(calibration, calibration_file_path=CALIBRATION_FILE):
+    tmp_path = calibration_file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(calibration, f, indent=1)
+    os.replace(tmp_path, calibration_file_path)
+    _calibrations.pop(calibration_file_path, None)
+
+
+def main(argv):
+    run_calibration = False
+    SVM_joblib_file_path = ""
+    calibration_file_path = CALIBRATION_FILE
+    peptides = residues = 0
+    families = features.ALL_FAMILIES
+    predict = False
+    workers = None
+    try:
+        opts, args = getopt.getopt(argv, "hcj:o:n:r:f:pw:", ["calibrate", "joblib=", "output=", "peptides=",
+                                                             "residues=", "feature=", "predict", "workers="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__doc__)
+                sys.exit()
+            if opt in ("-c", "--calibrate"):
+                run_calibration = True
+            if opt in ("-j", "--joblib"):
+                SVM_joblib_file_path = arg
+            if opt in ("-o", "--output"):
+                calibration_file_path = arg
+            if opt in ("-n", "--peptides"):
+                peptides = int(arg)
+            if opt in ("-r", "--residues"):
+                residues = int(arg)
+            if opt in ("-f", "--feature"):
+                families = features.ALL_FAMILIES if arg == "all" else tuple(sorted(set(int(f) for f in arg.split(","))))
+            if opt in ("-p", "--predict"):
+                predict = True
+            if opt in ("-w", "--workers"):
+                workers = int(arg)
+        if not run_calibration and not peptides:
+            raise ValueError("give -c to calibrate or -n to plan a job")
+    except (getopt.GetoptError, ValueError) as e:
+        print(__doc__ + "\n   Error: %s" % e)
+        sys.exit()
+
+    if run_calibration:
+        calibration = calibrate(SVM_joblib_file_path)
+        save_calibration(calibration, calibration_file_path)
+        print(json.dumps(calibration, indent=1))
+    if peptides:
+        job = plan(peptides, residues or peptides * 30, families, predict, workers,
+                   load_calibration(calibration_file_path))
+        print(json.dumps(job.as_dict(), indent=1))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
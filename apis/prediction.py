@@ -1,3 +1,182 @@
+import os
+import threading
+
+try:
+    from apis import checkpoint, features, profiling
+except ImportError:
+    import checkpoint
+    import features
+    import profiling
+
+# Rows per model call when a large matrix is predicted in parallel chunks.
+PREDICT_CHUNK_ROWS = 2048
+
+_models = {}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def load_model(SVM_joblib_file_path, mmap_mode=None):
+    """Load a joblib model once per process and keep it resident.
+
+    With ``mmap_mode='r'`` the model's numpy arrays (support vectors, dual
+    coefficients, scaler statistics) are memory-mapped from an uncompressed
+    joblib file instead of copied, so every process serving the same file
+    shares one copy in the page cache.
+    """
+    if SVM_joblib_file_path not in _models:
+        from joblib import load
+        _models[SVM_joblib_file_path] = load(SVM_joblib_file_path, mmap_mode=mmap_mode)
+    return _models[SVM_joblib_file_path]
+
+
+def forget_model(SVM_joblib_file_path):
+    _models.pop(SVM_joblib_file_path, None)
+
+
+def label_name(prediction):
+    return str(prediction).replace("0", "non BIP").replace("1", "BIP")
+
+
+def model_columns(model):
+    """Feature columns ``model`` was fitted on, defaulting to every family."""
+    return list(getattr(model, "feature_names_in_", features.feature_names()))
+
+
+def predict_rows(model, rows, columns, dtype=None):
+    """Predict feature ``rows`` and return ``(labels, decision_scores)``.
+
+    ``decision_scores`` is ``None`` for models without ``decision_function``.
+    With ``dtype='float32'`` the feature matrix takes half the memory, and it
+    is passed to the model ``PREDICT_CHUNK_ROWS`` rows at a time, because
+    libsvm works on a float64 copy of whatever it is given.
+    """
+    import pandas as pd
+    if dtype is None:
+        return _predict_frame(model, pd.DataFrame(rows, columns=columns))
+    import numpy as np
+    X_test = pd.DataFrame(np.asarray(rows, dtype=dtype).reshape(len(rows), len(columns)), columns=columns)
+    return join_predictions(_predict_frame(model, X_test.iloc[start:start + PREDICT_CHUNK_ROWS])
+                            for start in range(0, len(X_test), PREDICT_CHUNK_ROWS))
+
+
+def _predict_frame(model, X_test):
+    labels = [label_name(p) for p in model.predict(X_test)]
+    scores = None
+    if hasattr(model, "decision_function"):
+        scores = [float(s) for s in model.decision_function(X_test)]
+    return labels, scores
+
+
+def default_workers(workers=None):
+    return workers or os.cpu_count() or 1
+
+
+def inference_pool(workers=None):
+    """The process-wide thread pool of ``workers`` threads for chunked predictions."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = default_workers(workers)
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bip-predict')
+        return _pools[workers]
+
+
+def join_predictions(results):
+    """Concatenate ``(labels, scores)`` pairs of consecutive chunks."""
+    labels, scores = [], []
+    for chunk_labels, chunk_scores in results:
+        labels.extend(chunk_labels)
+        if scores is not None and chunk_scores is not None:
+            scores.extend(chunk_scores)
+        else:
+            scores = None
+    return labels, scores
+
+
+def predict_rows_parallel(model, rows, columns, chunk_rows=PREDICT_CHUNK_ROWS, workers=None, dtype=None):
+    """``predict_rows`` on chunks of ``chunk_rows`` rows in the inference pool, in input order.
+
+    libsvm releases the GIL while it predicts, so the chunks of a large matrix
+    run on as many cores as there are ``workers``. Matrices of at most one
+    chunk, or a single worker, are predicted in one call as before.
+    """
+    if not chunk_rows or len(rows) <= chunk_rows or default_workers(workers) == 1:
+        return predict_rows(model, rows, columns, dtype)
+    chunks = [rows[start:start + chunk_rows] for start in range(0, len(rows), chunk_rows)]
+    return join_predictions(inference_pool(workers).map(lambda chunk: predict_rows(model, chunk, columns, dtype),
+                                                        chunks))
+
+
+def predict_sequences(model, sequences, columns=None, chunk_rows=None, workers=None, sparse=False, dtype=None):
+    """Featurize ``sequences`` and return ``(labels, decision_scores)``.
+
+    With ``chunk_rows`` more than that many peptides are predicted in parallel
+    chunks (see ``predict_rows_parallel``). With ``sparse`` the features stay
+    in a CSR matrix all the way into the SVM (see ``sparse.py``). ``dtype``
+    is that of the feature matrix, e.g. ``'float32'`` (see ``predict_rows``).
+    """
+    if columns is None:
+        columns = model_columns(model)
+    if sparse:
+        try:
+            from apis import sparse as sparse_features
+        except ImportError:
+            import sparse as sparse_features
+        return sparse_features.predict_sequences(model, sequences, columns, chunk_rows, workers, dtype)
+    sequences = [features.clean_sequence(seq) for seq in sequences]
+    return predict_rows_parallel(model, features.feature_rows(sequences, columns), columns, chunk_rows, workers, dtype)
+
+
+def predict_with_model_path(SVM_joblib_file_path, sequences, columns=None, mmap_mode=None, chunk_rows=None,
+                            workers=None, sparse=False, dtype=None):
+    """``predict_sequences`` with the resident model; safe to submit to a process pool."""
+    return predict_sequences(load_model(SVM_joblib_file_path, mmap_mode), sequences, columns, chunk_rows, workers,
+                             sparse, dtype)
+
+
+def predict_rows_with_model_path(SVM_joblib_file_path, rows, columns=None, mmap_mode=None, dtype=None):
+    """``predict_rows`` with the resident model, for process pools."""
+    model = load_model(SVM_joblib_file_path, mmap_mode)
+    return predict_rows(model, rows, columns or model_columns(model), dtype)
+
+
+def iter_ndjson(records):
+    """Yield one JSON document per line for each record dict."""
+    import json
+    for record in records:
+        yield json.dumps(record) + "\n"
+
+
+def iter_json(records):
+    """Yield ``json.dumps(list(records))`` piece by piece, one record at a time."""
+    import json
+    separator = "["
+    for record in records:
+        yield separator + json.dumps(record)
+        separator = ", "
+    yield "]" if separator == ", " else "[]"
+
+
+def iter_csv(records, columns, chunk_size=64 * 1024, header=True):
+    """Yield CSV text for ``records`` in chunks of roughly ``chunk_size`` characters."""
+    import csv
+    import io
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(columns)
+    for record in records:
+        writer.writerow([record[column] for column in columns])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
 def dataframe_to_json(df):
     import json
     dct = {}
@@ -7,27 +186,104 @@ def dataframe_to_json(df):
     return json.dumps(dct)
 
 
-def perform_prediction(SVM_joblib_file_path, test_file_path, output_file_path):
-    #for predicting
-    #TODO: extract features | merge them | then perform prediction
-    from joblib import load
-    with open(output_file_path, "a") as f:
-        f.write("YAAAYYY joblib")
+def perform_prediction(SVM_joblib_file_path, test_file_path, output_file_path, workers=None,
+                       chunk_rows=PREDICT_CHUNK_ROWS, executor='thread', dtype=None, profiler=None, resume=False):
+    """``biofilm.py -p 1``: predict every row of a feature CSV such as ``biofilm.py -f all`` writes.
+
+    The first column of ``test_file_path`` holds the peptide, the others its
+    features, named as in the model's training columns. The file is read
+    ``chunk_rows`` rows at a time and up to twice ``workers`` chunks are
+    predicted concurrently on threads, or processes with
+    ``executor='process'``, or one after another in this thread with
+    ``executor='inline'``; the output keeps the input order. The features
+    are read as ``dtype``, e.g. ``'float32'``, instead of float64. Reading,
+    predicting and writing are timed as stages of ``profiler``. The output is
+    checkpointed every few chunks, and ``resume`` continues an interrupted
+    run after its last checkpoint (see ``checkpoint``).
+    """
+    import csv
+    import io
+    from collections import deque
+    from concurrent.futures import Future, ProcessPoolExecutor
     import pandas as pd
-    # testdf = pd.DataFrame([[1,2],[3,4]], columns=["a", "b"])
-    # testdf.to_csv("D:\\vhosts\\cbb1.ut.ac.ir\\httpdocs\\UploadedFiles\\testdf.csv", sep=",", index=False)
-    with open(output_file_path, "w") as f:
-        f.write("YAAAYYY pandas imported ")
-    model = load(SVM_joblib_file_path) # 'SVMModel.joblib'
-    with open(output_file_path, "a") as f:
-        f.write("YAAAYYY SVMModel.joblib loaded successfully")
-    X_test = pd.read_csv(test_file_path)
-    predictions = model.predict(X_test.iloc[:,1:])
-    df = pd.DataFrame(columns=["Peptide sequence", "Biofilm inhobitor"])
-    seqs = list(X_test.seq)
-    for indx in range(len(predictions)):
-        df = df.append({"Peptide sequence": seqs[indx], "Biofilm inhobitor": str(predictions[indx]).replace("0", "non BIP").replace("1", "BIP")}, ignore_index=True)
-    df.to_csv(output_file_path, sep=',', index=False)
-    # print(X_test)
-    # print(predictions)
-    # print(len(predictions))
+
+    if executor not in ('inline', 'thread', 'process'):
+        raise ValueError("executor must be 'inline', 'thread' or 'process', not %r" % executor)
+    profiler = profiler or profiling.NULL
+    workers = 1 if executor == 'inline' else default_workers(workers)
+    with profiler.stage('load model'):
+        model = load_model(SVM_joblib_file_path)
+    columns = model_columns(model)
+    if executor == 'inline':
+        pool = None
+
+        def submit(rows):
+            done = Future()
+            done.set_result(predict_rows(model, rows, columns, dtype))
+            return done
+    elif executor == 'process':
+        pool = ProcessPoolExecutor(max_workers=workers)
+        submit = lambda rows: pool.submit(predict_rows_with_model_path, SVM_joblib_file_path, rows, columns, None,
+                                          dtype)
+    else:
+        pool = None
+        submit = lambda rows: inference_pool(workers).submit(predict_rows, model, rows, columns, dtype)
+
+    def write(out, seqs, future):
+        with profiler.stage('predict'):
+            labels = future.result()[0]
+        with profiler.stage('write'):
+            text = io.StringIO()
+            csv.writer(text).writerows(zip(seqs, labels))
+            out.write(text.getvalue())
+            out.commit()
+        profiler.count(len(seqs))
+
+    params = {'input': checkpoint.input_fingerprint(test_file_path),
+              'model': checkpoint.input_fingerprint(SVM_joblib_file_path), 'chunk_rows': chunk_rows,
+              'dtype': dtype}
+    try:
+        with checkpoint.CheckpointedOutput(output_file_path, params, resume, compress=False) as out:
+            if not out.resumed:
+                out.write('Peptide sequence,Biofilm inhobitor\r\n')
+            pending = deque()
+            with profiler.stage('read'):
+                header = pd.read_csv(test_file_path, nrows=0).columns
+                missing = [column for column in columns if column not in header]
+                if missing:
+                    raise ValueError("%s lacks %d of the model's feature columns, e.g. %s"
+                                     % (test_file_path, len(missing), ', '.join(missing[:5])))
+                total = count_rows(test_file_path)
+                done = min(out.chunks * chunk_rows, total)
+                profiler.start(total, done)
+                dtypes = None
+                if dtype is not None:
+                    dtypes = {name: dtype for name in header[1:]}
+                chunks = pd.read_csv(test_file_path, chunksize=chunk_rows, dtype=dtypes,
+                                     skiprows=range(1, done + 1))
+            while True:
+                with profiler.stage('read'):
+                    X_test = next(chunks, None)
+                if X_test is None:
+                    break
+                with profiler.stage('predict'):
+                    # Features are matched to the model by header name, not by position.
+                    pending.append((list(X_test.iloc[:, 0]), submit(X_test[columns].values)))
+                if len(pending) >= 2 * workers:
+                    write(out, *pending.popleft())
+            while pending:
+                write(out, *pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def count_rows(csv_file_path, block_size=1 << 20):
+    """Data rows of a CSV file whose values hold no newlines, counted without parsing it."""
+    lines = 0
+    last = b'\n'
+    with open(csv_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    return max(lines + (last != b'\n') - 1, 0)
@@ -0,0 +1,168 @@
+"""Per-stage profiling and a live progress line for batch runs.
+
+``biofilm.py --profile`` times every stage of a run (reading, each feature
+family, formatting, writing, model loading and prediction) in wall and CPU
+seconds, runs each stage under its own ``cProfile`` profile and records the
+``tracemalloc`` peak of memory allocated while it ran. The summary is
+printed to stderr and written as JSON, together with the execution plans
+chosen for the run (see ``planner``). ``--progress`` shows peptides done,
+peptides per second and the ETA on one refreshing stderr line.
+
+Stages must not nest: each is a flat span of work within the run.
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+
+PROGRESS_SECONDS = 0.5
+TOP_FUNCTIONS = 10
+
+
+class _Stage:
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_bytes = 0
+        self.profile = None
+
+
+class Profiler:
+    """Collects stage timings when ``profile`` is set and reports progress when ``progress`` is set.
+
+    With both off every method is a cheap no-op, so code paths can always
+    take a profiler.
+    """
+
+    def __init__(self, profile=False, progress=False, stream=None):
+        self.profile = profile
+        self.progress = progress
+        self.stream = stream or sys.stderr
+        self.stages = {}
+        self.plans = {}
+        self.total = 0
+        self.done = self._resumed = 0
+        self._started, self._cpu_started = time.perf_counter(), time.process_time()
+        self._counting = None
+        self._last_progress = 0.0
+        if profile:
+            import tracemalloc
+            tracemalloc.start()
+
+    def start(self, total, done=0):
+        """Start counting ``total`` peptides, ``done`` of them already finished (e.g. on resume)."""
+        self.total = total
+        self.done = self._resumed = done
+        self._counting = time.perf_counter()
+
+    def stage(self, name):
+        if not self.profile:
+            return contextlib.nullcontext()
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        import cProfile
+        import tracemalloc
+
+        stage = self.stages.setdefault(name, _Stage())
+        if stage.profile is None:
+            stage.profile = cProfile.Profile()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        stage.profile.enable()
+        try:
+            yield
+        finally:
+            stage.profile.disable()
+            stage.wall += time.perf_counter() - wall
+            stage.cpu += time.process_time() - cpu
+            stage.calls += 1
+            stage.peak_bytes = max(stage.peak_bytes, tracemalloc.get_traced_memory()[1] - base)
+
+    def plan(self, name, plan):
+        """Record the ``planner.Plan`` chosen for the ``name`` part of the run."""
+        if self.profile:
+            self.plans[name] = plan.as_dict()
+
+    def count(self, peptides):
+        """Record ``peptides`` more peptides as done and refresh the progress line."""
+        self.done += peptides
+        if self.progress and (time.perf_counter() - self._last_progress >= PROGRESS_SECONDS
+                              or self.done >= self.total):
+            self._last_progress = time.perf_counter()
+            self.stream.write('\r' + self.progress_line())
+            self.stream.flush()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self._counting if self._counting is not None else 0.0
+        return (self.done - self._resumed) / elapsed if elapsed > 0 else 0.0
+
+    def progress_line(self):
+        rate = self.rate()
+        eta = (self.total - self.done) / rate if rate else 0.0
+        return "%d/%d peptides  %.1f peptides/s  ETA %d:%02d:%02d " % (
+            self.done, self.total, rate, eta // 3600, eta % 3600 // 60, eta % 60)
+
+    def summary(self):
+        wall = time.perf_counter() - self._started
+        cpu = time.process_time() - self._cpu_started
+        return {'command': sys.argv, 'peptides': self.done, 'wall_s': wall, 'cpu_s': cpu,
+                'peptides_per_s': self.rate(), 'peak_rss_mb': _peak_rss_mb(),
+                'stages': {name: {'calls': stage.calls, 'wall_s': stage.wall, 'cpu_s': stage.cpu,
+                                  'peak_alloc_mb': stage.peak_bytes / 1048576.0,
+                                  'top_functions': _top_functions(stage.profile)}
+                           for name, stage in self.stages.items()},
+                'plans': self.plans}
+
+    def report(self, json_file_path=""):
+        """End the progress line, print the stage table and write the JSON summary."""
+        if self.progress:
+            self.stream.write('\n')
+        if not self.profile:
+            return None
+        import tracemalloc
+        tracemalloc.stop()
+        summary = self.summary()
+        self.stream.write("%-16s %6s %9s %9s %11s\n" % ('stage', 'calls', 'wall s', 'cpu s', 'peak MB'))
+        for name, stage in summary['stages'].items():
+            self.stream.write("%-16s %6d %9.3f %9.3f %11.1f\n" % (name, stage['calls'], stage['wall_s'],
+                                                                  stage['cpu_s'], stage['peak_alloc_mb']))
+        for name, plan in summary['plans'].items():
+            self.stream.write("plan %s: %s, %d workers, %d rows per chunk (estimated %.3f s)\n" % (
+                name, plan['mode'], plan['workers'], plan['chunk_rows'], plan['estimated_s'][plan['mode']]))
+        self.stream.write("%d peptides in %.3f s wall, %.3f s cpu (%.1f peptides/s), peak RSS %.1f MB\n" % (
+            summary['peptides'], summary['wall_s'], summary['cpu_s'], summary['peptides_per_s'],
+            summary['peak_rss_mb']))
+        if json_file_path:
+            with open(json_file_path, 'w') as f:
+                json.dump(summary, f, indent=1)
+            self.stream.write("profile written to %s\n" % json_file_path)
+        return summary
+
+
+NULL = Profiler()
+
+
+def _top_functions(profile, top=TOP_FUNCTIONS):
+    """``[function, calls, own seconds, cumulative seconds]`` of the slowest functions of a stage."""
+    if profile is None:
+        return []
+    import pstats
+    stats = pstats.Stats(profile).stats
+    ranked = sorted(stats.items(), key=lambda item: -item[1][3])[:top]
+    return [["%s:%d(%s)" % (os.path.basename(filename), line, function), calls, own, cumulative]
+            for (filename, line, function), (_, calls, own, cumulative, _) in ranked]
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1048576.0 if sys.platform == 'darwin' else peak / 1024.0
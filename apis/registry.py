@@ -0,0 +1,253 @@
+"""Versioned model registry with background loading and atomic hot swap.
+
+A registry is a directory holding one sub-directory per model version::
+
+    <root>/<version>/model.joblib
+    <root>/<version>/metadata.json   (version, created, feature_columns, ...)
+    <root>/CURRENT                   (name of the version to serve)
+
+Models are written uncompressed so that with ``mmap_mode='r'`` their arrays
+are memory-mapped and shared by every worker process serving the same
+version. Each server process keeps the version it serves in memory. When ``CURRENT``
+names another version, the new one is loaded and warmed in a background
+thread and then swapped in with a single reference assignment, so requests
+already holding the old ``ModelVersion`` finish on it undisturbed.
+
+Run ``python registry.py -h`` to list, register and activate versions.
+"""
+import getopt
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    from apis import batching, prediction
+except ImportError:
+    import batching
+    import prediction
+
+MODEL_FILE = 'model.joblib'
+METADATA_FILE = 'metadata.json'
+CURRENT_FILE = 'CURRENT'
+WARM_UP_PEPTIDE = 'ARNDCEQGHILKMFPSTWYV'
+
+
+class ModelVersion:
+    """A loaded, warmed model together with what is needed to serve it."""
+
+    def __init__(self, version, path, model, columns, metadata=None, mmap_mode=None, chunk_rows=None, workers=None,
+                 sparse=False, dtype=None):
+        self.version = version
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.model = model
+        self.columns = list(columns)
+        self.metadata = metadata or {}
+        # Batches of more than chunk_rows peptides are predicted in parallel chunks.
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        # Keep the features in CSR through to the SVM (see sparse.py).
+        self.sparse = sparse
+        # Feature matrices are built as this dtype, e.g. 'float32'; None is float64.
+        self.dtype = dtype
+
+    def predict_sequences(self, sequences):
+        return prediction.predict_sequences(self.model, sequences, self.columns, self.chunk_rows, self.workers,
+                                            self.sparse, self.dtype)
+
+    def warm_up(self):
+        self.predict_sequences([WARM_UP_PEPTIDE])
+        return self
+
+
+class ModelRegistry:
+    def __init__(self, root, fallback_path=None, fallback_version=None, poll_seconds=5.0, mmap_mode=None,
+                 chunk_rows=None, workers=None, sparse=False, dtype=None):
+        """``fallback_path``/``fallback_version`` are served while ``root`` holds no version."""
+        self.root = root
+        self.mmap_mode = mmap_mode
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self.sparse = sparse
+        self.dtype = dtype
+        self.fallback_path = fallback_path
+        self.fallback_version = fallback_version
+        self.poll_seconds = poll_seconds
+        self._current = None
+        self._lock = threading.Lock()
+        self._loading = None
+        self._checked = 0.0
+
+    # -- artifacts on disk --
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        found = [name for name in os.listdir(self.root)
+                 if os.path.isfile(os.path.join(self.root, name, METADATA_FILE))]
+        return sorted(found, key=lambda version: (self.metadata(version).get('created', ''), version))
+
+    def metadata(self, version):
+        with open(os.path.join(self.root, version, METADATA_FILE)) as f:
+            return json.load(f)
+
+    def model_path(self, version):
+        return os.path.join(self.root, version, MODEL_FILE)
+
+    def active_version(self):
+        """The version ``CURRENT`` names, else the newest registered one."""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                version = f.read().strip()
+            if version:
+                return version
+        except OSError:
+            pass
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def save(self, model, columns, version=None, **metadata):
+        """Write ``model`` as a new version and return its name. Does not activate it."""
+        from joblib import dump
+
+        if version is None:
+            version = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        target = os.path.join(self.root, version)
+        if os.path.exists(target):
+            raise ValueError("Model version %r already exists in %s" % (version, self.root))
+        staging = os.path.join(self.root, '.staging-%s-%d' % (version, os.getpid()))
+        os.makedirs(staging)
+        dump(model, os.path.join(staging, MODEL_FILE), compress=0)
+        metadata.update(version=version, created=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                        feature_columns=list(columns))
+        with open(os.path.join(staging, METADATA_FILE), 'w') as f:
+            json.dump(metadata, f, indent=1)
+        os.rename(staging, target)
+        return version
+
+    def activate(self, version):
+        """Point ``CURRENT`` at ``version``; every process picks it up on its next poll."""
+        if version not in self.versions():
+            raise ValueError("Unknown model version %r in %s" % (version, self.root))
+        staging = os.path.join(self.root, '.%s.%d' % (CURRENT_FILE, os.getpid()))
+        with open(staging, 'w') as f:
+            f.write(version + '\n')
+        os.replace(staging, os.path.join(self.root, CURRENT_FILE))
+
+    # -- serving --
+
+    def load(self, version):
+        """Load and warm ``version`` without serving it."""
+        path = self.model_path(version)
+        metadata = self.metadata(version)
+        model = prediction.load_model(path, self.mmap_mode)
+        columns = metadata.get('feature_columns') or prediction.model_columns(model)
+        return ModelVersion(version, path, model, columns, metadata, self.mmap_mode, self.chunk_rows,
+                            self.workers, self.sparse, self.dtype).warm_up()
+
+    def _load_fallback(self):
+        model = prediction.load_model(self.fallback_path)
+        return ModelVersion(self.fallback_version, self.fallback_path, model, prediction.model_columns(model),
+                            chunk_rows=self.chunk_rows, workers=self.workers, sparse=self.sparse,
+                            dtype=self.dtype)
+
+    def current(self):
+        """Return the ``ModelVersion`` to serve this request with.
+
+        The first call loads synchronously; afterwards a changed ``CURRENT``
+        only starts a background load and the old version keeps serving.
+        """
+        served = self._current
+        if served is None:
+            with self._lock:
+                if self._current is None:
+                    version = self.active_version()
+                    self._current = self.load(version) if version else self._load_fallback()
+                    self._checked = time.monotonic()
+                served = self._current
+        elif time.monotonic() - self._checked >= self.poll_seconds:
+            self._checked = time.monotonic()
+            version = self.active_version()
+            if version and version != served.version:
+                self.reload(version)
+        return served
+
+    def reload(self, version, wait=False):
+        """Load ``version`` in a background thread and swap it in once warm."""
+        with self._lock:
+            if self._loading is None or not self._loading.is_alive():
+                self._loading = threading.Thread(target=self._swap, args=(version,), name='bip-model-loader',
+                                                 daemon=True)
+                self._loading.start()
+            loading = self._loading
+        if wait:
+            loading.join()
+
+    def _swap(self, version):
+        try:
+            loaded = self.load(version)
+        except Exception as e:
+            sys.stderr.write("Could not load model version %r: %s\n" % (version, e))
+            return
+        previous, self._current = self._current, loaded
+        if previous is not None and previous.path != loaded.path:
+            # Requests still holding ``previous`` keep their own reference.
+            prediction.forget_model(previous.path)
+            batching.stop_batchers(previous.path)
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the process-wide registry configured by the Django settings."""
+    from django.conf import settings
+
+    key = (settings.BIP_MODEL_DIR, settings.BIP_MODEL_PATH, settings.BIP_MODEL_VERSION,
+           settings.BIP_PREDICT_CHUNK_ROWS, settings.BIP_PREDICT_WORKERS, settings.BIP_SPARSE_FEATURES, settings.BIP_FEATURE_DTYPE)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = ModelRegistry(settings.BIP_MODEL_DIR, settings.BIP_MODEL_PATH,
+                                             settings.BIP_MODEL_VERSION, settings.BIP_MODEL_POLL_SECONDS,
+                                             settings.BIP_MODEL_MMAP_MODE, settings.BIP_PREDICT_CHUNK_ROWS,
+                                             settings.BIP_PREDICT_WORKERS, settings.BIP_SPARSE_FEATURES,
+                                             settings.BIP_FEATURE_DTYPE)
+        return _registries[key]
+
+
+def main(argv):
+    str_help = "registry USAGE:\n  registry.py -d <registry directory> [-l] [-r <joblib file> [-v <version>]] [-a <version>]\n" +\
+    "\n  -l  list registered versions\n  -r  register a joblib model (feature columns are taken from the model or default to AAC+DPC+CTD)\n" +\
+    "  -v  version name for -r (default: a UTC timestamp)\n  -a  make <version> the one every server process serves"
+    try:
+        opts, args = getopt.getopt(argv, "hd:lr:v:a:", ["dir=", "list", "register=", "version=", "activate="])
+    except getopt.GetoptError:
+        print(str_help)
+        sys.exit()
+    opts = dict(opts)
+    if "-h" in opts or not ("-d" in opts or "--dir" in opts):
+        print(str_help)
+        sys.exit()
+    registry = ModelRegistry(opts.get("-d", opts.get("--dir")))
+
+    joblib_file_path = opts.get("-r", opts.get("--register"))
+    if joblib_file_path:
+        model = prediction.load_model(joblib_file_path)
+        version = registry.save(model, prediction.model_columns(model), opts.get("-v", opts.get("--version")),
+                                source=os.path.abspath(joblib_file_path))
+        print("registered " + version)
+    version = opts.get("-a", opts.get("--activate"))
+    if version:
+        registry.activate(version)
+        print("activated " + version)
+    if "-l" in opts or "--list" in opts:
+        active = registry.active_version()
+        for version in registry.versions():
+            print(("* " if version == active else "  ") + version)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,101 @@
+"""Cache whole prediction responses, keyed by request content and model version.
+
+A prediction is a pure function of the normalized request and the model
+version serving it, so the SHA-256 of both is used as a strong ETag and as
+the key of the response in the ``BIP_RESPONSE_CACHE`` cache. The default
+local-memory backend evicts the least recently used entries beyond its
+``MAX_ENTRIES``; a file-based backend can be configured instead for a cache
+shared by all worker processes.
+
+A request whose ``If-None-Match`` names the ETag is answered without the
+cache or the model: 304 for GET and HEAD and, as RFC 9110 asks of every
+other method, 412 for the POSTs of the prediction views. ``*`` is not
+treated as a match, since a prediction exists for every request before it
+was ever made.
+"""
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.precondition_failed = 0
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'not_modified': self.not_modified,
+                    'precondition_failed': self.precondition_failed,
+                    'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+                    'cache': settings.BIP_RESPONSE_CACHE}
+
+
+stats = CacheStats()
+
+
+def response_key(view, request_data, version):
+    """Hex digest of the view name, the normalized request and the model version."""
+    content = json.dumps([view, request_data, version], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def not_modified(request, tag):
+    """Whether ``If-None-Match`` already names ``tag``."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    tags = parse_etags(header)
+    return tag in tags or 'W/' + tag in tags
+
+
+def etag(key):
+    return '"%s"' % key
+
+
+def cached(request, key):
+    """Return a 304 or 412 when ``If-None-Match`` names ``key``, the cached response, or ``None`` on a miss."""
+    if not_modified(request, etag(key)):
+        if request.method in ('GET', 'HEAD'):
+            stats.count('not_modified')
+            response = HttpResponseNotModified()
+        else:
+            stats.count('precondition_failed')
+            response = HttpResponse(status=412)
+        response['ETag'] = etag(key)
+        return response
+    content = caches[settings.BIP_RESPONSE_CACHE].get(key)
+    if content is None:
+        stats.count('misses')
+        return None
+    stats.count('hits')
+    return _response(key, content)
+
+
+def cache_response(key, content):
+    """Store the JSON ``content`` of a successful response and return it with its ETag."""
+    caches[settings.BIP_RESPONSE_CACHE].set(key, content, settings.BIP_RESPONSE_CACHE_TIMEOUT)
+    return _response(key, content)
+
+
+def _response(key, content):
+    response = HttpResponse(content, content_type='text/json')
+    response['ETag'] = etag(key)
+    return response
+
+
+def cache_metrics():
+    return stats.metrics()
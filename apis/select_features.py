@@ -0,0 +1,223 @@
+"""Trade prediction accuracy against latency with smaller feature sets.
+
+Builds candidate feature sets from the training file: whole feature families
+(``AAC``, ``AAC+CTD``, ... where only the listed families are computed per
+peptide) and the ``k`` columns with the highest ANOVA F-score (``top<k>``).
+For each set it reports stratified k-fold accuracy, with the top-k ranking
+redone inside every fold, and the measured featurize+predict latency of one
+peptide through the same code path the API uses. A tier picked with ``-x``
+is refitted on the whole file and registered, with its column list, as a
+model version.
+
+USAGE:
+  select_features.py [-t <training csv>] [-k <top-k sizes>] [-f <family sets, e.g. 1,13,123>]
+                     [-l <kernel>] [-c <C>] [-g <gamma>] [-n <folds>] [-p <latency peptides>] [-j <jobs>] [-r <seed>]
+                     [-o <report json>] [-x <tier to export> [-d <registry dir>] [-v <version>] [-a]]
+"""
+import getopt
+import json
+import sys
+import time
+
+try:
+    from apis import features, prediction, train
+    from apis.loadtest import PeptideSampler, training_profiles
+    from apis.registry import ModelRegistry
+except ImportError:
+    import features
+    import prediction
+    import train
+    from loadtest import PeptideSampler, training_profiles
+    from registry import ModelRegistry
+
+TOP_K = (20, 50, 100, 200, 400)
+FAMILY_SETS = ((1,), (2,), (3,), (1, 3), (1, 2, 3))
+
+
+def family_tier(families):
+    return '+'.join(features.FAMILIES[family][0] for family in families)
+
+
+def f_scores(X, y):
+    """``f_classif`` scoring columns that are constant within a fold as 0 instead of warning."""
+    import warnings
+
+    import numpy as np
+    from sklearn.feature_selection import f_classif
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        scores, pvalues = f_classif(X, y)
+    return np.nan_to_num(scores), np.nan_to_num(pvalues, nan=1.0)
+
+
+def rank_columns(X, y):
+    """Column names ordered by decreasing ANOVA F-score."""
+    import numpy as np
+
+    scores, _ = f_scores(X, y)
+    return [X.columns[i] for i in np.argsort(-scores, kind='stable')]
+
+
+def candidate_sets(X, y, top_k=TOP_K, family_sets=FAMILY_SETS):
+    """Return ``[(tier, columns, k or None)]``; columns keep the training order.
+
+    Columns that are constant over the training file are left out of every set.
+    """
+    order = {column: n for n, column in enumerate(X.columns)}
+    ranked = rank_columns(X, y)
+    sets = [(family_tier(families), [column for column in features.feature_names(families) if column in order], None)
+            for families in family_sets]
+    sets += [('top%d' % k, sorted(ranked[:k], key=order.get), k) for k in top_k if k < len(ranked)]
+    return sets
+
+
+def _pipeline(kernel, C, gamma, k=None):
+    from sklearn.feature_selection import SelectKBest
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    steps = [('scaler', StandardScaler())]
+    if k is not None:
+        steps.append(('select', SelectKBest(f_scores, k=k)))
+    steps.append(('svc', SVC(kernel=kernel, C=C, gamma=gamma)))
+    return Pipeline(steps)
+
+
+def cross_validate(X, y, columns, k, kernel, C, gamma, folds, n_jobs, seed):
+    """CV accuracy of a set; top-k sets select their columns within each fold."""
+    from sklearn.model_selection import StratifiedKFold, cross_val_score
+
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    if k is None:
+        scores = cross_val_score(_pipeline(kernel, C, gamma), X[columns], y, cv=cv, n_jobs=n_jobs)
+    else:
+        scores = cross_val_score(_pipeline(kernel, C, gamma, k), X, y, cv=cv, n_jobs=n_jobs)
+    return float(scores.mean()), float(scores.std())
+
+
+def measure_latency(model, columns, peptides):
+    """Median and p95 milliseconds to featurize and predict one peptide."""
+    prediction.predict_sequences(model, peptides[:1], columns)
+    timings = []
+    for peptide in peptides:
+        start = time.perf_counter()
+        prediction.predict_sequences(model, [peptide], columns)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+
+
+def evaluate(training_file_path=train.TRAINING_FILE, top_k=TOP_K, family_sets=FAMILY_SETS, kernel='rbf', C=10.0,
+             gamma='scale', folds=5, latency_peptides=200, n_jobs=-1, seed=0):
+    """Return ``(report rows, fitted models by tier)``; rows are sorted by median latency."""
+    X, y = train.load_training(training_file_path)
+    X = X.loc[:, X.std() > 0]
+    sampler = PeptideSampler(training_profiles(training_file_path), seed)
+    peptides = [sampler.peptide() for _ in range(latency_peptides)]
+    report = []
+    models = {}
+    for tier, columns, k in candidate_sets(X, y, top_k, family_sets):
+        mean_score, std_score = cross_validate(X, y, columns, k, kernel, C, gamma, folds, n_jobs, seed)
+        model = train.fit_model(X[columns], y, kernel, C, gamma)
+        median_ms, p95_ms = measure_latency(model, columns, peptides)
+        models[tier] = (model, columns)
+        report.append({'tier': tier, 'features': len(columns),
+                       'families': family_tier(features.families_for_columns(columns)),
+                       'cv_accuracy': mean_score, 'cv_std': std_score,
+                       'latency_median_ms': median_ms, 'latency_p95_ms': p95_ms})
+    report.sort(key=lambda row: row['latency_median_ms'])
+    return report, models
+
+
+def main(argv):
+    training_file_path = train.TRAINING_FILE
+    top_k = TOP_K
+    family_sets = FAMILY_SETS
+    kernel = 'rbf'
+    C = 10.0
+    gamma = 'scale'
+    folds = 5
+    latency_peptides = 200
+    n_jobs = -1
+    seed = 0
+    output_file_path = ""
+    export = ""
+    registry_dir = train.REGISTRY_DIR
+    version = None
+    activate = False
+    try:
+        opts, args = getopt.getopt(argv, "ht:k:f:l:c:g:n:p:j:r:o:x:d:v:a",
+                                   ["training=", "top=", "families=", "kernel=", "C=", "gamma=", "folds=", "peptides=",
+                                    "jobs=", "seed=", "output=", "export=", "dir=", "version=", "activate"])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit()
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__doc__)
+                sys.exit()
+            if opt in ("-t", "--training"):
+                training_file_path = arg
+            if opt in ("-k", "--top"):
+                top_k = tuple(int(k) for k in arg.split(',') if k)
+            if opt in ("-f", "--families"):
+                family_sets = tuple(tuple(int(family) for family in families) for families in arg.split(',') if families)
+            if opt in ("-l", "--kernel"):
+                kernel = arg
+            if opt in ("-c", "--C"):
+                C = float(arg)
+            if opt in ("-g", "--gamma"):
+                gamma = arg if arg == 'scale' else float(arg)
+            if opt in ("-n", "--folds"):
+                folds = int(arg)
+            if opt in ("-p", "--peptides"):
+                latency_peptides = int(arg)
+            if opt in ("-j", "--jobs"):
+                n_jobs = int(arg)
+            if opt in ("-r", "--seed"):
+                seed = int(arg)
+            if opt in ("-o", "--output"):
+                output_file_path = arg
+            if opt in ("-x", "--export"):
+                export = arg
+            if opt in ("-d", "--dir"):
+                registry_dir = arg
+            if opt in ("-v", "--version"):
+                version = arg
+            if opt in ("-a", "--activate"):
+                activate = True
+        if any(family not in features.FAMILIES for families in family_sets for family in families):
+            raise ValueError("-f families are 1 (AAC), 2 (DPC) and 3 (CTD)")
+    except ValueError as e:
+        print(__doc__ + "\n   Error: %s" % e)
+        sys.exit()
+
+    report, models = evaluate(training_file_path, top_k, family_sets, kernel, C, gamma, folds, latency_peptides,
+                              n_jobs, seed)
+    print("%-12s %8s  %-12s %12s  %10s  %10s" % ("tier", "features", "computes", "cv accuracy", "median ms", "p95 ms"))
+    for row in report:
+        print("%-12s %8d  %-12s %6.4f+/-%.3f  %10.2f  %10.2f" % (row['tier'], row['features'], row['families'],
+                                                              row['cv_accuracy'], row['cv_std'],
+                                                              row['latency_median_ms'], row['latency_p95_ms']))
+    if output_file_path:
+        with open(output_file_path, 'w') as f:
+            json.dump(report, f, indent=1)
+    if export:
+        if export not in models:
+            print("   Error: unknown tier %r, choose one of %s" % (export, ", ".join(row['tier'] for row in report)))
+            sys.exit()
+        model, columns = models[export]
+        row = [row for row in report if row['tier'] == export][0]
+        registry = ModelRegistry(registry_dir)
+        version = registry.save(model, columns, version, training_file=training_file_path, tier=row,
+                                params={'kernel': kernel, 'C': C, 'gamma': gamma})
+        if activate:
+            registry.activate(version)
+        print(("registered and activated " if activate else "registered ") + version)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,283 @@
+"""Split a peptide file into shards, featurize them independently and merge.
+
+Shard ``k`` of ``N`` (1-based) is a contiguous range of whole lines of the
+input, chosen either by byte offsets (every shard gets about size/N bytes;
+needs no pass over the file) or by record counts (every shard gets about
+R/N non-blank lines). A record belongs to the shard in which its first byte
+lies, so any machine with the same input computes the same ranges.
+
+``split`` writes a manifest with every shard's byte range and record count,
+and the input's size and modification time; a shard or merge refuses an
+input that no longer matches them, so copies of the input on other nodes
+must keep their modification time (``cp -p``, ``rsync -t``).
+Each shard is then processed on its own, e.g. ``biofilm.py -f 3 -i <input>
+-s k/N -m <manifest> -o <shard output>``. ``merge`` concatenates the shard
+outputs in order, into a temporary file that replaces the output only once
+the merge succeeded, and checks that every shard holds exactly the records of
+its range, in order, so nothing is missing or duplicated. ``local`` does all
+of this with one process per shard standing in for the nodes.
+
+USAGE:
+  shard.py split -i <input> -n <shards> [-b bytes|records] -m <manifest>
+  shard.py merge -m <manifest> -o <output> <shard output> ...
+  shard.py local -i <input> -n <shards> [-b bytes|records] -f <features> -o <output> [-w <work dir>]
+
+  <features> are those of biofilm.py -f: 1, 2, 3, a comma-separated list of them, or all.
+"""
+import getopt
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+try:
+    from apis import checkpoint, features
+except ImportError:
+    import checkpoint
+    import features
+
+BY = ('bytes', 'records')
+
+
+def parse_families(spec):
+    """``'1,3'`` or ``'all'`` -> the sorted feature families, as ``biofilm.py -f`` takes them."""
+    try:
+        families = features.ALL_FAMILIES if spec == 'all' else tuple(sorted(set(int(f) for f in spec.split(','))))
+    except ValueError:
+        families = ()
+    if not families or not set(families) <= set(features.ALL_FAMILIES):
+        raise ValueError("Features are 1, 2, 3, a comma-separated list of them, or all, not %r" % spec)
+    return families
+
+
+def parse_shard(spec):
+    """``'k/N'`` -> ``(k, N)`` with 1 <= k <= N."""
+    try:
+        k, n = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError("Shards are given as k/N, not %r" % spec)
+    if not 1 <= k <= n:
+        raise ValueError("Shard %r is out of range; k/N needs 1 <= k <= N" % spec)
+    return k, n
+
+
+def _line_start(f, offset, size):
+    """The first line start at or after byte ``offset``."""
+    if offset <= 0:
+        return 0
+    if offset >= size:
+        return size
+    f.seek(offset - 1)
+    f.readline()
+    return f.tell()
+
+
+def _line_starts_by_records(f, n):
+    """Byte offsets splitting the non-blank lines of ``f`` into ``n`` near-equal groups."""
+    starts = []
+    f.seek(0)
+    offset = 0
+    for line in iter(f.readline, b''):
+        if line.strip():
+            starts.append(offset)
+        offset += len(line)
+    records = len(starts)
+    bounds = [starts[records * k // n] if records * k // n < records else offset for k in range(n)]
+    return bounds + [offset]
+
+
+def boundaries(input_file_path, n, by='bytes'):
+    """Return the ``n + 1`` byte offsets delimiting the shards of ``input_file_path``."""
+    if by not in BY:
+        raise ValueError("Shards are split by %s, not %r" % (' or '.join(BY), by))
+    size = os.path.getsize(input_file_path)
+    with open(input_file_path, 'rb') as f:
+        if by == 'records':
+            return _line_starts_by_records(f, n)
+        return [_line_start(f, size * k // n, size) for k in range(n)] + [size]
+
+
+def read_range(input_file_path, start, end):
+    """Cleaned, non-blank sequences of the lines starting in ``[start, end)``."""
+    with open(input_file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return [features.clean_sequence(line) for line in data.decode().split('\n') if line.strip()]
+
+
+def read_shard(input_file_path, shard, by='bytes', manifest_file_path=""):
+    """Sequences of shard ``(k, N)``, from the manifest's ranges when one is given."""
+    k, n = shard
+    if manifest_file_path:
+        manifest = load_manifest(manifest_file_path, input_file_path)
+        if len(manifest['shards']) != n:
+            raise ValueError("The manifest has %d shards, not %d" % (len(manifest['shards']), n))
+        entry = manifest['shards'][k - 1]
+        return read_range(input_file_path, entry['start'], entry['end'])
+    bounds = boundaries(input_file_path, n, by)
+    return read_range(input_file_path, bounds[k - 1], bounds[k])
+
+
+def split(input_file_path, n, by='bytes', manifest_file_path=""):
+    """Compute the shards of ``input_file_path`` and write (and return) their manifest."""
+    bounds = boundaries(input_file_path, n, by)
+    shards = []
+    first_record = 0
+    for k in range(n):
+        records = len(read_range(input_file_path, bounds[k], bounds[k + 1]))
+        shards.append({'shard': '%d/%d' % (k + 1, n), 'start': bounds[k], 'end': bounds[k + 1],
+                       'first_record': first_record, 'records': records})
+        first_record += records
+    manifest = {'input': os.path.abspath(input_file_path), 'fingerprint': checkpoint.input_fingerprint(input_file_path),
+                'by': by, 'records': first_record, 'shards': shards}
+    if manifest_file_path:
+        with open(manifest_file_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def load_manifest(manifest_file_path, input_file_path=""):
+    with open(manifest_file_path) as f:
+        manifest = json.load(f)
+    input_file_path = input_file_path or manifest['input']
+    fingerprint = checkpoint.input_fingerprint(input_file_path)
+    # The path may differ on another node; size and mtime may not.
+    if any(fingerprint[key] != manifest['fingerprint'][key] for key in ('size', 'mtime_ns')):
+        raise ValueError("%s changed since the manifest %s was written" % (input_file_path, manifest_file_path))
+    return manifest
+
+
+def _open_text(path, mode='r', compress=None):
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return gzip.open(path, mode + 't', newline='')
+    return open(path, mode, newline='')
+
+
+def merge(manifest_file_path, shard_output_paths, output_file_path):
+    """Concatenate shard outputs, given in shard order, into ``output_file_path``.
+
+    Raises ``ValueError`` unless every shard output holds one row per record of
+    its shard, in input order, under the same header; ``output_file_path``
+    is then left as it was.
+    """
+    manifest = load_manifest(manifest_file_path)
+    if len(shard_output_paths) != len(manifest['shards']):
+        raise ValueError("Expected %d shard outputs, got %d" % (len(manifest['shards']), len(shard_output_paths)))
+    tmp_path = output_file_path + '.tmp'
+    try:
+        rows = _merge_into(manifest, shard_output_paths, tmp_path, output_file_path.endswith('.gz'))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_file_path)
+    return rows
+
+
+def _merge_into(manifest, shard_output_paths, tmp_path, compress):
+    header = None
+    rows = 0
+    with _open_text(tmp_path, 'w', compress) as out:
+        for entry, path in zip(manifest['shards'], shard_output_paths):
+            expected = read_range(manifest['input'], entry['start'], entry['end'])
+            with _open_text(path) as f:
+                shard_header = f.readline()
+                if header is None:
+                    header = shard_header
+                    out.write(header)
+                elif shard_header != header:
+                    raise ValueError("Shard %s (%s) has a different header" % (entry['shard'], path))
+                found = 0
+                for line in f:
+                    if found >= len(expected):
+                        raise ValueError("Shard %s (%s) has more rows than its %d records"
+                                         % (entry['shard'], path, len(expected)))
+                    if line.split(',', 1)[0] != expected[found]:
+                        raise ValueError("Shard %s (%s) row %d is %r, expected record %d %r"
+                                         % (entry['shard'], path, found + 1, line.split(',', 1)[0],
+                                            entry['first_record'] + found + 1, expected[found]))
+                    out.write(line)
+                    found += 1
+            if found != len(expected):
+                raise ValueError("Shard %s (%s) has %d rows for %d records" % (entry['shard'], path, found,
+                                                                                len(expected)))
+            rows += found
+    return rows
+
+
+def run_local(input_file_path, n, feature, output_file_path, by='bytes', workdir=""):
+    """Split, featurize every shard in its own ``biofilm.py`` process, and merge.
+
+    ``feature`` is one feature family or a sequence of them.
+    """
+    if isinstance(feature, int):
+        feature = (feature,)
+    families = ','.join(str(family) for family in feature)
+    workdir = workdir or tempfile.mkdtemp(prefix='shards-')
+    os.makedirs(workdir, exist_ok=True)
+    manifest_file_path = os.path.join(workdir, 'manifest.json')
+    split(input_file_path, n, by, manifest_file_path)
+    biofilm = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'biofilm.py')
+    outputs = [os.path.join(workdir, 'shard-%d-of-%d.csv' % (k, n)) for k in range(1, n + 1)]
+    processes = [subprocess.Popen([sys.executable, biofilm, '-f', families, '-i', input_file_path,
+                                   '-s', '%d/%d' % (k, n), '-m', manifest_file_path, '-o', output])
+                 for k, output in zip(range(1, n + 1), outputs)]
+    failed = [k for k, process in enumerate(processes, 1) if process.wait() != 0]
+    if failed:
+        raise RuntimeError("Shards %s failed" % ', '.join('%d/%d' % (k, n) for k in failed))
+    return merge(manifest_file_path, outputs, output_file_path)
+
+
+def main(argv):
+    if not argv or argv[0] not in ('split', 'merge', 'local'):
+        print(__doc__)
+        sys.exit()
+    command = argv[0]
+    input_file_path = ""
+    manifest_file_path = ""
+    output_file_path = ""
+    workdir = ""
+    n = 0
+    by = 'bytes'
+    feature = ()
+    try:
+        opts, args = getopt.getopt(argv[1:], "hi:n:b:m:o:f:w:",
+                                   ["input=", "shards=", "by=", "manifest=", "output=", "feature=", "workdir="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__doc__)
+                sys.exit()
+            if opt in ("-i", "--input"):
+                input_file_path = arg
+            if opt in ("-n", "--shards"):
+                n = int(arg)
+            if opt in ("-b", "--by"):
+                by = arg
+            if opt in ("-m", "--manifest"):
+                manifest_file_path = arg
+            if opt in ("-o", "--output"):
+                output_file_path = arg
+            if opt in ("-f", "--feature"):
+                feature = parse_families(arg)
+            if opt in ("-w", "--workdir"):
+                workdir = arg
+        if command == 'split':
+            manifest = split(input_file_path, n, by, manifest_file_path)
+            for entry in manifest['shards']:
+                print("%-7s bytes %d-%d, %d records" % (entry['shard'], entry['start'], entry['end'], entry['records']))
+        elif command == 'merge':
+            print("merged %d rows into %s" % (merge(manifest_file_path, args, output_file_path), output_file_path))
+        else:
+            rows = run_local(input_file_path, n, feature, output_file_path, by, workdir)
+            print("merged %d rows into %s" % (rows, output_file_path))
+    except (getopt.GetoptError, ValueError, RuntimeError, OSError) as e:
+        print("   Error: %s" % e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
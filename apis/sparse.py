@@ -0,0 +1,256 @@
+"""Sparse feature matrices and SVM prediction without densifying.
+
+A 10-50 residue peptide has at most 49 of the 400 dipeptides, so its DPC
+block is built straight into CSR from the pairs that occur; the AAC and CTD
+blocks, which are mostly non-zero, are computed as before and stacked next
+to it with ``scipy.sparse.hstack``.
+
+A fitted ``StandardScaler`` cannot centre a sparse matrix and an ``SVC``
+fitted on dense data refuses sparse input, so ``SparseSVM`` folds the scaler
+into the kernel instead. With ``z = (x - mean) / scale`` and a support
+vector ``s``::
+
+    z . s   = x . (s / scale) - (mean / scale) . s
+    |z|^2   = |x / scale|^2 - 2 x . (mean / scale^2) + |mean / scale|^2
+
+so every kernel needs only sparse-by-dense products of ``x`` and is exactly
+the kernel of the standardized dense row. Run ``python sparse.py -h`` to
+compare the memory and time of both paths on a peptide file.
+
+USAGE:
+  sparse.py -j <joblib file> -i <peptide file> [-r <repeats>]
+"""
+import getopt
+import sys
+import threading
+import time
+import weakref
+
+try:
+    from apis import features, prediction
+except ImportError:
+    import features
+    import prediction
+
+DPC_INDEX = {dipeptide: position for position, dipeptide in enumerate(features.DIPEPTIDES)}
+
+
+def dpc_block(sequences, dtype=None):
+    """The DPC columns of ``sequences`` as a CSR matrix, equal to ``DPC.CalculateDipeptideComposition``."""
+    import numpy as np
+    from scipy import sparse
+    from collections import Counter
+    from operator import add
+
+    indptr, indices, data = [0], [], []
+    for sequence in sequences:
+        m = len(sequence) - 1
+        pairs = Counter(map(add, sequence, sequence[1:]))
+        row = []
+        for dipeptide, count in pairs.items():
+            position = DPC_INDEX.get(dipeptide)
+            if position is None:
+                continue
+            if dipeptide[0] == dipeptide[1]:
+                # Homodipeptides are counted like str.count, without overlaps.
+                count = sequence.count(dipeptide)
+            row.append((position, round(count / m * 100, 2)))
+        row.sort()
+        indices.extend(position for position, _ in row)
+        data.extend(value for _, value in row)
+        indptr.append(len(indices))
+    return sparse.csr_matrix((np.array(data, dtype=dtype or np.float64), np.array(indices, dtype=np.int32),
+                              np.array(indptr, dtype=np.int64)), shape=(len(sequences), len(features.DIPEPTIDES)))
+
+
+def feature_matrix(sequences, columns=None, dtype=None):
+    """CSR matrix of ``sequences`` with ``columns`` (default: every family), without a dense DPC block."""
+    import numpy as np
+    from scipy import sparse
+
+    if columns is None:
+        columns = features.feature_names()
+    families = features.families_for_columns(columns)
+    sequences = [features.clean_sequence(sequence) for sequence in sequences]
+    blocks, names = [], []
+    for family in families:
+        if family == 2:
+            blocks.append(dpc_block(sequences, dtype))
+        else:
+            dense = np.array(features.feature_rows(sequences, None, (family,)), dtype=dtype or np.float64)
+            blocks.append(sparse.csr_matrix(dense.reshape(len(sequences), -1)))
+        names.extend(features.feature_names((family,)))
+    X = sparse.hstack(blocks, format='csr')
+    if names != list(columns):
+        position = {name: i for i, name in enumerate(names)}
+        X = X[:, [position[column] for column in columns]]
+    return X
+
+
+class SparseSVM:
+    """Predict with a fitted ``SVC`` (optionally behind a ``StandardScaler``) on CSR input."""
+
+    def __init__(self, model):
+        import numpy as np
+
+        from sklearn.preprocessing import StandardScaler
+
+        steps = [step for _, step in getattr(model, 'steps', [(None, model)])]
+        scaler = steps[0] if len(steps) == 2 and isinstance(steps[0], StandardScaler) else None
+        svc = steps[-1]
+        if len(steps) != (2 if scaler is not None else 1):
+            raise ValueError("Only an SVC, or a StandardScaler followed by an SVC, can predict sparse input")
+        if len(svc.classes_) != 2:
+            raise ValueError("SparseSVM handles binary classifiers only")
+        S = svc.support_vectors_
+        n_features = S.shape[1]
+        mean = np.zeros(n_features)
+        scale = np.ones(n_features)
+        if scaler is not None and scaler.with_mean:
+            mean = scaler.mean_
+        if scaler is not None and scaler.with_std:
+            scale = scaler.scale_
+        self.classes = svc.classes_
+        self.kernel = svc.kernel
+        self.gamma = svc._gamma
+        self.degree = svc.degree
+        self.coef0 = svc.coef0
+        self.dual_coef = svc.dual_coef_[0]
+        self.intercept = svc.intercept_[0]
+        # The support vectors are used as the model holds them, so a
+        # memory-mapped model stays shared; the scale is applied to the rows.
+        self.support_vectors = S
+        self.inverse_scale = 1.0 / scale
+        centre = mean * self.inverse_scale
+        self.offset = S @ centre
+        self.centre_weights = centre * self.inverse_scale
+        self.centre_norm = centre @ centre
+        self.support_norms = np.einsum('ij,ij->i', S, S)
+
+    def dot_support(self, X):
+        """``z . s`` for every standardized row ``z`` of ``X`` and support vector ``s``.
+
+        scipy multiplies a sparse matrix by a C-ordered copy of
+        ``support_vectors.T``, which lives only for the duration of the call.
+        """
+        from scipy import sparse
+
+        return sparse.csr_matrix(X.multiply(self.inverse_scale)) @ self.support_vectors.T - self.offset
+
+    def squared_norms(self, X):
+        squared = X.multiply(X).multiply(self.inverse_scale ** 2).sum(axis=1)
+        return (squared.A1 if hasattr(squared, 'A1') else squared) - 2 * (X @ self.centre_weights) + self.centre_norm
+
+    def decision_function(self, X):
+        import numpy as np
+
+        dot = self.dot_support(X)
+        if self.kernel == 'linear':
+            K = dot
+        elif self.kernel == 'rbf':
+            K = np.exp(-self.gamma * np.maximum(self.squared_norms(X)[:, None] - 2 * dot + self.support_norms, 0))
+        elif self.kernel == 'poly':
+            K = (self.gamma * dot + self.coef0) ** self.degree
+        elif self.kernel == 'sigmoid':
+            K = np.tanh(self.gamma * dot + self.coef0)
+        else:
+            raise ValueError("Unsupported kernel %r" % self.kernel)
+        return np.asarray(K @ self.dual_coef + self.intercept).ravel()
+
+    def predict(self, X):
+        return self.classes[(self.decision_function(X) > 0).astype(int)]
+
+
+# Dropped together with the model, e.g. once the registry swaps in a new version.
+_sparse_models = weakref.WeakKeyDictionary()
+_sparse_models_lock = threading.Lock()
+
+
+def sparse_model(model):
+    """The ``SparseSVM`` of ``model``, derived once per model object."""
+    with _sparse_models_lock:
+        if model not in _sparse_models:
+            _sparse_models[model] = SparseSVM(model)
+        return _sparse_models[model]
+
+
+def predict_sequences(model, sequences, columns=None, chunk_rows=None, workers=None, dtype=None):
+    """``prediction.predict_sequences`` through CSR features and ``SparseSVM``."""
+    if columns is None:
+        columns = prediction.model_columns(model)
+    svm = sparse_model(model)
+
+    def predict_chunk(chunk):
+        scores = svm.decision_function(feature_matrix(chunk, columns, dtype))
+        return ([prediction.label_name(svm.classes[int(score > 0)]) for score in scores],
+                [float(score) for score in scores])
+
+    if not chunk_rows or len(sequences) <= chunk_rows or prediction.default_workers(workers) == 1:
+        return predict_chunk(sequences)
+    chunks = [sequences[start:start + chunk_rows] for start in range(0, len(sequences), chunk_rows)]
+    return prediction.join_predictions(prediction.inference_pool(workers).map(predict_chunk, chunks))
+
+
+def compare(model, sequences, repeats=3):
+    """Memory and best-of-``repeats`` time of the dense and the sparse path, and whether they agree."""
+    import numpy as np
+    import pandas as pd
+
+    columns = prediction.model_columns(model)
+    results = {}
+    for path in ('dense', 'sparse'):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            if path == 'dense':
+                X = pd.DataFrame(features.feature_rows([features.clean_sequence(seq) for seq in sequences], columns),
+                                 columns=columns)
+                scores = model.decision_function(X)
+                nbytes = int(X.memory_usage(index=False).sum())
+            else:
+                X = feature_matrix(sequences, columns)
+                scores = sparse_model(model).decision_function(X)
+                nbytes = int(X.data.nbytes + X.indices.nbytes + X.indptr.nbytes)
+            timings.append(time.perf_counter() - start)
+        results[path] = {'matrix_bytes': nbytes, 'seconds': min(timings), 'scores': np.asarray(scores)}
+    dense, sparse_ = results['dense'].pop('scores'), results['sparse'].pop('scores')
+    results['sparse']['density'] = float(feature_matrix(sequences[:1000], columns).nnz) / (min(len(sequences), 1000)
+                                                                                            * len(columns))
+    results['labels_agree'] = bool(((dense > 0) == (sparse_ > 0)).all())
+    results['max_score_difference'] = float(np.abs(dense - sparse_).max()) if len(dense) else 0.0
+    return results
+
+
+def main(argv):
+    SVM_joblib_file_path = ""
+    input_file_path = ""
+    repeats = 3
+    try:
+        opts, args = getopt.getopt(argv, "hj:i:r:", ["joblib=", "input=", "repeats="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__doc__)
+                sys.exit()
+            if opt in ("-j", "--joblib"):
+                SVM_joblib_file_path = arg
+            if opt in ("-i", "--input"):
+                input_file_path = arg
+            if opt in ("-r", "--repeats"):
+                repeats = int(arg)
+        if not SVM_joblib_file_path or not input_file_path:
+            raise ValueError("-j and -i are required")
+    except (getopt.GetoptError, ValueError) as e:
+        print(__doc__ + "\n   Error: %s" % e)
+        sys.exit()
+
+    with open(input_file_path) as f:
+        sequences = [line for line in f if line.strip()]
+    results = compare(prediction.load_model(SVM_joblib_file_path), sequences, repeats)
+    for path in ('dense', 'sparse'):
+        print("%-7s %10.1f KB %8.3f s" % (path, results[path]['matrix_bytes'] / 1024.0, results[path]['seconds']))
+    print("density %.3f, labels agree: %s, max decision score difference %.2e"
+          % (results['sparse']['density'], results['labels_agree'], results['max_score_difference']))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
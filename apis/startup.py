@@ -0,0 +1,149 @@
+"""Start-up budget: import-time report and cold-start benchmark.
+
+Runs each target in fresh interpreters, measures its wall time (median of
+``-n`` runs), and once more under ``python -X importtime`` to list the
+slowest top-level imports. Each target is checked against its time budget
+and its list of modules it must never import. Targets:
+
+  help       biofilm.py -h
+  features   biofilm.py -f 3 on a few peptides (must not import numpy, pandas or sklearn)
+  django     django.setup() and the URL conf, i.e. what every server worker imports
+  predict    the first prediction with the model in -j (load + featurize + predict)
+
+Exits with status 1 if any target is over budget or imports a forbidden module.
+
+USAGE:
+  startup.py [-t help,features,django[,predict]] [-j <joblib file>] [-n <runs>] [-k <top imports>] [-o <json output>]
+"""
+import getopt
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# Wall-clock budgets in milliseconds.
+BUDGET_MS = {'help': 50, 'features': 100, 'django': 400, 'predict': 2500}
+
+FORBIDDEN = {
+    'help': ('numpy', 'pandas', 'sklearn', 'joblib', 'django'),
+    'features': ('numpy', 'pandas', 'sklearn', 'joblib', 'django'),
+    'django': ('numpy', 'pandas', 'sklearn', 'joblib'),
+    'predict': (),
+}
+
+SAMPLE = ['GLFDIVKKVVGALGSL', 'ARNDCEQGHILKMFPSTWYV', 'KWKLFKKIGAVLKVL']
+
+DJANGO = ("import os, sys; sys.path.insert(0, %r); os.environ.setdefault('DJANGO_SETTINGS_MODULE', "
+          "'BiofilmPrediction.settings'); import django; django.setup(); import BiofilmPrediction.urls" % ROOT)
+
+PREDICT = ("import sys; sys.path.insert(0, %r); import prediction; "
+           "prediction.predict_sequences(prediction.load_model(sys.argv[1]), %r)" % (HERE, SAMPLE))
+
+
+def commands(targets, workdir, SVM_joblib_file_path=""):
+    sample_file_path = os.path.join(workdir, 'peptides.txt')
+    with open(sample_file_path, 'w') as f:
+        f.write('\n'.join(SAMPLE) + '\n')
+    available = {
+        'help': ['biofilm.py', '-h'],
+        'features': ['biofilm.py', '-f', '3', '-i', sample_file_path, '-o', os.path.join(workdir, 'features.csv')],
+        'django': ['-c', DJANGO],
+        'predict': ['-c', PREDICT, SVM_joblib_file_path],
+    }
+    return [(target, available[target]) for target in targets]
+
+
+def wall_time(args, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def import_times(args):
+    """Return ``{module: (self_us, cumulative_us, depth)}`` from ``-X importtime``."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=HERE, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.setdefault(name.strip(), (int(own), int(cumulative), depth))
+    return modules
+
+
+def measure(targets, SVM_joblib_file_path="", runs=5, top=10):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for target, args in commands(targets, workdir, SVM_joblib_file_path):
+            modules = import_times(args)
+            roots = sorted(((name, times[1]) for name, times in modules.items() if times[2] == 0),
+                           key=lambda item: -item[1])
+            forbidden = sorted(name for name in modules if name.split('.')[0] in FORBIDDEN[target]
+                               and '.' not in name)
+            median_ms = wall_time(args, runs)
+            results.append({'target': target, 'median_ms': median_ms, 'budget_ms': BUDGET_MS[target],
+                            'import_ms': sum(cumulative for _, cumulative in roots) / 1000.0,
+                            'top_imports': [[name, cumulative / 1000.0] for name, cumulative in roots[:top]],
+                            'forbidden_imports': forbidden,
+                            'ok': median_ms <= BUDGET_MS[target] and not forbidden})
+    return results
+
+
+def main(argv):
+    targets = ['help', 'features', 'django']
+    SVM_joblib_file_path = ""
+    runs = 5
+    top = 10
+    output_file_path = ""
+    try:
+        opts, args = getopt.getopt(argv, "ht:j:n:k:o:", ["targets=", "joblib=", "runs=", "top=", "output="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__doc__)
+                sys.exit()
+            if opt in ("-t", "--targets"):
+                targets = [target for target in arg.split(',') if target]
+            if opt in ("-j", "--joblib"):
+                SVM_joblib_file_path = arg
+            if opt in ("-n", "--runs"):
+                runs = int(arg)
+            if opt in ("-k", "--top"):
+                top = int(arg)
+            if opt in ("-o", "--output"):
+                output_file_path = arg
+        unknown = [target for target in targets if target not in BUDGET_MS]
+        if unknown or ('predict' in targets and not SVM_joblib_file_path):
+            raise ValueError("unknown targets %s" % unknown if unknown else "the predict target needs -j")
+    except (getopt.GetoptError, ValueError) as e:
+        print(__doc__ + "\n   Error: %s" % e)
+        sys.exit()
+
+    results = measure(targets, SVM_joblib_file_path, runs, top)
+    for result in results:
+        print("%-9s %7.1f ms (budget %d ms, imports %.1f ms) %s" % (
+            result['target'], result['median_ms'], result['budget_ms'], result['import_ms'],
+            "ok" if result['ok'] else "OVER BUDGET" if not result['forbidden_imports'] else
+            "imports " + ", ".join(result['forbidden_imports'])))
+        for name, cumulative in result['top_imports']:
+            print("    %8.1f ms  %s" % (cumulative, name))
+    if output_file_path:
+        with open(output_file_path, 'w') as f:
+            json.dump(results, f, indent=1)
+    if not all(result['ok'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,3 +1,708 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.test import (AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+
+from apis import (admission, batching, checkpoint, csvwriter, features, mutation, neighbours, parity, planner,
+                  prediction, registry, response_cache, shard, sparse, train, window)
+from apis.executors import shutdown_executor
+from apis.models import Peptide
+
+SLOW_MODEL_PATH = 'slow-test-model'
+
+
+class SlowModel:
+    """Stands in for the SVM: a fixed cost per call spent outside the GIL."""
+    delay = 0.2
+
+    def predict(self, X):
+        time.sleep(self.delay)
+        return [1] * len(X)
+
+
+class SlowModelMixin:
+    """Serve a ``SlowModel`` taking ``model_delay`` seconds per call from ``SLOW_MODEL_PATH``."""
+    model_delay = 0
+
+    def setUp(self):
+        super().setUp()
+        prediction._models[SLOW_MODEL_PATH] = SlowModel()
+        self.addCleanup(prediction._models.pop, SLOW_MODEL_PATH)
+        SlowModel.delay, delay = self.model_delay, SlowModel.delay
+        self.addCleanup(setattr, SlowModel, 'delay', delay)
+
+
+# Without micro-batching every request reaches the executor with its own model call.
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH,
+                   BIP_EXECUTOR='thread', BIP_EXECUTOR_WORKERS=8, BIP_MICRO_BATCHING=False)
+class ConcurrencyTests(SlowModelMixin, TestCase):
+    concurrent_requests = 8
+    model_delay = 0.2
+
+    def setUp(self):
+        super().setUp()
+        shutdown_executor()
+        self.addCleanup(shutdown_executor)
+
+    def bodies(self, first):
+        # Distinct peptides per request so nothing is answered from the store.
+        letters = 'ARNDCEQGHILKMFPSTWYV'
+        return [json.dumps({'peptides': ['GLFDIVKK' + letters[(first + i) % 20] + letters[(first + i) // 20 % 20]]})
+                for i in range(self.concurrent_requests)]
+
+    async def post_concurrently(self, path, bodies):
+        client = AsyncClient()
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(client.post(path, body, content_type='application/json')
+                                           for body in bodies))
+        return responses, time.perf_counter() - start
+
+    async def test_async_view_serves_concurrent_requests_faster(self):
+        # Under ASGI the sync view runs in the one thread-sensitive worker,
+        # so concurrent requests to it queue behind each other.
+        sync_responses, sync_elapsed = await self.post_concurrently('/predict', self.bodies(0))
+        async_responses, async_elapsed = await self.post_concurrently('/predict/async', self.bodies(100))
+
+        for response in list(sync_responses) + list(async_responses):
+            self.assertEqual(json.loads(response.content)[0]['Biofilm inhibitor'], 'BIP')
+        self.assertLess(async_elapsed, sync_elapsed / 2)
+
+
+class MicroBatchingTests(SimpleTestCase):
+    def test_concurrent_peptides_share_one_model_call(self):
+        calls = []
+
+        def predict_batch(sequences):
+            calls.append(list(sequences))
+            return [sequence.lower() for sequence in sequences], [float(len(sequence)) for sequence in sequences]
+
+        batcher = batching.MicroBatcher(predict_batch, max_wait_ms=200, max_batch_size=4)
+        self.addCleanup(batcher.stop)
+        futures = [batcher.submit(sequence) for sequence in ('GL', 'FDI', 'VKKV', 'VGALG', 'SL')]
+        self.assertEqual([future.result(5) for future in futures],
+                         [('gl', 2.0), ('fdi', 3.0), ('vkkv', 4.0), ('vgalg', 5.0), ('sl', 2.0)])
+        self.assertEqual(calls, [['GL', 'FDI', 'VKKV', 'VGALG'], ['SL']])
+        metrics = batcher.metrics()
+        self.assertEqual((metrics['batches'], metrics['requests'], metrics['max_batch_size']), (2, 5, 4))
+
+    def test_a_failed_batch_fails_each_of_its_requests(self):
+        def predict_batch(sequences):
+            raise ValueError("no model")
+
+        batcher = batching.MicroBatcher(predict_batch, max_wait_ms=1)
+        self.addCleanup(batcher.stop)
+        with self.assertRaisesMessage(ValueError, "no model"):
+            batcher.predict('GLFDIV', timeout=5)
+
+
+class FeatureParityTests(SimpleTestCase):
+    """The fused kernels must reproduce the PyDPI functions key for key."""
+    sequences = ['GLFDIVKKVVGALGSL', 'ARNDCEQGHILKMFPSTWYV', 'AA', 'AAAAKAAA', 'CCWWXBCC', 'KWKLFKKIGAVLKVL' * 7]
+
+    def test_every_family_matches_pydpi(self):
+        for sequence in self.sequences:
+            for family, (name, reference) in features.FAMILIES.items():
+                with self.subTest(sequence=sequence, family=name):
+                    self.assertEqual(list(features.calculate_features(sequence, (family,)).items()),
+                                     list(reference(sequence).items()))
+
+    def test_csv_round_trips_against_the_old_writers(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        input_file_path = os.path.join(root.name, 'input.txt')
+        with open(input_file_path, 'w') as f:
+            f.write('\n'.join(self.sequences) + '\n')
+        for family, (name, reference) in features.FAMILIES.items():
+            with self.subTest(family=name):
+                output_file_path = os.path.join(root.name, name + '.csv')
+                csvwriter.featurize_file(input_file_path, output_file_path, (family,), 2 if family == 2 else 3)
+                with open(output_file_path) as f:
+                    written = [line.split(',') for line in f.read().splitlines()]
+                # The PyDPI *4All writers: a quoted key list with the underscores
+                # dropped, then str() of every value with a trailing comma. The
+                # CTD names now keep the leading underscore of the training file.
+                keys = list(reference('AD'))
+                old_header = 'seq,' + str(keys).replace('[', '').replace(']', '').replace("'", '').replace('_', '') + ','
+                self.assertEqual([name.replace('_', '') for name in written[0]],
+                                 [key.strip() for key in old_header.split(',')[:-1]])
+                self.assertEqual(written[0][1:], keys)
+                for sequence, row in zip(self.sequences, written[1:]):
+                    values = reference(sequence)
+                    old_row = (sequence + ',' + ''.join(str(values[key]) + ',' for key in keys)).split(',')[:-1]
+                    self.assertEqual(row[0], old_row[0])
+                    self.assertEqual([float(value) for value in row[1:]], [float(value) for value in old_row[1:]])
+
+
+class WindowTests(SimpleTestCase):
+    """Every incrementally updated window must equal the featurization of that stretch on its own."""
+    protein = 'GLFDIVKKAAAAAVVGALGSLLLLKWXKWWWCCKAAABAKKGGGG'
+
+    def test_every_window_matches_full_featurization(self):
+        for size in (2, 3, 7, 16, len(self.protein)):
+            with self.subTest(window=size):
+                windows = list(window.WindowScanner(self.protein, size))
+                self.assertEqual([start for start, _ in windows], list(range(len(self.protein) - size + 1)))
+                for start, result in windows:
+                    self.assertEqual(result, features.calculate_features(self.protein[start:start + size]))
+
+    def test_scan_file_scores_every_window(self):
+        from joblib import dump
+        from sklearn.svm import SVC
+
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        path = lambda name: os.path.join(root.name, name)
+        columns = features.feature_names()
+        corpus = parity.synthetic_corpus(40)
+        model = SVC().fit(features.feature_matrix(corpus, columns), [int('K' in peptide[:5]) for peptide in corpus])
+        dump(model, path('model.joblib'))
+        self.addCleanup(prediction.forget_model, path('model.joblib'))
+        with open(path('proteins.txt'), 'w') as f:
+            f.write(self.protein + '\nGLFDIV\n' + self.protein[::-1] + '\n')
+        window.scan_file(path('model.joblib'), path('proteins.txt'), path('tracks.csv'), 10)
+        with open(path('tracks.csv')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'protein,position,window,label,score')
+        # The second protein is shorter than the window and has no rows.
+        expected = [(index, start + 1, protein[start:start + 10])
+                    for index, protein in ((1, self.protein), (3, self.protein[::-1]))
+                    for start in range(len(protein) - 9)]
+        labels, scores = prediction.predict_sequences(model, [sequence for _, _, sequence in expected], columns)
+        rows = [line.split(',') for line in lines[1:]]
+        self.assertEqual([(int(r[0]), int(r[1]), r[2], r[3]) for r in rows],
+                         [row + (label,) for row, label in zip(expected, labels)])
+        for row, score in zip(rows, scores):
+            self.assertAlmostEqual(float(row[4]), score, places=9)
+
+
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH)
+class ScanViewTests(SlowModelMixin, TestCase):
+    def test_one_track_per_protein(self):
+        response = Client().post('/scan', json.dumps({'proteins': ['GLFDIVKKVVGALGSL', 'gl fd'], 'window': 10}),
+                                 content_type='application/json')
+        tracks = json.loads(response.content)
+        self.assertEqual([(t['Protein'], t['Window'], len(t['Track'])) for t in tracks],
+                         [('GLFDIVKKVVGALGSL', 10, 7), ('GLFD', 10, 0)])
+        self.assertEqual([(p['Position'], p['Biofilm inhibitor']) for p in tracks[0]['Track']],
+                         [(position, 'BIP') for position in range(1, 8)])
+        response = Client().post('/scan', json.dumps({'proteins': ['GLFDIV'], 'window': 1}),
+                                 content_type='application/json')
+        self.assertIn('Window length', json.loads(response.content)[0]['Error'])
+
+
+class SparseParityTests(SimpleTestCase):
+    """The CSR path must give the dense features and decision scores of the fitted pipeline."""
+    sequences = FeatureParityTests.sequences + ['KKLLKKLLKKLL', 'FLPIIAKLLSGLL', 'GIGKFLHSAKKFGKAFVGEIMNS']
+
+    def test_csr_features_and_scores_match_dense(self):
+        import numpy as np
+        import pandas as pd
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.svm import SVC
+
+        columns = features.feature_names()
+        dense = features.feature_matrix(self.sequences, columns)
+        self.assertTrue(np.array_equal(sparse.feature_matrix(self.sequences, columns).toarray(), dense))
+        labels = [i % 2 for i in range(len(self.sequences))]
+        scalers = [(kernel, {}) for kernel in ('rbf', 'linear', 'poly', 'sigmoid')]
+        scalers += [('rbf', {'with_mean': False}), ('rbf', {'with_std': False})]
+        for kernel, options in scalers:
+            with self.subTest(kernel=kernel, **options):
+                model = Pipeline([('standardize', StandardScaler(**options)), ('svc', SVC(kernel=kernel))]).fit(
+                    pd.DataFrame(dense, columns=columns), labels)
+                sparse_labels, sparse_scores = sparse.predict_sequences(model, self.sequences, columns)
+                dense_labels, dense_scores = prediction.predict_sequences(model, self.sequences, columns)
+                self.assertEqual(sparse_labels, dense_labels)
+                np.testing.assert_allclose(sparse_scores, dense_scores, rtol=0, atol=1e-9)
+
+
+    def test_sparse_models_share_support_vectors_and_are_dropped_with_the_model(self):
+        import gc
+        from sklearn.svm import SVC
+
+        columns = features.feature_names((1,))
+        model = SVC().fit(features.feature_matrix(self.sequences, columns), [i % 2 for i in range(len(self.sequences))])
+        self.assertIs(sparse.sparse_model(model).support_vectors, model.support_vectors_)
+        self.assertIs(sparse.sparse_model(model), sparse.sparse_model(model))
+        count = len(sparse._sparse_models)
+        del model
+        gc.collect()
+        self.assertEqual(len(sparse._sparse_models), count - 1)
+
+
+class Float32ParityTests(SimpleTestCase):
+    """float32 feature matrices must give the labels of float64 ones in half the memory."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import pandas as pd
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.svm import SVC
+
+        cls.columns = features.feature_names()
+        cls.corpus = parity.synthetic_corpus(200)
+        cls.X = features.feature_matrix(cls.corpus, cls.columns)
+        cls.model = Pipeline([('scaler', StandardScaler()), ('svc', SVC())]).fit(
+            pd.DataFrame(cls.X, columns=cls.columns), [int('K' in peptide[:5]) for peptide in cls.corpus])
+
+    def test_float32_labels_match_float64(self):
+        report = parity.compare(self.model, self.X, self.corpus, self.columns)
+        self.assertEqual(report['disagreements'], [])
+        self.assertEqual(report['float32_bytes'] * 2, report['float64_bytes'])
+
+    def test_chunked_float32_predictions_equal_one_call(self):
+        rows = self.X.tolist()
+        with mock.patch.object(prediction, 'PREDICT_CHUNK_ROWS', len(rows)):
+            whole = prediction.predict_rows(self.model, rows, self.columns, 'float32')
+        with mock.patch.object(prediction, 'PREDICT_CHUNK_ROWS', 16):
+            chunked = prediction.predict_rows(self.model, rows, self.columns, 'float32')
+        self.assertEqual(list(chunked[0]), list(whole[0]))
+        self.assertEqual(list(chunked[1]), list(whole[1]))
+        self.assertEqual(len(chunked[0]), len(rows))
+
+
+class ShardTests(SimpleTestCase):
+    peptides = ['GLFDIVKKVVGALGSL', 'KKLLKKLLKKLL', 'FLPIIAKLLSGLL', 'GIGKFLHSAKKFGKAFVGEIMNS', 'ARNDCEQGHILKMFPSTWYV',
+                'KWKLFKKIGAVLKVL', 'AAAAKAAA']
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.path = lambda name: os.path.join(root.name, name)
+        with open(self.path('input.txt'), 'w') as f:
+            f.write('\n'.join(self.peptides) + '\n')
+
+    def featurize_shards(self, by):
+        manifest = self.path('manifest.json')
+        shard.split(self.path('input.txt'), 3, by, manifest)
+        outputs = [self.path('shard-%d.csv' % k) for k in (1, 2, 3)]
+        for k, output in enumerate(outputs, 1):
+            csvwriter.featurize_file(self.path('input.txt'), output, (1,), shard=(k, 3), manifest_file_path=manifest)
+        return manifest, outputs
+
+    def test_merged_shards_equal_the_unsharded_output(self):
+        csvwriter.featurize_file(self.path('input.txt'), self.path('whole.csv'), (1,))
+        with open(self.path('whole.csv')) as f:
+            whole = f.read()
+        for by in shard.BY:
+            with self.subTest(by=by):
+                manifest, outputs = self.featurize_shards(by)
+                self.assertEqual(shard.merge(manifest, outputs, self.path('merged.csv')), len(self.peptides))
+                with open(self.path('merged.csv')) as f:
+                    self.assertEqual(f.read(), whole)
+
+    def test_merge_rejects_reordered_shards_and_a_changed_input(self):
+        manifest, outputs = self.featurize_shards('records')
+        with self.assertRaisesMessage(ValueError, "Shard 1/3"):
+            shard.merge(manifest, outputs[::-1], self.path('merged.csv'))
+        with self.assertRaisesMessage(ValueError, "Expected 3 shard outputs, got 2"):
+            shard.merge(manifest, outputs[:2], self.path('merged.csv'))
+        # Same size, new content: only the modification time tells.
+        with open(self.path('input.txt'), 'r+') as f:
+            f.write('K')
+        os.utime(self.path('input.txt'), ns=(0, os.stat(manifest).st_mtime_ns + 10 ** 9))
+        with self.assertRaisesMessage(ValueError, "changed since the manifest"):
+            shard.merge(manifest, outputs, self.path('merged.csv'))
+
+    def test_failed_merge_leaves_the_previous_output(self):
+        manifest, outputs = self.featurize_shards('bytes')
+        with open(self.path('merged.csv'), 'w') as f:
+            f.write('previous\n')
+        with self.assertRaisesMessage(ValueError, "Shard 1/3"):
+            shard.merge(manifest, outputs[::-1], self.path('merged.csv'))
+        with open(self.path('merged.csv')) as f:
+            self.assertEqual(f.read(), 'previous\n')
+        self.assertFalse(os.path.exists(self.path('merged.csv.tmp')))
+
+    def test_local_run_featurizes_a_list_of_families(self):
+        csvwriter.featurize_file(self.path('input.txt'), self.path('whole.csv'), (1, 3))
+        rows = shard.run_local(self.path('input.txt'), 2, shard.parse_families('3,1'), self.path('merged.csv'),
+                               workdir=self.path('work'))
+        self.assertEqual(rows, len(self.peptides))
+        with open(self.path('merged.csv')) as f, open(self.path('whole.csv')) as whole:
+            self.assertEqual(f.read(), whole.read())
+        with self.assertRaisesMessage(ValueError, "not '4'"):
+            shard.parse_families('4')
+
+
+class CheckpointTests(SimpleTestCase):
+    peptides = ShardTests.peptides * 3
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.path = lambda name: os.path.join(root.name, name)
+        with open(self.path('input.txt'), 'w') as f:
+            f.write('\n'.join(self.peptides) + '\n')
+        checkpoint.CHECKPOINT_SECONDS, seconds = 0, checkpoint.CHECKPOINT_SECONDS
+        self.addCleanup(setattr, checkpoint, 'CHECKPOINT_SECONDS', seconds)
+
+    def crash_on_call(self, target, name, call):
+        """Patch ``target.name`` to raise ``RuntimeError`` on its ``call``-th call."""
+        original = getattr(target, name)
+        calls = []
+
+        def crashing(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == call:
+                raise RuntimeError("crash")
+            return original(*args, **kwargs)
+        return mock.patch.object(target, name, crashing)
+
+    def read(self, name):
+        with gzip.open(self.path(name), 'rt') if name.endswith('.gz') else open(self.path(name)) as f:
+            return f.read()
+
+    def test_interrupted_featurization_resumes_to_the_same_output(self):
+        csvwriter.featurize_file(self.path('input.txt'), self.path('whole.csv.gz'), chunk_rows=4)
+        with self.crash_on_call(csvwriter, 'format_block', 3), self.assertRaises(RuntimeError):
+            csvwriter.featurize_file(self.path('input.txt'), self.path('resumed.csv.gz'), chunk_rows=4)
+        self.assertFalse(os.path.exists(self.path('resumed.csv.gz')))
+        self.assertTrue(os.path.exists(self.path('resumed.csv.gz.ckpt')))
+        with self.assertRaises(ValueError):
+            csvwriter.featurize_file(self.path('input.txt'), self.path('resumed.csv.gz'), precision=2, chunk_rows=4,
+                                     resume=True)
+        csvwriter.featurize_file(self.path('input.txt'), self.path('resumed.csv.gz'), chunk_rows=4, resume=True)
+        self.assertEqual(self.read('resumed.csv.gz'), self.read('whole.csv.gz'))
+        self.assertEqual(sorted(os.listdir(self.path(''))), ['input.txt', 'resumed.csv.gz', 'whole.csv.gz'])
+
+    def test_interrupted_prediction_resumes_to_the_same_output(self):
+        import pandas as pd
+        from joblib import dump
+        from sklearn.svm import SVC
+
+        columns = features.feature_names((1,))
+        X = pd.DataFrame(features.feature_matrix(self.peptides, columns), columns=columns)
+        dump(SVC().fit(X, [int('K' in peptide[:4]) for peptide in self.peptides]), self.path('model.joblib'))
+        self.addCleanup(prediction.forget_model, self.path('model.joblib'))
+        csvwriter.featurize_file(self.path('input.txt'), self.path('features.csv'), (1,))
+        arguments = (self.path('model.joblib'), self.path('features.csv'))
+        prediction.perform_prediction(*arguments, self.path('whole.csv'), chunk_rows=4, executor='inline')
+        with self.crash_on_call(prediction, 'predict_rows', 3), self.assertRaises(RuntimeError):
+            prediction.perform_prediction(*arguments, self.path('resumed.csv'), chunk_rows=4, executor='inline')
+        self.assertTrue(os.path.exists(self.path('resumed.csv.ckpt')))
+        prediction.perform_prediction(*arguments, self.path('resumed.csv'), chunk_rows=4, executor='inline',
+                                      resume=True)
+        self.assertEqual(self.read('resumed.csv'), self.read('whole.csv'))
+
+
+class GridSearchTests(SimpleTestCase):
+    def test_cached_gram_scores_match_cross_validation(self):
+        import numpy as np
+        from sklearn.model_selection import StratifiedKFold, cross_val_score
+
+        corpus = parity.synthetic_corpus(60)
+        X = features.feature_matrix(corpus, features.feature_names((1,)))
+        y = np.array([int('K' in peptide[:5]) for peptide in corpus])
+        results = train.grid_search(X, y, C_values=(0.1, 10.0), gamma_values=('scale', 0.01), folds=3, n_jobs=1)
+        self.assertEqual(len(results), 2 + 2 * 2 * 2)
+        self.assertEqual(results, sorted(results, key=lambda result: result['mean_score'], reverse=True))
+        folds = StratifiedKFold(n_splits=3, shuffle=True, random_state=0)
+        for result in results:
+            with self.subTest(kernel=result['kernel'], C=result['C'], gamma=result['gamma']):
+                model = train.fit_model(X, y, result['kernel'], result['C'], result['gamma'])
+                np.testing.assert_allclose(result['scores'], cross_val_score(model, X, y, cv=folds), atol=1e-9)
+
+
+class PlannerTests(SimpleTestCase):
+    calibration = planner.DEFAULT_CALIBRATION
+
+    def test_plans_grow_with_the_job(self):
+        small = planner.plan(10, 300, workers=8, calibration=self.calibration)
+        self.assertEqual((small.mode, small.workers, small.chunk_rows), ('inline', 1, 10))
+        large = planner.plan(200000, 6000000, workers=8, calibration=self.calibration)
+        self.assertEqual(large.mode, 'process')
+        self.assertGreaterEqual(-(-200000 // large.chunk_rows), 8 * planner.CHUNKS_PER_WORKER)
+        self.assertEqual(planner.plan(200000, 6000000, workers=1, calibration=self.calibration).mode, 'inline')
+        # Prediction alone parallelizes on threads, without paying for processes.
+        self.assertEqual(planner.plan(20000, 0, (), workers=8, calibration=self.calibration).mode, 'thread')
+
+
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH, BIP_EXECUTOR='auto')
+class PlannedPredictionTests(SlowModelMixin, TestCase):
+    def test_sync_and_async_predictions_are_planned(self):
+        for path, peptides in (('/predict', ['GLFDIVKKVVGALGSL', 'KKLLKKLLKKLL']),
+                               ('/predict/async', ['FLPLLAGLAANFLPK', 'ILPWKWPWWPWRR'])):
+            with self.subTest(path=path), mock.patch('apis.views.plan', wraps=planner.plan) as plan:
+                response = Client().post(path, json.dumps({'peptides': peptides}), content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(plan.call_args[0][:2], (2, sum(map(len, peptides))))
+
+
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH)
+class StoreTests(SlowModelMixin, TestCase):
+    def post(self, peptides, fmt='json'):
+        return Client().post('/predict?format=' + fmt, json.dumps({'peptides': peptides}),
+                             content_type='application/json')
+
+    def test_repeated_peptides_are_answered_from_the_store(self):
+        peptides = ['GLFDIVKKVVGALGSL', 'KKLLKKLLKKLL']
+        first = json.loads(self.post(peptides).content)
+        with mock.patch.object(SlowModel, 'predict', side_effect=AssertionError("the model was called")):
+            again = [json.loads(line) for line in b''.join(self.post(peptides[::-1], 'ndjson').streaming_content)
+                     .decode().splitlines()]
+        self.assertEqual(again[::-1], first)
+        self.assertEqual(Peptide.objects.count(), 2)
+
+    def test_non_letter_residues_are_rejected_before_streaming(self):
+        for fmt in ('json', 'ndjson'):
+            with self.subTest(fmt=fmt):
+                response = self.post(['GLFDIV\u00e9KK'], fmt)
+                self.assertFalse(response.streaming)
+                self.assertIn('residue codes A-Z', json.loads(response.content)[0]['Error'])
+
+
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH, BIP_STREAM_CHUNK_SIZE=3)
+class StreamingTests(SlowModelMixin, TestCase):
+    peptides = ['GLFDIVKKVVGALGSL', 'KKLLKKLLKKLL', 'FLPLLAGLAANFLPK', 'GLFDIVKKVVGALGSL', 'ILPWKWPWWPWRR',
+                'AAAAKAAA', 'KWKLFKKIGAVLKVL']
+
+    def body(self):
+        return json.dumps({'peptides': self.peptides})
+
+    def check_lines(self, response, fmt, text):
+        lines = text.splitlines()
+        if fmt == 'ndjson':
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            records = [json.loads(line) for line in lines]
+        else:
+            self.assertEqual(response['Content-Type'], 'text/csv')
+            self.assertEqual(lines[0], 'Peptide sequence,Biofilm inhibitor,Decision score,Model version')
+            records = [dict(zip(lines[0].split(','), line.split(','))) for line in lines[1:]]
+        self.assertEqual([record['Peptide sequence'] for record in records], self.peptides)
+        self.assertEqual({record['Biofilm inhibitor'] for record in records}, {'BIP'})
+
+    def test_sync_streams_one_line_per_peptide_in_order(self):
+        for fmt in ('ndjson', 'csv'):
+            with self.subTest(fmt=fmt):
+                response = Client().post('/predict?format=' + fmt, self.body(), content_type='application/json')
+                self.assertTrue(response.streaming)
+                self.check_lines(response, fmt, b''.join(response.streaming_content).decode())
+
+    async def test_async_streams_one_line_per_peptide_in_order(self):
+        for fmt in ('ndjson', 'csv'):
+            with self.subTest(fmt=fmt):
+                response = await AsyncClient().post('/predict/async?format=' + fmt, self.body(),
+                                                    content_type='application/json')
+                self.assertTrue(response.streaming)
+                self.check_lines(response, fmt, b''.join([chunk async for chunk in response.streaming_content]).decode())
+
+
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH, BIP_ADMISSION_CAPACITY=20,
+                   BIP_ADMISSION_MAX_QUEUE=0, BIP_ADMISSION_TIMEOUT=0, BIP_ADMISSION_JOB_COST=30)
+class AdmissionTests(SlowModelMixin, TransactionTestCase):
+    def post(self, peptides):
+        return Client().post('/predict', json.dumps({'peptides': peptides}), content_type='application/json')
+
+    def test_full_server_answers_429_with_retry_after(self):
+        with admission.get_controller().admit(20):
+            response = self.post(['GLFDIVKKVV'])
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(self.post(['GLFDIVKKVV']).status_code, 200)
+
+    def test_streams_and_uploads_are_refused_when_saturated(self):
+        client = Client()
+        body = json.dumps({'peptides': ['GLFDIVKKVV']})
+        with admission.get_controller().admit(20):
+            for path in ('/predict?format=ndjson', '/predict?format=csv', '/predict/async?format=ndjson'):
+                with self.subTest(path=path):
+                    response = client.post(path, body, content_type='application/json')
+                    self.assertEqual(response.status_code, 429)
+                    self.assertIn('Retry-After', response)
+            response = client.post('/predict/upload', b'GLFDIVKKVV\n', content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 429)
+        response = client.post('/predict?format=ndjson', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['Peptide sequence'], 'GLFDIVKKVV')
+
+    def test_oversized_request_becomes_a_job(self):
+        peptides = ['GLFDIVKKVVGALGSL', 'KKLLKKLLKKLL', 'FLPIIAKLLSGLL']
+        response = self.post(peptides)
+        self.assertEqual(response.status_code, 202)
+        [accepted] = json.loads(response.content)
+        self.assertEqual(response['Location'], accepted['Location'])
+        deadline = time.monotonic() + 10
+        while True:
+            [found] = json.loads(Client().get(response['Location']).content)
+            if found['Status'] in ('done', 'failed') or time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        self.assertEqual(found['Status'], 'done')
+        self.assertEqual([(r['Peptide sequence'], r['Biofilm inhibitor']) for r in found['Results']],
+                         [(peptide, 'BIP') for peptide in peptides])
+
+
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH)
+class ResponseCacheTests(SlowModelMixin, TestCase):
+    body = json.dumps({'peptides': ['GLFDIVKKVVGALGSL']})
+
+    def setUp(self):
+        super().setUp()
+        caches[settings.BIP_RESPONSE_CACHE].clear()
+
+    def post(self, **headers):
+        return Client().post('/predict', self.body, content_type='application/json', headers=headers)
+
+    def test_etag_revalidation_and_cached_responses(self):
+        first = self.post()
+        self.assertEqual(first.status_code, 200)
+        revalidated = self.post(if_none_match=first['ETag'])
+        self.assertEqual((revalidated.status_code, revalidated['ETag']), (412, first['ETag']))
+        self.assertEqual(self.post(if_none_match='*').content, first.content)
+        hits = response_cache.stats.hits
+        self.assertEqual(self.post(if_none_match='"stale"').content, first.content)
+        self.assertEqual(response_cache.stats.hits, hits + 1)
+        with self.settings(BIP_MODEL_VERSION='2'):
+            self.assertNotEqual(self.post()['ETag'], first['ETag'])
+
+    def test_matching_tag_is_304_for_get_and_head_only(self):
+        tag = response_cache.etag('key')
+        for method, status in (('get', 304), ('head', 304), ('post', 412), ('put', 412)):
+            with self.subTest(method=method):
+                request = getattr(RequestFactory(), method)('/predict', headers={'if_none_match': tag})
+                self.assertEqual(response_cache.cached(request, 'key').status_code, status)
+
+
+class MutationScannerTests(SimpleTestCase):
+    def test_delta_rows_match_full_featurization(self):
+        columns = features.feature_names()
+        for peptide in ('GLFDIVKKAAAAVVGLLLW', 'AA', 'KKKK', 'GLXKKAAW'):
+            with self.subTest(peptide=peptide):
+                mutants = list(mutation.MutationScanner(peptide, columns).mutants())
+                standard = sum(residue != 'X' for residue in peptide)
+                self.assertEqual(len(mutants), 19 * standard)
+                for position, original, substitute, sequence, row in mutants:
+                    self.assertNotEqual(original, 'X')
+                    self.assertEqual(sequence, peptide[:position - 1] + substitute + peptide[position:])
+                    full = features.calculate_features(sequence)
+                    self.assertEqual(row, [full[column] for column in columns])
+
+
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH, BIP_MUTANTS_MAX_LENGTH=10)
+class MutantsTests(SlowModelMixin, TestCase):
+    def mutants(self, body):
+        return json.loads(Client().post('/mutants', json.dumps(body), content_type='application/json').content)
+
+    def test_every_single_point_mutant_is_scored(self):
+        records = self.mutants({'peptide': 'GLFDIV'})
+        self.assertEqual(len(records), 19 * 6)
+        self.assertEqual({(r['Position'], r['Original']) for r in records}, set(enumerate('GLFDIV', 1)))
+        first = records[0]
+        self.assertEqual((first['Substitute'], first['Peptide sequence'], first['Biofilm inhibitor']),
+                         ('A', 'ALFDIV', 'BIP'))
+        self.assertEqual(len(self.mutants({'peptide': 'GLFDIV', 'top': 3})), 3)
+
+    def test_long_peptides_are_rejected(self):
+        self.assertEqual(self.mutants({'peptide': 'GLFDIVKKVVG'}),
+                         [{'Error': 'Peptides may have at most 10 residues for a mutant scan'}])
+
+
+class NeighboursTests(SimpleTestCase):
+    def test_nearest_training_peptides_from_a_fresh_index(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        index_file_path = os.path.join(root.name, 'neighbours.npz')
+        self.addCleanup(neighbours._indexes.clear)
+        client = Client()
+        with self.settings(BIP_NEIGHBOUR_INDEX=index_file_path):
+            response = client.post('/neighbours', json.dumps({'peptides': ['GLFDIVKKVVGALGSL'], 'k': 3}),
+                                   content_type='application/json')
+            [record] = json.loads(response.content)
+            self.assertEqual((record['Peptide sequence'], record['Training match']), ('GLFDIVKKVVGALGSL', None))
+            similarities = [n['Similarity'] for n in record['Neighbours']]
+            self.assertEqual(len(similarities), 3)
+            self.assertEqual(similarities, sorted(similarities, reverse=True))
+            self.assertTrue(os.path.exists(index_file_path))
+            response = client.post('/neighbours', json.dumps({'peptides': ['GLFDIV'], 'k': 0}),
+                                   content_type='application/json')
+            self.assertIn('k must be between 1', json.loads(response.content)[0]['Error'])
+
+
+class RegistryTests(SlowModelMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.registry = registry.ModelRegistry(root.name, poll_seconds=0, mmap_mode='r')
+
+    def test_registered_model_arrays_are_memory_mapped(self):
+        import numpy as np
+        import pandas as pd
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.svm import SVC
+
+        columns = features.feature_names((1,))
+        corpus = parity.synthetic_corpus(60)
+        model = Pipeline([('scaler', StandardScaler()), ('svc', SVC())]).fit(
+            pd.DataFrame(features.feature_matrix(corpus, columns), columns=columns),
+            [int('K' in peptide[:5]) for peptide in corpus])
+        self.registry.activate(self.registry.save(model, columns, 'v1'))
+        served = self.registry.current()
+        self.addCleanup(prediction.forget_model, served.path)
+        self.assertIsInstance(served.model.steps[-1][1].support_vectors_, np.memmap)
+        self.assertIsInstance(served.model.steps[0][1].mean_, np.memmap)
+        self.assertEqual(served.predict_sequences(corpus), prediction.predict_sequences(model, corpus, columns))
+
+    def test_activated_version_is_swapped_in_and_old_batchers_stop(self):
+        columns = features.feature_names((1,))
+        self.registry.activate(self.registry.save(SlowModel(), columns, 'v1'))
+        old = self.registry.current()
+        self.assertEqual((old.version, old.columns), ('v1', columns))
+        old_batcher = batching.get_batcher(old)
+        self.assertEqual(old_batcher.predict('GLFDIVKKVVGALGSL', timeout=5), ('BIP', None))
+
+        self.registry.activate(self.registry.save(SlowModel(), columns, 'v2'))
+        self.registry.reload('v2', wait=True)
+        self.assertEqual(self.registry.current().version, 'v2')
+        old_batcher._thread.join(5)
+        self.assertFalse(old_batcher._thread.is_alive())
+        self.assertNotIn(old_batcher, batching._batchers.values())
+        # A request still holding the old version is answered all the same.
+        self.assertEqual(old_batcher.predict('GLFDIVKKVVGALGSL', timeout=5), ('BIP', None))
+        served = self.registry.current()
+        self.addCleanup(prediction.forget_model, served.path)
+        self.addCleanup(batching.stop_batchers, served.path)
+        self.assertNotEqual(batching.get_batcher(served), old_batcher)
+
+
+@override_settings(BIP_MODEL_DIR='no-such-registry', BIP_MODEL_PATH=SLOW_MODEL_PATH, BIP_STREAM_CHUNK_SIZE=2,
+                   BIP_UPLOAD_BLOCK_SIZE=16)
+class UploadTests(SlowModelMixin, TestCase):
+    fasta = b">first\nGLFDIV\nKKVVGALGSL\n>short\nA\n>third\nARNDCEQGHILKMFPSTWYV\n\n"
+
+    def upload(self, body, fmt='json'):
+        response = Client().post('/predict/upload?format=' + fmt, body, content_type='application/octet-stream')
+        return b''.join(response.streaming_content).decode()
+
+    def test_gzip_fasta_is_predicted_record_by_record(self):
+        records = json.loads(self.upload(gzip.compress(self.fasta)))
+        self.assertEqual([(r['ID'], r['Peptide sequence'], r['Biofilm inhibitor']) for r in records],
+                         [('first', 'GLFDIVKKVVGALGSL', 'BIP'), ('short', 'A', None),
+                          ('third', 'ARNDCEQGHILKMFPSTWYV', 'BIP')])
+        self.assertIn('two residues', records[1]['Error'])
+
+    def test_plain_upload_and_truncated_gzip(self):
+        lines = self.upload(b"GLFDIVKKVVGALGSL\nKKLLKKLLKK\n", 'csv').splitlines()
+        self.assertEqual(lines[0], 'ID,Peptide sequence,Biofilm inhibitor,Decision score,Model version,Error')
+        self.assertEqual([line.split(',')[:3] for line in lines[1:]],
+                         [['1', 'GLFDIVKKVVGALGSL', 'BIP'], ['2', 'KKLLKKLLKK', 'BIP']])
+        records = [json.loads(line) for line in self.upload(gzip.compress(self.fasta)[:-6], 'ndjson').splitlines()]
+        self.assertEqual(records[-1]['Error'], 'The gzip upload is truncated')
+
+    def test_non_ascii_residue_is_an_error_row(self):
+        records = json.loads(self.upload(b'GLFDIVKK\nGLF\xc3\xa9DIV\nKKLLKKLLKK\n'))
+        self.assertEqual([(r['ID'], r['Biofilm inhibitor']) for r in records], [('1', 'BIP'), ('2', None), ('3', 'BIP')])
+        self.assertIn('residue codes A-Z', records[1]['Error'])
@@ -0,0 +1,261 @@
+"""Retrain the SVM from the training file and register it as a new model version.
+
+Loads the AAC, DPC and CTD columns of ``new_all_feature_train2_pydpi.csv``
+(the columns the service can compute for a new peptide) and the ``Y``
+label, then runs a stratified k-fold grid search over kernel, C and gamma
+in parallel worker processes. Kernel matrices are never recomputed per
+parameter setting: for every fold the scaled linear Gram matrix and the
+squared distances are computed once, and each linear, rbf and poly kernel
+of the grid is derived from them and fitted with ``kernel='precomputed'``
+for all values of C. The best setting is refitted on the whole file as a
+``StandardScaler`` + ``SVC`` pipeline and saved to the model registry.
+
+USAGE:
+  train.py [-t <training csv>] [-d <registry dir>] [-v <version>] [-a]
+           [-k linear,rbf,poly] [-c <C values>] [-g <gamma values|scale>] [-b]
+           [-n <folds>] [-s <scoring>] [-j <jobs>] [-r <seed>] [-o <cv results json>]
+
+  -a  activate the new version     -b  class_weight='balanced'
+  scoring: accuracy, balanced_accuracy, f1, mcc or roc_auc
+"""
+import getopt
+import json
+import os
+import sys
+import time
+
+try:
+    from apis import features
+    from apis.registry import ModelRegistry
+except ImportError:
+    import features
+    from registry import ModelRegistry
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TRAINING_FILE = os.path.join(HERE, 'new_all_feature_train2_pydpi.csv')
+REGISTRY_DIR = os.path.join(HERE, 'model_registry')
+
+KERNELS = ('linear', 'rbf', 'poly')
+C_VALUES = (0.1, 1.0, 10.0, 100.0)
+GAMMA_VALUES = ('scale', 0.0001, 0.001, 0.01)
+POLY_DEGREE = 3
+POLY_COEF0 = 0.0
+
+
+def load_training(training_file_path=TRAINING_FILE, columns=None):
+    """Return ``(X, y)`` with ``X`` a DataFrame of ``columns`` (default: every family)."""
+    import pandas as pd
+
+    if columns is None:
+        columns = features.feature_names()
+    data = pd.read_csv(training_file_path)
+    # Headers are quoted (`` 'AR'``) and some names repeat, so select by position.
+    names = [features.normalize_column(name) for name in data.columns]
+    first = {}
+    for position, name in enumerate(names):
+        first.setdefault(name, position)
+    X = data.iloc[:, [first[column] for column in columns]].astype(float)
+    X.columns = list(columns)
+    y = data.iloc[:, -1].astype(int).values
+    return X, y
+
+
+def _score(scoring, y_true, y_pred, decision):
+    from sklearn import metrics
+
+    if scoring == 'roc_auc':
+        return metrics.roc_auc_score(y_true, decision)
+    return {
+        'accuracy': metrics.accuracy_score,
+        'balanced_accuracy': metrics.balanced_accuracy_score,
+        'f1': metrics.f1_score,
+        'mcc': metrics.matthews_corrcoef,
+    }[scoring](y_true, y_pred)
+
+
+class FoldKernels:
+    """Scaled linear Gram matrix and squared distances of one CV fold.
+
+    Rows are the whole data set, columns the fold's training rows, so the
+    train/train and test/train blocks are both slices of the same matrix.
+    """
+
+    def __init__(self, X, train, test):
+        import numpy as np
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler().fit(X[train])
+        Z = scaler.transform(X)
+        self.train = train
+        self.test = test
+        self.n_features = Z.shape[1]
+        self.variance = Z[train].var()
+        self.gram = Z @ Z[train].T
+        norms = np.einsum('ij,ij->i', Z, Z)
+        self.distances = np.maximum(norms[:, None] + norms[train][None, :] - 2 * self.gram, 0)
+
+    def gamma(self, gamma):
+        if gamma == 'scale':
+            return 1.0 / (self.n_features * self.variance) if self.variance else 1.0
+        return gamma
+
+    def kernel(self, kernel, gamma):
+        import numpy as np
+
+        if kernel == 'linear':
+            return self.gram
+        if kernel == 'rbf':
+            return np.exp(-self.gamma(gamma) * self.distances)
+        if kernel == 'poly':
+            return (self.gamma(gamma) * self.gram + POLY_COEF0) ** POLY_DEGREE
+        raise ValueError("Unsupported kernel %r" % kernel)
+
+
+def _evaluate(fold, y, kernel, gamma, C_values, class_weight, scoring):
+    """Fit one fold for every C on a kernel matrix computed once; return ``[(C, score)]``."""
+    from sklearn.svm import SVC
+
+    K = fold.kernel(kernel, gamma)
+    K_train, K_test = K[fold.train], K[fold.test]
+    scores = []
+    for C in C_values:
+        model = SVC(kernel='precomputed', C=C, class_weight=class_weight).fit(K_train, y[fold.train])
+        scores.append((C, _score(scoring, y[fold.test], model.predict(K_test), model.decision_function(K_test))))
+    return scores
+
+
+def grid_search(X, y, kernels=KERNELS, C_values=C_VALUES, gamma_values=GAMMA_VALUES, folds=5, scoring='accuracy',
+                class_weight=None, n_jobs=-1, seed=0):
+    """Return CV results, best first, as dicts with ``kernel``, ``C``, ``gamma``, ``mean_score`` and ``scores``."""
+    import numpy as np
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import StratifiedKFold
+
+    X = np.asarray(X, dtype=float)
+    splits = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(X, y)
+    fold_kernels = Parallel(n_jobs=n_jobs)(delayed(FoldKernels)(X, train, test) for train, test in splits)
+    settings = [(kernel, None if kernel == 'linear' else gamma)
+                for kernel in kernels for gamma in (gamma_values if kernel != 'linear' else (None,))]
+    tasks = [(n, kernel, gamma) for kernel, gamma in settings for n in range(len(fold_kernels))]
+    outcomes = Parallel(n_jobs=n_jobs)(
+        delayed(_evaluate)(fold_kernels[n], y, kernel, gamma, C_values, class_weight, scoring)
+        for n, kernel, gamma in tasks)
+
+    results = {}
+    for (n, kernel, gamma), scores in zip(tasks, outcomes):
+        for C, score in scores:
+            results.setdefault((kernel, C, gamma), []).append(score)
+    ranked = [{'kernel': kernel, 'C': C, 'gamma': gamma, 'mean_score': float(np.mean(scores)),
+               'std_score': float(np.std(scores)), 'scores': [float(s) for s in scores]}
+              for (kernel, C, gamma), scores in results.items()]
+    ranked.sort(key=lambda result: result['mean_score'], reverse=True)
+    return ranked
+
+
+def fit_model(X, y, kernel, C, gamma=None, class_weight=None):
+    """Fit the servable pipeline for one parameter setting on ``(X, y)``."""
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    svc = SVC(kernel=kernel, C=C, gamma='scale' if gamma is None else gamma, degree=POLY_DEGREE, coef0=POLY_COEF0,
+              class_weight=class_weight)
+    return Pipeline([('scaler', StandardScaler()), ('svc', svc)]).fit(X, y)
+
+
+def train(training_file_path=TRAINING_FILE, registry_dir=REGISTRY_DIR, version=None, activate=False,
+          kernels=KERNELS, C_values=C_VALUES, gamma_values=GAMMA_VALUES, folds=5, scoring='accuracy',
+          class_weight=None, n_jobs=-1, seed=0):
+    """Search, refit the best setting and register it; return ``(version, cv results)``."""
+    X, y = load_training(training_file_path)
+    start = time.perf_counter()
+    results = grid_search(X, y, kernels, C_values, gamma_values, folds, scoring, class_weight, n_jobs, seed)
+    search_seconds = time.perf_counter() - start
+    best = results[0]
+    model = fit_model(X, y, best['kernel'], best['C'], best['gamma'], class_weight)
+
+    registry = ModelRegistry(registry_dir)
+    version = registry.save(model, list(X.columns), version,
+                            training_file=os.path.abspath(training_file_path), samples=len(y),
+                            params={'kernel': best['kernel'], 'C': best['C'], 'gamma': best['gamma'],
+                                    'class_weight': class_weight},
+                            cv={'folds': folds, 'seed': seed, 'scoring': scoring, 'mean_score': best['mean_score'],
+                                'std_score': best['std_score'], 'search_seconds': search_seconds})
+    if activate:
+        registry.activate(version)
+    return version, results
+
+
+def _values(arg, convert=float):
+    return tuple(value if value == 'scale' else convert(value) for value in arg.split(',') if value)
+
+
+def main(argv):
+    training_file_path = TRAINING_FILE
+    registry_dir = REGISTRY_DIR
+    version = None
+    activate = False
+    kernels = KERNELS
+    C_values = C_VALUES
+    gamma_values = GAMMA_VALUES
+    class_weight = None
+    folds = 5
+    scoring = 'accuracy'
+    n_jobs = -1
+    seed = 0
+    output_file_path = ""
+    try:
+        opts, args = getopt.getopt(argv, "ht:d:v:ak:c:g:bn:s:j:r:o:",
+                                   ["training=", "dir=", "version=", "activate", "kernels=", "C=", "gamma=",
+                                    "balanced", "folds=", "scoring=", "jobs=", "seed=", "output="])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit()
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__doc__)
+                sys.exit()
+            if opt in ("-t", "--training"):
+                training_file_path = arg
+            if opt in ("-d", "--dir"):
+                registry_dir = arg
+            if opt in ("-v", "--version"):
+                version = arg
+            if opt in ("-a", "--activate"):
+                activate = True
+            if opt in ("-k", "--kernels"):
+                kernels = _values(arg, str)
+            if opt in ("-c", "--C"):
+                C_values = _values(arg)
+            if opt in ("-g", "--gamma"):
+                gamma_values = _values(arg)
+            if opt in ("-b", "--balanced"):
+                class_weight = 'balanced'
+            if opt in ("-n", "--folds"):
+                folds = int(arg)
+            if opt in ("-s", "--scoring"):
+                scoring = arg
+            if opt in ("-j", "--jobs"):
+                n_jobs = int(arg)
+            if opt in ("-r", "--seed"):
+                seed = int(arg)
+            if opt in ("-o", "--output"):
+                output_file_path = arg
+    except ValueError as e:
+        print(__doc__ + "\n   Error: %s" % e)
+        sys.exit()
+
+    version, results = train(training_file_path, registry_dir, version, activate, kernels, C_values, gamma_values,
+                             folds, scoring, class_weight, n_jobs, seed)
+    for result in results[:5]:
+        print("%-6s C=%-6g gamma=%-7s %s %.4f +/- %.4f" % (result['kernel'], result['C'], result['gamma'], scoring,
+                                                        result['mean_score'], result['std_score']))
+    print(("registered and activated " if activate else "registered ") + version)
+    if output_file_path:
+        with open(output_file_path, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,154 @@
+"""Incremental parsing of peptide uploads.
+
+An upload body is plain text with one peptide per line, or FASTA, either of
+them optionally gzip-compressed. The body is read from a file-like stream
+(``request`` itself in a view) a block at a time, inflated and split into
+lines as it arrives, and handed on in chunks of peptides, so memory stays
+bounded by one block, one chunk and the longest peptide whatever the size of
+the upload.
+
+The format is detected from the data: gzip by its magic bytes, FASTA by a
+first non-blank line starting with ``>``.
+"""
+import codecs
+import zlib
+
+try:
+    from apis import features
+except ImportError:
+    import features
+
+BLOCK_SIZE = 64 * 1024
+# Longest peptide accepted, in residues; longer records are reported as errors.
+MAX_PEPTIDE_LENGTH = 10000
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class UploadError(ValueError):
+    pass
+
+
+def iter_blocks(stream, block_size=BLOCK_SIZE):
+    """Raw blocks of ``stream`` until it is exhausted."""
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+def iter_inflated(blocks, block_size=BLOCK_SIZE):
+    """``blocks`` decompressed if they start with the gzip magic, else unchanged.
+
+    At most ``block_size`` bytes are inflated at a time, so a small body that
+    inflates to a huge one is still read in bounded steps. Concatenated gzip
+    members, as ``gzip`` appends or ``csvwriter`` checkpoints write them, are
+    inflated one after another.
+    """
+    blocks = iter(blocks)
+    first = b''
+    for block in blocks:
+        first += block
+        if len(first) >= len(GZIP_MAGIC):
+            break
+    if not first.startswith(GZIP_MAGIC):
+        if first:
+            yield first
+        yield from blocks
+        return
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    fed = False
+    data = first
+    while data is not None:
+        try:
+            while data:
+                fed = True
+                inflated = inflater.decompress(data, block_size)
+                if inflated:
+                    yield inflated
+                if inflater.eof:
+                    # The next member starts right after this one.
+                    data = inflater.unused_data
+                    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    fed = False
+                else:
+                    data = inflater.unconsumed_tail
+        except zlib.error as e:
+            raise UploadError("The upload is not valid gzip: %s" % e)
+        data = next(blocks, None)
+    if fed:
+        raise UploadError("The gzip upload is truncated")
+
+
+def iter_lines(blocks, encoding='ascii'):
+    """Text lines of byte ``blocks``, without line endings."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    rest = ''
+    for block in blocks:
+        text = rest + decoder.decode(block)
+        lines = text.split('\n')
+        rest = lines.pop()
+        if len(rest) > MAX_PEPTIDE_LENGTH + 1024:
+            raise UploadError("A line of the upload is longer than %d characters" % (MAX_PEPTIDE_LENGTH + 1024))
+        for line in lines:
+            yield line.rstrip('\r')
+    rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest.rstrip('\r')
+
+
+def iter_records(lines):
+    """``(id, sequence)`` of plain or FASTA ``lines``; plain peptides are numbered from 1.
+
+    FASTA sequences may span lines. A sequence longer than
+    ``MAX_PEPTIDE_LENGTH`` is cut off there and fails ``check_record``.
+    """
+    fasta = None
+    header, parts, length = None, [], 0
+    number = 0
+    for line in lines:
+        if fasta is None:
+            if not line.strip():
+                continue
+            fasta = line.startswith('>')
+        if not fasta:
+            if line.strip():
+                number += 1
+                yield str(number), line
+            continue
+        if line.startswith('>'):
+            if header is not None:
+                yield header, ''.join(parts)
+            header, parts, length = line[1:].strip() or str(number + 1), [], 0
+            number += 1
+        elif length <= MAX_PEPTIDE_LENGTH:
+            parts.append(line)
+            length += len(line)
+    if fasta and header is not None:
+        yield header, ''.join(parts)
+
+
+def check_record(sequence):
+    """The cleaned sequence, or ``ValueError`` if it cannot be featurized."""
+    sequence = features.check_sequence(features.clean_sequence(sequence))
+    if len(sequence) > MAX_PEPTIDE_LENGTH:
+        raise ValueError("Peptide sequences may have at most %d residues" % MAX_PEPTIDE_LENGTH)
+    return sequence
+
+
+def iter_chunks(records, chunk_size):
+    """Lists of at most ``chunk_size`` records."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_upload(stream, chunk_size, block_size=BLOCK_SIZE):
+    """Chunks of ``(id, sequence)`` records parsed from ``stream`` as it is read."""
+    return iter_chunks(iter_records(iter_lines(iter_inflated(iter_blocks(stream, block_size)))), chunk_size)
@@ -1,9 +1,24 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from apis.models import Car
+from apis.models import Car, Peptide
+from apis.admission import Overloaded, admission_metrics, get_controller, get_job_queue, request_cost
+from apis.features import check_sequence, clean_sequence, families_for_columns
+from apis.batching import batching_metrics, get_batcher
+from apis.executors import get_executor, run_cpu_bound
+from apis.prediction import iter_csv, iter_json, iter_ndjson, join_predictions, predict_with_model_path
+from apis.registry import get_registry
+from apis.response_cache import cache_metrics, cache_response, cached, response_key
+from apis.mutation import scan_mutants
+from apis.neighbours import get_index
+from apis.planner import plan, planner_metrics, sequences_workload
+from apis.upload import UploadError, check_record, iter_upload
+from apis.window import scan_proteins
+import asyncio
 import json
-# from prediction import perform_prediction
 
 def index(request):
     response = json.dumps([{}])
@@ -32,6 +47,403 @@ def add_car(request):
             response = json.dumps([{'Error': 'Car could not be added!'}])
     return HttpResponse(response, content_type='text/json')
 
+def lookup_peptides(sequences, version):
+    """Split ``sequences`` into stored predictions and work still to do.
+
+    Returns ``(hashes, stored, missing)`` where ``stored`` maps sequence hash
+    to ``Peptide`` for model ``version`` and ``missing`` maps the remaining
+    hashes to their sequence.
+    """
+    sequences = [check_sequence(clean_sequence(seq)) for seq in sequences]
+    hashes = [Peptide.hash_sequence(seq) for seq in sequences]
+    stored = Peptide.objects.lookup(hashes, version)
+
+    missing = {}
+    for seq, seq_hash in zip(sequences, hashes):
+        if seq_hash not in stored:
+            missing[seq_hash] = seq
+    return hashes, stored, missing
+
+def store_peptides(stored, missing, labels, scores, version):
+    if scores is None:
+        scores = [None] * len(labels)
+    new = [Peptide(sequence=seq, sequence_hash=seq_hash, model_version=version,
+                   label=label, decision_score=score)
+           for (seq_hash, seq), label, score in zip(missing.items(), labels, scores)]
+    Peptide.objects.bulk_create(new, batch_size=settings.BIP_STORE_BATCH_SIZE, ignore_conflicts=True)
+    stored.update((peptide.sequence_hash, peptide) for peptide in new)
+
+def prediction_calls(served, sequences):
+    """``(kind, func, args)`` calls predicting ``sequences``, whose results join in order.
+
+    ``kind`` is the executor of ``BIP_EXECUTOR``, or with ``'auto'`` the one
+    the planner picks for the job, which then also sets the chunk size; planned
+    process jobs are split into one call per chunk so that they spread over
+    the process pool.
+    """
+    kind, chunk_rows, workers = settings.BIP_EXECUTOR, served.chunk_rows, served.workers
+    if kind == 'auto':
+        job = plan(*sequences_workload(sequences), families_for_columns(served.columns), True,
+                   settings.BIP_EXECUTOR_WORKERS)
+        kind, chunk_rows = job.mode, job.chunk_rows
+    if kind == 'inline':
+        return [(kind, predict_with_model_path, (served.path, sequences, served.columns, served.mmap_mode, None, None,
+                                                 served.sparse, served.dtype))]
+    if kind == 'process' and settings.BIP_EXECUTOR == 'auto':
+        return [(kind, predict_with_model_path, (served.path, sequences[start:start + chunk_rows], served.columns,
+                                                 served.mmap_mode, None, 1, served.sparse, served.dtype))
+                for start in range(0, len(sequences), chunk_rows)]
+    return [(kind, predict_with_model_path, (served.path, sequences, served.columns, served.mmap_mode, chunk_rows,
+                                             workers, served.sparse, served.dtype))]
+
+def predict_peptides(sequences, served=None):
+    """Return one stored or freshly computed ``Peptide`` per sequence.
+
+    Sequences already predicted by the current model version are answered
+    from the store; the rest are featurized and predicted together and
+    written back with ``bulk_create``. A lone new peptide goes through the
+    micro-batcher so concurrent single-peptide requests share a model call.
+    The whole call is served by one model version (``served``, by default
+    the current one) even if a newer one is swapped in meanwhile. Process
+    calls of ``prediction_calls`` run in the process pool, the others in
+    this thread, which is already a worker of its own.
+    """
+    if served is None:
+        served = get_registry().current()
+    hashes, stored, missing = lookup_peptides(sequences, served.version)
+    if len(missing) == 1 and settings.BIP_MICRO_BATCHING:
+        label, score = get_batcher(served).predict(*missing.values())
+        store_peptides(stored, missing, [label], [score], served.version)
+    elif missing:
+        calls = prediction_calls(served, list(missing.values()))
+        futures = [get_executor(kind).submit(func, *args) for kind, func, args in calls if kind == 'process']
+        if futures:
+            labels, scores = join_predictions(future.result() for future in futures)
+        else:
+            labels, scores = join_predictions(func(*args) for _, func, args in calls)
+        store_peptides(stored, missing, labels, scores, served.version)
+    return [stored[seq_hash] for seq_hash in hashes]
+
+async def apredict_peptides(sequences, served=None):
+    """Async ``predict_peptides``: inline calls of ``prediction_calls`` run here, the others in their executor."""
+    if served is None:
+        served = await sync_to_async(get_registry().current)()
+    hashes, stored, missing = await sync_to_async(lookup_peptides)(sequences, served.version)
+    if len(missing) == 1 and settings.BIP_MICRO_BATCHING:
+        label, score = await asyncio.wrap_future(get_batcher(served).submit(*missing.values()))
+        await sync_to_async(store_peptides)(stored, missing, [label], [score], served.version)
+    elif missing:
+        calls = prediction_calls(served, list(missing.values()))
+        if calls[0][0] == 'inline':
+            labels, scores = join_predictions(func(*args) for _, func, args in calls)
+        else:
+            labels, scores = join_predictions(await asyncio.gather(*(run_cpu_bound(func, *args, kind=kind)
+                                                                     for kind, func, args in calls)))
+        await sync_to_async(store_peptides)(stored, missing, labels, scores, served.version)
+    return [stored[seq_hash] for seq_hash in hashes]
+
+def metrics(request):
+    served = get_registry().current()
+    response = json.dumps({'model': {'version': served.version, 'path': served.path},
+                           'batching': batching_metrics(), 'admission': admission_metrics(),
+                           'response_cache': cache_metrics(), 'planner': planner_metrics()})
+    return HttpResponse(response, content_type='text/json')
+
+PREDICTION_COLUMNS = ['Peptide sequence', 'Biofilm inhibitor', 'Decision score', 'Model version']
+
+def peptide_record(peptide):
+    return dict(zip(PREDICTION_COLUMNS, [peptide.sequence, peptide.label, peptide.decision_score, peptide.model_version]))
+
+def iter_predictions(sequences):
+    """Predict ``sequences`` chunk by chunk, yielding records as soon as each chunk is done.
+
+    Each chunk waits for admission on its own, so a long stream or job
+    never holds more than one chunk's worth of capacity.
+    """
+    chunk_size = settings.BIP_STREAM_CHUNK_SIZE
+    controller = get_controller()
+    for start in range(0, len(sequences), chunk_size):
+        chunk = sequences[start:start + chunk_size]
+        with controller.admit(request_cost(chunk), timeout=None, bounded=False):
+            peptides = predict_peptides(chunk)
+        for peptide in peptides:
+            yield peptide_record(peptide)
+
+UPLOAD_COLUMNS = ['ID'] + PREDICTION_COLUMNS + ['Error']
+
+def upload_record(peptide_id, sequence, peptide=None, error=None):
+    record = dict.fromkeys(UPLOAD_COLUMNS)
+    if peptide is not None:
+        record.update(peptide_record(peptide))
+    record.update({'ID': peptide_id, 'Peptide sequence': sequence, 'Error': error})
+    return record
+
+def iter_upload_predictions(chunks):
+    """Predict each chunk of ``(id, sequence)`` records as soon as it has been parsed.
+
+    Peptides that cannot be featurized get a record with an ``Error`` instead
+    of failing the whole upload; an unreadable body ends the stream with one.
+    """
+    controller = get_controller()
+    try:
+        for chunk in chunks:
+            sequences, errors = {}, {}
+            for position, (peptide_id, sequence) in enumerate(chunk):
+                try:
+                    sequences[position] = check_record(sequence)
+                except ValueError as e:
+                    errors[position] = str(e)
+            with controller.admit(request_cost(sequences.values()), timeout=None, bounded=False):
+                peptides = dict(zip(sequences, predict_peptides(list(sequences.values())))) if sequences else {}
+            for position, (peptide_id, sequence) in enumerate(chunk):
+                if position in peptides:
+                    yield upload_record(peptide_id, sequences[position], peptides[position])
+                else:
+                    yield upload_record(peptide_id, sequence, error=errors[position])
+    except UploadError as e:
+        yield upload_record(None, None, error=str(e))
+
+def run_prediction_job(sequences):
+    try:
+        return list(iter_predictions(sequences))
+    finally:
+        connection.close()
+
+def overloaded(e):
+    response = HttpResponse(json.dumps([{'Error': str(e)}]), content_type='text/json', status=429)
+    response['Retry-After'] = str(e.retry_after)
+    return response
+
+def job_accepted(sequences):
+    """Queue an oversized prediction request as a job and answer 202 with where to fetch it."""
+    job_id = get_job_queue().submit(run_prediction_job, sequences)
+    location = '/jobs/' + job_id
+    response = HttpResponse(json.dumps([{'Job': job_id, 'Status': 'queued', 'Location': location}]),
+                            content_type='text/json', status=202)
+    response['Location'] = location
+    return response
+
+def job(request, job_id):
+    found = get_job_queue().get(job_id)
+    if found is None:
+        response = json.dumps([{'Error': 'No job with that id'}])
+    elif found['status'] == 'failed':
+        response = json.dumps([{'Job': job_id, 'Status': 'failed', 'Error': found['error']}])
+    else:
+        response = json.dumps([{'Job': job_id, 'Status': found['status'], 'Results': found['result']}])
+    return HttpResponse(response, content_type='text/json')
+
+def response_format(request):
+    """Pick ``json``, ``ndjson`` or ``csv`` from ``?format=`` or the Accept header."""
+    requested = request.GET.get('format')
+    if requested is None:
+        accept = request.META.get('HTTP_ACCEPT', '')
+        if 'application/x-ndjson' in accept:
+            requested = 'ndjson'
+        elif 'text/csv' in accept:
+            requested = 'csv'
+    return requested or 'json'
+
+@csrf_exempt
+def predict(request):
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body)
+            sequences = [check_sequence(clean_sequence(seq)) for seq in payload['peptides']]
+            cost = request_cost(sequences)
+            controller = get_controller()
+            fmt = response_format(request)
+            if fmt in ('ndjson', 'csv'):
+                controller.check(cost)
+            if fmt == 'ndjson':
+                return StreamingHttpResponse(iter_ndjson(iter_predictions(sequences)), content_type='application/x-ndjson')
+            if fmt == 'csv':
+                return StreamingHttpResponse(iter_csv(iter_predictions(sequences), PREDICTION_COLUMNS), content_type='text/csv')
+            served = get_registry().current()
+            key = response_key('predict', sequences, served.version)
+            response = cached(request, key)
+            if response is not None:
+                return response
+            if cost > settings.BIP_ADMISSION_JOB_COST:
+                return job_accepted(sequences)
+            with controller.admit(cost):
+                return cache_response(key, json.dumps([peptide_record(p) for p in predict_peptides(sequences, served)]))
+        except Overloaded as e:
+            return overloaded(e)
+        except (KeyError, TypeError, AttributeError):
+            response = json.dumps([{'Error': 'Expected a JSON body with a "peptides" list'}])
+        except ValueError as e:
+            response = json.dumps([{'Error': str(e)}])
+    else:
+        response = json.dumps([{'Error': 'Use POST with a JSON body with a "peptides" list'}])
+    return HttpResponse(response, content_type='text/json')
+
+@csrf_exempt
+def scan(request):
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body)
+            proteins = [clean_sequence(protein) for protein in payload['proteins']]
+            window = int(payload['window'])
+            served = get_registry().current()
+            fmt = response_format(request)
+            key = response_key('scan', {'proteins': proteins, 'window': window}, served.version)
+            if fmt != 'ndjson':
+                response = cached(request, key)
+                if response is not None:
+                    return response
+            with get_controller().admit(request_cost(proteins)):
+                tracks = scan_proteins(served.model, proteins, window, served.columns)
+            records = [{'Protein': protein, 'Window': window, 'Model version': served.version,
+                        'Track': [{'Position': position, 'Biofilm inhibitor': label, 'Decision score': score}
+                                  for position, label, score in track]}
+                       for protein, track in zip(proteins, tracks)]
+            if fmt == 'ndjson':
+                return HttpResponse(''.join(iter_ndjson(records)), content_type='application/x-ndjson')
+            return cache_response(key, json.dumps(records))
+        except Overloaded as e:
+            return overloaded(e)
+        except (KeyError, TypeError, AttributeError):
+            response = json.dumps([{'Error': 'Expected a JSON body with a "proteins" list and a "window" length'}])
+        except ValueError as e:
+            response = json.dumps([{'Error': str(e)}])
+    else:
+        response = json.dumps([{'Error': 'Use POST with a JSON body with a "proteins" list and a "window" length'}])
+    return HttpResponse(response, content_type='text/json')
+
+@csrf_exempt
+def mutants(request):
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body)
+            peptide = clean_sequence(payload['peptide'])
+            if len(peptide) > settings.BIP_MUTANTS_MAX_LENGTH:
+                raise ValueError("Peptides may have at most %d residues for a mutant scan" % settings.BIP_MUTANTS_MAX_LENGTH)
+            top = payload.get('top')
+            if top is not None:
+                top = int(top)
+            served = get_registry().current()
+            key = response_key('mutants', {'peptide': peptide, 'top': top}, served.version)
+            response = cached(request, key)
+            if response is not None:
+                return response
+            # 19 single-point mutants per residue, each as long as the peptide.
+            with get_controller().admit(19 * len(peptide) ** 2):
+                results = scan_mutants(served.model, peptide, served.columns)
+            if top is not None:
+                results = results[:top]
+            return cache_response(key, json.dumps([{'Position': r['position'], 'Original': r['original'], 'Substitute': r['substitute'],
+                                    'Peptide sequence': r['sequence'], 'Biofilm inhibitor': r['label'],
+                                    'Decision score': r['score'], 'Model version': served.version}
+                                   for r in results]))
+        except Overloaded as e:
+            return overloaded(e)
+        except (KeyError, TypeError, AttributeError):
+            response = json.dumps([{'Error': 'Expected a JSON body with a "peptide" sequence'}])
+        except ValueError as e:
+            response = json.dumps([{'Error': str(e)}])
+    else:
+        response = json.dumps([{'Error': 'Use POST with a JSON body with a "peptide" sequence'}])
+    return HttpResponse(response, content_type='text/json')
+
+@csrf_exempt
+def neighbours(request):
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body)
+            sequences = [check_sequence(clean_sequence(seq)) for seq in payload['peptides']]
+            k = int(payload.get('k', settings.BIP_NEIGHBOURS))
+            if not 1 <= k <= settings.BIP_NEIGHBOURS_MAX:
+                raise ValueError("k must be between 1 and %d" % settings.BIP_NEIGHBOURS_MAX)
+            with get_controller().admit(request_cost(sequences)):
+                results = get_index().query(sequences, k)
+            response = json.dumps([{'Peptide sequence': r['sequence'],
+                                    'Training match': r['exact'] and {'ID': r['exact']['id'], 'Label': r['exact']['label']},
+                                    'Neighbours': [{'ID': n['id'], 'Label': n['label'], 'Similarity': n['similarity']}
+                                                   for n in r['neighbours']]}
+                                   for r in results])
+        except Overloaded as e:
+            return overloaded(e)
+        except (KeyError, TypeError, AttributeError):
+            response = json.dumps([{'Error': 'Expected a JSON body with a "peptides" list'}])
+        except ValueError as e:
+            response = json.dumps([{'Error': str(e)}])
+    else:
+        response = json.dumps([{'Error': 'Use POST with a JSON body with a "peptides" list'}])
+    return HttpResponse(response, content_type='text/json')
+
+@csrf_exempt
+def predict_upload(request):
+    """Predict a peptide file POSTed as the raw body: plain, FASTA, or either gzip-compressed.
+
+    The body is read and parsed a block at a time while the response streams,
+    so the file is never held in memory and prediction overlaps the upload
+    (under ASGI Django spools the body to a temporary file first).
+    """
+    if request.method == 'POST':
+        try:
+            get_controller().check()
+        except Overloaded as e:
+            return overloaded(e)
+        records = iter_upload_predictions(iter_upload(request, settings.BIP_STREAM_CHUNK_SIZE,
+                                                      settings.BIP_UPLOAD_BLOCK_SIZE))
+        fmt = response_format(request)
+        if fmt == 'ndjson':
+            return StreamingHttpResponse(iter_ndjson(records), content_type='application/x-ndjson')
+        if fmt == 'csv':
+            return StreamingHttpResponse(iter_csv(records, UPLOAD_COLUMNS), content_type='text/csv')
+        return StreamingHttpResponse(iter_json(records), content_type='text/json')
+    response = json.dumps([{'Error': 'Use POST with a plain, FASTA or gzip peptide file as the body'}])
+    return HttpResponse(response, content_type='text/json')
+
+async def aiter_predictions(sequences, fmt):
+    """Async counterpart of ``iter_predictions`` that yields formatted ndjson or csv text."""
+    chunk_size = settings.BIP_STREAM_CHUNK_SIZE
+    admit = sync_to_async(get_controller().admit, thread_sensitive=False)
+    for start in range(0, len(sequences), chunk_size):
+        chunk = sequences[start:start + chunk_size]
+        with await admit(request_cost(chunk), timeout=None, bounded=False):
+            records = [peptide_record(p) for p in await apredict_peptides(chunk)]
+        if fmt == 'csv':
+            yield ''.join(iter_csv(records, PREDICTION_COLUMNS, header=start == 0))
+        else:
+            yield ''.join(iter_ndjson(records))
+
+@csrf_exempt
+async def predict_async(request):
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body)
+            sequences = [check_sequence(clean_sequence(seq)) for seq in payload['peptides']]
+            cost = request_cost(sequences)
+            controller = get_controller()
+            fmt = response_format(request)
+            if fmt in ('ndjson', 'csv'):
+                controller.check(cost)
+            if fmt == 'ndjson':
+                return StreamingHttpResponse(aiter_predictions(sequences, fmt), content_type='application/x-ndjson')
+            if fmt == 'csv':
+                return StreamingHttpResponse(aiter_predictions(sequences, fmt), content_type='text/csv')
+            served = await sync_to_async(get_registry().current)()
+            key = response_key('predict', sequences, served.version)
+            response = cached(request, key)
+            if response is not None:
+                return response
+            if cost > settings.BIP_ADMISSION_JOB_COST:
+                return job_accepted(sequences)
+            with await sync_to_async(controller.admit, thread_sensitive=False)(cost):
+                records = [peptide_record(p) for p in await apredict_peptides(sequences, served)]
+            return cache_response(key, json.dumps(records))
+        except Overloaded as e:
+            return overloaded(e)
+        except (KeyError, TypeError, AttributeError):
+            response = json.dumps([{'Error': 'Expected a JSON body with a "peptides" list'}])
+        except ValueError as e:
+            response = json.dumps([{'Error': str(e)}])
+    else:
+        response = json.dumps([{'Error': 'Use POST with a JSON body with a "peptides" list'}])
+    return HttpResponse(response, content_type='text/json')
+
 # @csrf_exempt
 # def add_car(request):
 #     if request.method == 'POST':
@@ -0,0 +1,256 @@
+"""Sliding-window scanning of long proteins for biofilm-inhibitory windows.
+
+Every ``window``-residue stretch of a protein is featurized exactly as
+``features.calculate_features`` would featurize it on its own, but the AAC
+and DPC counts and the CTD composition, transition and position state are
+updated incrementally as the window slides one residue at a time, so a
+protein of length L costs O(L) updates instead of O(L*w) recounts.
+"""
+from bisect import bisect_left
+from collections import Counter
+
+try:
+    from apis import AAC1, CTD1, features
+except ImportError:
+    import AAC1
+    import CTD1
+    import features
+
+AALetter = AAC1.AALetter
+_CLASSES = ('1', '2', '3')
+_PAIRS = (('1', '2'), ('1', '3'), ('2', '3'))
+
+
+def _ctd_properties():
+    """``(name, residue -> class)`` of every CTD property, from ``features._CTD_PROPERTIES``."""
+    return [(composition[0][:-2], {chr(aa): c for aa, c in table.items()})
+            for table, composition, _, _ in features._CTD_PROPERTIES]
+
+
+def distribution(result, name, c, num, cds, length):
+    """Fill the CTD distribution values of class ``c`` into ``result``.
+
+    ``cds(k)`` returns the 1-based position of the k-th occurrence of the
+    class (0 <= k < num). The indexing follows CTD1.CalculateDistribution,
+    including its wrap-around to the last occurrence when floor(num*q) is 0.
+    """
+    if num == 0:
+        for suffix in ('001', '025', '050', '075', '100'):
+            result[name + 'D' + c + suffix] = 0
+        return
+    result[name + 'D' + c + '001'] = round(float(cds(0)) / length * 100, 3)
+    result[name + 'D' + c + '025'] = round(float(cds((int(num * 0.25) - 1) % num)) / length * 100, 3)
+    result[name + 'D' + c + '050'] = round(float(cds((int(num * 0.5) - 1) % num)) / length * 100, 3)
+    result[name + 'D' + c + '075'] = round(float(cds((int(num * 0.75) - 1) % num)) / length * 100, 3)
+    result[name + 'D' + c + '100'] = round(float(cds(num - 1)) / length * 100, 3)
+
+
+class _PropertyState:
+    """Composition, transition and position state of one CTD property."""
+
+    def __init__(self, name, classes, protein):
+        self.name = name
+        self.classes = [classes.get(aa) for aa in protein]
+        self.positions = {c: [i for i, k in enumerate(self.classes) if k == c] for c in _CLASSES}
+        self.counts = Counter()
+        self.pairs = Counter()
+
+    def add(self, i, start):
+        c = self.classes[i]
+        self.counts[c] += 1
+        if i > start:
+            self.pairs[frozenset((self.classes[i - 1], c))] += 1
+
+    def remove(self, i, end):
+        c = self.classes[i]
+        self.counts[c] -= 1
+        if i + 1 < end:
+            self.pairs[frozenset((c, self.classes[i + 1]))] -= 1
+
+    def features(self, start, end, result):
+        name = self.name
+        length = end - start
+        for c in _CLASSES:
+            result[name + 'C' + c] = round(float(self.counts[c]) / length, 3)
+        for a, b in _PAIRS:
+            result[name + 'T' + a + b] = round(float(self.pairs[frozenset((a, b))]) / (length - 1), 3)
+        for c in _CLASSES:
+            positions = self.positions[c]
+            lo = bisect_left(positions, start)
+            hi = bisect_left(positions, end, lo)
+            num = hi - lo
+            distribution(result, name, c, num, lambda k: positions[lo + k] - start + 1, length)
+
+
+class WindowScanner:
+    """Incrementally featurize every ``window``-residue window of ``protein``."""
+
+    def __init__(self, protein, window, families=features.ALL_FAMILIES):
+        protein = features.clean_sequence(protein)
+        if window < 2 or window > len(protein):
+            raise ValueError("Window length must be between 2 and the protein length (%d), not %d"
+                             % (len(protein), window))
+        self.protein = protein
+        self.window = window
+        self.families = tuple(families)
+        # Runs of identical residues, needed because DPC counts
+        # homodipeptides like str.count, i.e. without overlaps ("AAA" holds
+        # one "AA"): run_start[i] and run_stop[i] bound the run containing i.
+        n = len(protein)
+        self.run_start = [0] * n
+        self.run_stop = [n - 1] * n
+        for i in range(1, n):
+            self.run_start[i] = self.run_start[i - 1] if protein[i] == protein[i - 1] else i
+        for i in range(n - 2, -1, -1):
+            self.run_stop[i] = self.run_stop[i + 1] if protein[i] == protein[i + 1] else i
+        self.properties = [_PropertyState(name, classes, protein) for name, classes in _ctd_properties()] \
+            if 3 in self.families else []
+
+    def __iter__(self):
+        """Yield ``(start, features)`` for each window, ``start`` being 0-based."""
+        protein, window = self.protein, self.window
+        aa = Counter(protein[:window])
+        dipeptides = Counter(protein[i:i + 2] for i in range(window - 1) if protein[i] != protein[i + 1])
+        for i in range(window):
+            if i + 1 == window or protein[i + 1] != protein[i]:
+                dipeptides[protein[i] * 2] += (i - self.run_start[i] + 1) // 2
+        for state in self.properties:
+            for i in range(window):
+                state.add(i, 0)
+
+        for start in range(len(protein) - window + 1):
+            end = start + window
+            if start:
+                self._slide(start - 1, end - 1, aa, dipeptides)
+            yield start, self._features(start, end, aa, dipeptides)
+
+    def _slide(self, old_start, old_end, aa, dipeptides):
+        """Move the window from ``[old_start, old_end)`` one residue to the right."""
+        protein = self.protein
+        left, right = protein[old_start], protein[old_end]
+
+        # Drop the leftmost residue.
+        aa[left] -= 1
+        nxt = protein[old_start + 1]
+        if nxt != left:
+            dipeptides[left + nxt] -= 1
+        else:
+            run = min(self.run_stop[old_start], old_end - 1) - old_start + 1
+            dipeptides[left * 2] += (run - 1) // 2 - run // 2
+        for state in self.properties:
+            state.remove(old_start, old_end)
+
+        # Add the new rightmost residue.
+        aa[right] += 1
+        prev = protein[old_end - 1]
+        if prev != right:
+            dipeptides[prev + right] += 1
+        else:
+            run = old_end - max(self.run_start[old_end - 1], old_start + 1)
+            dipeptides[right * 2] += (run + 1) // 2 - run // 2
+        for state in self.properties:
+            state.add(old_end, old_start + 1)
+
+    def _features(self, start, end, aa, dipeptides):
+        length = end - start
+        result = {}
+        if 1 in self.families:
+            for i in AALetter:
+                result[i] = round(float(aa[i]) / length * 100, 3)
+        if 2 in self.families:
+            for i in AALetter:
+                for j in AALetter:
+                    result[i + j] = round(float(dipeptides[i + j]) / (length - 1) * 100, 2)
+        for state in self.properties:
+            state.features(start, end, result)
+        return result
+
+
+def scan_rows(protein, window, columns):
+    """Return ``(starts, rows)`` with one feature row per window, ordered by ``columns``."""
+    starts, rows = [], []
+    for start, result in WindowScanner(protein, window, features.families_for_columns(columns)):
+        starts.append(start)
+        rows.append([result[column] for column in columns])
+    return starts, rows
+
+
+def scan_proteins(model, proteins, window, columns=None, profiler=None, dtype=None):
+    """Score every window of every protein with one batched predict per protein, as a ``dtype`` matrix.
+
+    Returns one track per protein: a list of ``(position, label, score)``
+    with 1-based window start positions, empty for a protein shorter than
+    ``window``.
+    """
+    try:
+        from apis import prediction, profiling
+    except ImportError:
+        import prediction
+        import profiling
+
+    profiler = profiler or profiling.NULL
+    if columns is None:
+        columns = prediction.model_columns(model)
+    tracks = []
+    for protein in proteins:
+        if len(protein) < window:
+            tracks.append([])
+            continue
+        with profiler.stage('featurize'):
+            starts, rows = scan_rows(protein, window, columns)
+        with profiler.stage('predict'):
+            labels, scores = prediction.predict_rows(model, rows, columns, dtype)
+        if scores is None:
+            scores = [None] * len(labels)
+        tracks.append([(start + 1, label, score) for start, label, score in zip(starts, labels, scores)])
+    return tracks
+
+
+def scan_file(SVM_joblib_file_path, input_file_path, output_file_path, window, resume=False, profiler=None,
+              chunk_proteins=64, dtype=None):
+    """``biofilm.py -w``: write the per-position score track of each protein in a file.
+
+    The output is checkpointed every few chunks of ``chunk_proteins``
+    proteins; ``resume`` continues an interrupted scan (see ``checkpoint``).
+    Windows are predicted from ``dtype`` feature matrices, float64 by default.
+    Proteins shorter than ``window`` have no windows; they are reported on
+    stderr and skipped.
+    """
+    import sys
+
+    try:
+        from apis import checkpoint, prediction, profiling
+    except ImportError:
+        import checkpoint
+        import prediction
+        import profiling
+
+    profiler = profiler or profiling.NULL
+    with profiler.stage('load model'):
+        model = prediction.load_model(SVM_joblib_file_path)
+    with profiler.stage('read'):
+        with open(input_file_path) as f:
+            proteins = [features.clean_sequence(line) for line in f if line.strip()]
+    params = {'input': checkpoint.input_fingerprint(input_file_path),
+              'model': checkpoint.input_fingerprint(SVM_joblib_file_path), 'window': window,
+              'chunk_proteins': chunk_proteins, 'dtype': dtype}
+    with checkpoint.CheckpointedOutput(output_file_path, params, resume, compress=False) as out:
+        profiler.start(len(proteins), min(out.chunks * chunk_proteins, len(proteins)))
+        if not out.resumed:
+            out.write("protein,position,window,label,score\n")
+        for start in range(out.chunks * chunk_proteins, len(proteins), chunk_proteins):
+            chunk = proteins[start:start + chunk_proteins]
+            tracks = scan_proteins(model, chunk, window, profiler=profiler, dtype=dtype)
+            with profiler.stage('format'):
+                lines = []
+                for index, (protein, track) in enumerate(zip(chunk, tracks), start + 1):
+                    if not track:
+                        sys.stderr.write("Protein %d has %d residues, fewer than the window of %d; skipped\n"
+                                         % (index, len(protein), window))
+                    for position, label, score in track:
+                        lines.append("%d,%d,%s,%s,%s\n" % (index, position,
+                                                           protein[position - 1:position - 1 + window], label, score))
+            with profiler.stage('write'):
+                out.write(''.join(lines))
+                out.commit()
+            profiler.count(len(chunk))